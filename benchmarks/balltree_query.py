@@ -0,0 +1,148 @@
+"""Benchmark for assigning frames to their nearest cluster centers
+through a BallTree index over the centers.
+
+Compares `BallTree.query` to `assign_to_nearest_center`, which uses
+libdist's native kernels (with triangle-inequality pruning, when the
+table of center-center distances fits in memory), for RMSD between
+frames of a synthetic protein and for euclidean distance between their
+flattened coordinates. Two kinds of data are generated: 'walk', a random
+walk in which each frame is a small perturbation of the last (like an
+MD trajectory), with centers drawn from its frames; and 'blobs',
+unstructured, well-separated centers with frames scattered tightly
+around them. Also times `assign_to_nearest_center` given the tree as its
+`index`, which queries the tree only where it judges that to be faster
+(see `BallTree.prunes_well`). Times exclude building the tree, which is
+done once per clustering. For each number of centers, reports the best
+of several repeats, the speedup over `assign_to_nearest_center` and
+whether the assignments agree. Run as
+``python benchmarks/balltree_query.py``; set OMP_NUM_THREADS to control
+the number of threads.
+"""
+
+import argparse
+import sys
+import time
+
+import mdtraj as md
+import numpy as np
+
+from enspara.cluster.balltree import BallTree
+from enspara.cluster.util import assign_to_nearest_center
+from enspara.geometry import libdist
+
+METHODS = ['assign', 'balltree', 'index']
+METRICS = ['rmsd', 'euclidean']
+
+
+def process_command_line(argv=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description=__doc__)
+    parser.add_argument(
+        '--n-frames', default=50000, type=int,
+        help="Number of frames to assign.")
+    parser.add_argument(
+        '--n-atoms', default=30, type=int,
+        help="Number of atoms per frame.")
+    parser.add_argument(
+        '--n-centers', default=[500, 2000, 5000], type=int, nargs='+',
+        help="Numbers of centers to benchmark.")
+    parser.add_argument(
+        '--data', default=['walk', 'blobs'], choices=['walk', 'blobs'],
+        nargs='+',
+        help="Kinds of synthetic data to benchmark.")
+    parser.add_argument(
+        '--leaf-size', default=8, type=int,
+        help="Number of centers in each leaf of the tree.")
+    parser.add_argument(
+        '--repeats', default=3, type=int,
+        help="Number of times to run each method; the best is reported.")
+    parser.add_argument(
+        '--seed', default=0, type=int)
+
+    return parser.parse_args(argv)
+
+
+def make_trajectory(xyz):
+    top = md.Topology()
+    residue = top.add_residue('ALA', top.add_chain())
+    for _ in range(xyz.shape[1]):
+        top.add_atom('CA', md.element.carbon, residue)
+
+    return md.Trajectory(xyz.astype(np.float32), top)
+
+
+def make_data(kind, n_frames, n_atoms, n_centers, random_state):
+    """Make frames and centers, as coordinates of shape (n, n_atoms, 3).
+    """
+
+    if kind == 'walk':
+        steps = random_state.normal(
+            scale=0.01, size=(n_frames, n_atoms, 3))
+        frames = np.cumsum(steps, axis=0)
+        centers = frames[np.sort(random_state.choice(
+            n_frames, n_centers, replace=False))]
+    elif kind == 'blobs':
+        centers = random_state.normal(size=(n_centers, n_atoms, 3))
+        frames = centers[random_state.randint(n_centers, size=n_frames)]
+        frames = frames + random_state.normal(
+            scale=0.05, size=frames.shape)
+
+    return frames, centers
+
+
+def main(argv=None):
+    args = process_command_line(argv)
+
+    random_state = np.random.RandomState(args.seed)
+
+    print("%s frames of %s atoms" % (args.n_frames, args.n_atoms))
+    print("%-6s %-10s %-8s %-9s %9s %8s" % (
+        'data', 'metric', 'centers', 'method', 'time (s)', 'speedup'))
+    for kind in args.data:
+        for n_centers in args.n_centers:
+            frames, centers = make_data(
+                kind, args.n_frames, args.n_atoms, n_centers, random_state)
+
+            for metric in METRICS:
+                if metric == 'rmsd':
+                    X, Y = make_trajectory(frames), make_trajectory(centers)
+                    distance_method = md.rmsd
+                else:
+                    X = frames.reshape(len(frames), -1)
+                    Y = centers.reshape(len(centers), -1)
+                    distance_method = libdist.euclidean
+
+                tree = BallTree(Y, distance_method, leaf_size=args.leaf_size)
+
+                expected = None
+                for method in METHODS:
+                    times = []
+                    for _ in range(args.repeats):
+                        # md.rmsd centers frames in place, so each
+                        # repeat gets its own copies.
+                        X_copy = X[:] if metric == 'rmsd' else X
+                        tick = time.perf_counter()
+                        if method == 'assign':
+                            assignments, _ = assign_to_nearest_center(
+                                X_copy, Y, distance_method)
+                        elif method == 'balltree':
+                            assignments, _ = tree.query(X_copy)
+                        elif method == 'index':
+                            assignments, _ = assign_to_nearest_center(
+                                X_copy, Y, distance_method, index=tree)
+                        times.append(time.perf_counter() - tick)
+
+                    if expected is None:
+                        expected, baseline = assignments, min(times)
+                    agreement = np.mean(assignments == expected)
+
+                    print("%-6s %-10s %-8s %-9s %9.3f %7.1fx%s" % (
+                        kind, metric, n_centers, method, min(times),
+                        baseline / min(times),
+                        '' if agreement == 1 else
+                        '  (%.4f%% disagree)' % (100 * (1 - agreement))))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
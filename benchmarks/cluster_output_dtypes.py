@@ -0,0 +1,122 @@
+"""Memory benchmark for compact clustering output dtypes.
+
+Partitions and saves a synthetic clustering result (int64 assignments
+and float64 distances, as produced by k-centers) with and without
+compact dtypes, then loads the saved files back as downstream analysis
+would. Reports the memory high-water mark of writing and of reading, and
+the size on disk, for each. Every step runs in a fresh process so that
+high-water marks are comparable. Run as
+``python benchmarks/cluster_output_dtypes.py``.
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+from enspara import ra
+from enspara.cluster.util import ClusterResult
+
+OUTPUTS = ['assignments', 'distances']
+
+
+def process_command_line(argv=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description=__doc__)
+    parser.add_argument(
+        '--n-frames', default=20000000, type=int,
+        help="Total number of clustered frames.")
+    parser.add_argument(
+        '--n-trajectories', default=1000, type=int,
+        help="Number of trajectories the frames are split into.")
+    parser.add_argument(
+        '--n-clusters', default=5000, type=int,
+        help="Number of clusters frames are assigned to.")
+    parser.add_argument(
+        '--seed', default=0, type=int)
+    parser.add_argument(
+        '--worker', choices=['exact', 'compact', 'read'], default=None,
+        help=argparse.SUPPRESS)
+    parser.add_argument(
+        '--output-dir', default=None, help=argparse.SUPPRESS)
+
+    return parser.parse_args(argv)
+
+
+def maxrss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def write_case(args):
+    random_state = np.random.RandomState(args.seed)
+
+    lengths = random_state.multinomial(
+        args.n_frames - args.n_trajectories,
+        np.ones(args.n_trajectories) / args.n_trajectories) + 1
+    result = ClusterResult(
+        assignments=random_state.randint(0, args.n_clusters,
+                                         size=args.n_frames),
+        distances=random_state.random_sample(args.n_frames),
+        center_indices=np.arange(args.n_clusters),
+        centers=None)
+
+    baseline = maxrss_mb()
+
+    result = result.partition(
+        lengths, compact_dtypes=(args.worker == 'compact'))
+    for name in OUTPUTS:
+        ra.save(os.path.join(args.output_dir, name + '.h5'),
+                getattr(result, name), layout='contiguous')
+
+    print("%.1f" % (maxrss_mb() - baseline))
+
+
+def read_case(args):
+    baseline = maxrss_mb()
+    # the high-water mark counts each array even after it's dropped
+    for name in OUTPUTS:
+        ra.load(os.path.join(args.output_dir, name + '.h5'))
+
+    print("%.1f" % (maxrss_mb() - baseline))
+
+
+def run_worker(worker, args, output_dir):
+    out = subprocess.check_output(
+        [sys.executable, __file__, '--worker', worker,
+         '--output-dir', output_dir,
+         '--n-frames', str(args.n_frames),
+         '--n-trajectories', str(args.n_trajectories),
+         '--n-clusters', str(args.n_clusters),
+         '--seed', str(args.seed)])
+    return out.decode().split()[-1]
+
+
+def main(argv=None):
+    args = process_command_line(argv)
+
+    if args.worker == 'read':
+        return read_case(args)
+    elif args.worker:
+        return write_case(args)
+
+    print("%s frames in %s trajectories, %s clusters" %
+          (args.n_frames, args.n_trajectories, args.n_clusters))
+    print("%-8s %16s %15s %13s" %
+          ('dtypes', 'write peak (MB)', 'read peak (MB)', 'on disk (MB)'))
+    for case in ['exact', 'compact']:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            write_rss = run_worker(case, args, tmpdir)
+            read_rss = run_worker('read', args, tmpdir)
+            size = sum(os.path.getsize(os.path.join(tmpdir, name + '.h5'))
+                       for name in OUTPUTS)
+        print("%-8s %16s %15s %13.1f" %
+              (case, write_rss, read_rss, size / 1024**2))
+
+
+if __name__ == '__main__':
+    main()
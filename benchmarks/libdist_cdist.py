@@ -0,0 +1,115 @@
+"""Benchmark for assigning points to their nearest centers with libdist.
+
+Compares the center-by-center loop (one call to `libdist.euclidean`, and
+one pass over the data, for each center) to the blocked many-to-many
+kernels `libdist.cdist`, which computes the full distance block, and
+`libdist.cdist_argmin`, which finds each point's nearest center and the
+distance to it in a single pass. The blocked kernels are run
+accumulating in both float64 and float32, and with triangle-inequality
+pruning (which helps little on the unstructured, high-dimensional
+points generated here). For each number of centers, reports the best of
+several repeats and the speedup over the loop. Run as
+``python benchmarks/libdist_cdist.py``; set OMP_NUM_THREADS to control
+the number of threads.
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from enspara.geometry import libdist
+
+METHODS = ['loop', 'cdist', 'cdist_argmin', 'cdist_argmin32', 'pruned']
+
+
+def process_command_line(argv=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description=__doc__)
+    parser.add_argument(
+        '--n-samples', default=200000, type=int,
+        help="Number of points to assign.")
+    parser.add_argument(
+        '--n-features', default=32, type=int,
+        help="Number of features per point.")
+    parser.add_argument(
+        '--n-centers', default=[10, 100, 1000], type=int, nargs='+',
+        help="Numbers of centers to benchmark.")
+    parser.add_argument(
+        '--dtype', default='float32',
+        help="Dtype of the points and centers.")
+    parser.add_argument(
+        '--repeats', default=3, type=int,
+        help="Number of times to run each method; the best is reported.")
+    parser.add_argument(
+        '--seed', default=0, type=int)
+
+    return parser.parse_args(argv)
+
+
+def loop_assign(X, Y):
+    """The center-by-center assignment that the blocked kernels replace."""
+
+    assignments = np.zeros(len(X), dtype=np.int64)
+    distances = np.full(len(X), np.inf)
+    d = np.empty(len(X))
+
+    for i, y in enumerate(Y):
+        libdist.euclidean(X, y, out=d)
+        inds = d < distances
+        distances[inds] = d[inds]
+        assignments[inds] = i
+
+    return assignments, distances
+
+
+def run_method(method, X, Y, out):
+    if method == 'loop':
+        return loop_assign(X, Y)
+    elif method == 'cdist':
+        d = libdist.cdist(X, Y, out=out)
+        return np.argmin(d, axis=1), np.min(d, axis=1)
+    elif method == 'cdist_argmin':
+        return libdist.cdist_argmin(X, Y)
+    elif method == 'cdist_argmin32':
+        return libdist.cdist_argmin(X, Y, dtype=np.float32)
+    elif method == 'pruned':
+        return libdist.cdist_argmin(X, Y, prune=True)
+
+
+def main(argv=None):
+    args = process_command_line(argv)
+
+    random_state = np.random.RandomState(args.seed)
+    X = random_state.normal(
+        size=(args.n_samples, args.n_features)).astype(args.dtype)
+
+    print("%s %s points with %s features" %
+          (args.n_samples, args.dtype, args.n_features))
+    print("%-8s %-15s %9s %8s" % ('centers', 'method', 'time (s)', 'speedup'))
+    for n_centers in args.n_centers:
+        Y = X[random_state.choice(len(X), n_centers, replace=False)]
+        out = np.empty((len(X), n_centers))
+
+        expected = None
+        for method in METHODS:
+            times = []
+            for _ in range(args.repeats):
+                tick = time.perf_counter()
+                assignments, _ = run_method(method, X, Y, out)
+                times.append(time.perf_counter() - tick)
+
+            if expected is None:
+                expected, baseline = assignments, min(times)
+            agreement = np.mean(assignments == expected)
+
+            print("%-8s %-15s %9.3f %7.1fx%s" % (
+                n_centers, method, min(times), baseline / min(times),
+                '' if agreement == 1 else
+                '  (%.4f%% disagree)' % (100 * (1 - agreement))))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
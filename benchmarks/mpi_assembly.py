@@ -0,0 +1,138 @@
+"""Scaling benchmark for assembling striped arrays across MPI ranks.
+
+Stripes a synthetic ragged array (e.g. assignments of frames from many
+trajectories) across ranks, then assembles it with
+`enspara.mpi.ops.assemble_striped_ragged_array`, both on every rank
+(Allgatherv) and on rank 0 only (Gatherv). These are compared to the
+previous implementation, in which each rank in turn broadcast its
+pickled array. For each number of ranks, reports the slowest rank's
+time and rank 0's memory high-water mark for each method. Each number
+of ranks is run in a fresh job with a local MPI launcher. Run as
+``python benchmarks/mpi_assembly.py``.
+"""
+
+import argparse
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from enspara import ra
+
+METHODS = ['bcast', 'allgatherv', 'gatherv']
+
+
+def process_command_line(argv=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description=__doc__)
+    parser.add_argument(
+        '--ranks', default=[1, 2, 4], type=int, nargs='+',
+        help="Numbers of MPI ranks to benchmark.")
+    parser.add_argument(
+        '--n-frames', default=10000000, type=int,
+        help="Total number of frames in the assembled array.")
+    parser.add_argument(
+        '--n-trajectories', default=1000, type=int,
+        help="Number of trajectories (rows) the frames are split into.")
+    parser.add_argument(
+        '--dtype', default='float32',
+        help="Dtype of the assembled array.")
+    parser.add_argument(
+        '--launcher', default='mpiexec',
+        help="Command used to launch MPI jobs.")
+    parser.add_argument(
+        '--seed', default=0, type=int)
+    parser.add_argument(
+        '--worker', choices=METHODS, default=None,
+        help=argparse.SUPPRESS)
+
+    return parser.parse_args(argv)
+
+
+def maxrss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bcast_assemble(local_array, global_lengths):
+    """The pickled-broadcast assembly that the collectives replaced."""
+
+    from enspara import mpi
+
+    global_ra = ra.RaggedArray(
+        np.empty(np.sum(global_lengths), dtype=local_array.dtype),
+        lengths=global_lengths)
+
+    for rank in range(mpi.size()):
+        rank_array = mpi.comm.bcast(local_array, root=rank)
+        local_lengths = global_lengths[rank::mpi.size()]
+        if len(local_lengths) > 1:
+            global_ra[rank::mpi.size()] = ra.RaggedArray(
+                rank_array, lengths=local_lengths)
+        else:
+            global_ra[rank] = rank_array
+
+    return global_ra._data
+
+
+def run_case(args):
+    # mpi is only imported by workers, since initializing MPI in the
+    # parent process would stop it launching MPI jobs of its own.
+    from enspara import mpi
+
+    random_state = np.random.RandomState(args.seed)
+    lengths = random_state.multinomial(
+        args.n_frames - args.n_trajectories,
+        np.ones(args.n_trajectories) / args.n_trajectories) + 1
+
+    local_lengths = lengths[mpi.rank()::mpi.size()]
+    local_array = np.ones(np.sum(local_lengths), dtype=args.dtype)
+
+    mpi.comm.barrier()
+    baseline = maxrss_mb()
+    tick = time.perf_counter()
+
+    if args.worker == 'bcast':
+        bcast_assemble(local_array, lengths)
+    else:
+        mpi.ops.assemble_striped_ragged_array(
+            local_array, lengths,
+            root=0 if args.worker == 'gatherv' else None)
+
+    elapsed = mpi.comm.allreduce(time.perf_counter() - tick,
+                                 op=mpi.mpi4py.MAX)
+    if mpi.rank() == 0:
+        print("%.3f %.1f" % (elapsed, maxrss_mb() - baseline))
+
+
+def run_worker(method, n_ranks, args):
+    out = subprocess.check_output(
+        [args.launcher, '-n', str(n_ranks), sys.executable, __file__,
+         '--worker', method,
+         '--n-frames', str(args.n_frames),
+         '--n-trajectories', str(args.n_trajectories),
+         '--dtype', args.dtype,
+         '--seed', str(args.seed)])
+    return out.decode().split()[-2:]
+
+
+def main(argv=None):
+    args = process_command_line(argv)
+
+    if args.worker:
+        return run_case(args)
+
+    print("%s %s frames in %s trajectories" %
+          (args.n_frames, args.dtype, args.n_trajectories))
+    print("%-6s %-11s %9s %22s" %
+          ('ranks', 'method', 'time (s)', 'rank 0 peak (MB)'))
+    for n_ranks in args.ranks:
+        for method in METHODS:
+            elapsed, rss = run_worker(method, n_ranks, args)
+            print("%-6s %-11s %9s %22s" % (n_ranks, method, elapsed, rss))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
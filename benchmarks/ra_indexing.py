@@ -0,0 +1,66 @@
+"""Micro-benchmark for RaggedArray 1d <-> 2d index translation.
+
+Times `ra.where`, 2d slicing and fancy indexing on a synthetic ragged
+array with many rows. Run as ``python benchmarks/ra_indexing.py``.
+"""
+
+import argparse
+import timeit
+
+import numpy as np
+
+from enspara import ra
+
+
+def process_command_line(argv=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description=__doc__)
+    parser.add_argument(
+        '--n-rows', default=10000, type=int,
+        help="Number of rows (trajectories) in the ragged array.")
+    parser.add_argument(
+        '--mean-length', default=200, type=int,
+        help="Mean length of each row.")
+    parser.add_argument(
+        '--repeats', default=3, type=int,
+        help="Number of timing repeats; the best is reported.")
+    parser.add_argument(
+        '--seed', default=0, type=int)
+
+    return parser.parse_args(argv)
+
+
+def make_ra(n_rows, mean_length, random_state):
+    lengths = random_state.poisson(mean_length, size=n_rows)
+    data = random_state.randint(0, 100, size=lengths.sum())
+    return ra.RaggedArray(data, lengths=lengths)
+
+
+def main(argv=None):
+    args = process_command_line(argv)
+    random_state = np.random.RandomState(args.seed)
+
+    a = make_ra(args.n_rows, args.mean_length, random_state)
+    mask = a < 50
+    rows = random_state.randint(0, len(a), size=a.size // 10)
+    cols = np.minimum(
+        random_state.randint(0, args.mean_length // 2, size=len(rows)),
+        a.lengths[rows] - 1)
+
+    cases = [
+        ('ra.where(mask)', lambda: ra.where(mask)),
+        ('a[:, ::3]', lambda: a[:, ::3]),
+        ('a[:, -10:]', lambda: a[:, -10:]),
+        ('a[rows, cols]', lambda: a[(rows, cols)]),
+        ('a[mask]', lambda: a[mask]),
+    ]
+
+    print("RaggedArray with %s rows, %s elements" % (len(a), a.size))
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=1, repeat=args.repeats))
+        print("%-16s %10.4f s" % (name, best))
+
+
+if __name__ == '__main__':
+    main()
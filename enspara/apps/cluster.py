@@ -51,11 +51,14 @@ from enspara.apps.util import readable_dir
 
 from enspara import mpi
 from enspara.cluster import KHybrid, KCenters
+from enspara.cluster.kcenters import MPI_CLOCK_EVERY
 from enspara.util import array as ra
 from enspara.util import load_as_concatenated
+from enspara.util.load import extract_atoms
 from enspara.util.log import timed
 from enspara.util.parallel import auto_nprocs
-from enspara.cluster.util import load_frames, partition_indices, ClusterResult
+from enspara.cluster.util import load_frames, partition_indices, \
+    ClusterResult, assignment_dtype, distance_dtype
 
 from enspara.geometry import libdist
 
@@ -130,6 +133,32 @@ def process_command_line(argv):
         '--subsample', default=1, type=int,
         help="Take only every nth frame when loading trajectories. "
              "1 implies no subsampling.")
+    cluster_args.add_argument(
+        '--cache-atoms', default=False, action='store_true',
+        help="Extract the atoms selected by --atoms from each trajectory "
+             "into a compact, memory-mapped file next to it (if not "
+             "already extracted), and load them from there. Later runs "
+             "with the same selection, with any --subsample, read these "
+             "files instead of decoding whole trajectories.")
+
+    cluster_args.add_argument(
+        '--checkpoint', default=None, action=readable_dir,
+        help="Periodically save the state of clustering to this .npz file "
+             "(one per rank in MPI mode), so that an interrupted run can "
+             "be continued with --resume.")
+    cluster_args.add_argument(
+        '--checkpoint-every', default=None, type=int,
+        help="Checkpoint every this many new cluster centers.")
+    cluster_args.add_argument(
+        '--checkpoint-seconds', default=3600, type=float,
+        help="Checkpoint when this many seconds have passed since the "
+             "last checkpoint. In MPI mode, this is checked every %s new "
+             "cluster centers." % MPI_CLOCK_EVERY)
+    cluster_args.add_argument(
+        '--resume', default=False, action='store_true',
+        help="If the --checkpoint file exists, continue clustering from "
+             "it. The data must be loaded as in the interrupted run (i.e. "
+             "with the same inputs, --subsample and number of MPI ranks).")
 
     # OUTPUT
     output_args = parser.add_argument_group("Output Settings")
@@ -138,6 +167,12 @@ def process_command_line(argv):
         help="Do not do a reassigment step. Ignored if --subsample is "
              "not supplied or 1.")
 
+    output_args.add_argument(
+        '--exact-dtypes', default=False, action='store_true',
+        help="Write assignments as int64 and distances as float64, rather "
+             "than the smallest integer type that fits the number of "
+             "clusters and float32. Use this to exactly reproduce output "
+             "from earlier versions.")
     output_args.add_argument(
         '--distances', required=True, action=readable_dir,
         help="The location to write the distances file.")
@@ -150,6 +185,12 @@ def process_command_line(argv):
     output_args.add_argument(
         "--center-indices", required=False, action=readable_dir,
         help="Location for cluster center indices output (pickle).")
+    output_args.add_argument(
+        "--center-index", required=False, action=readable_dir,
+        help="Location to write a ball-tree index over the cluster "
+             "centers (.npz), which speeds up assigning new frames to "
+             "thousands of centers or more (see the --center-index "
+             "option of reassign).")
 
     args = parser.parse_args(argv[1:])
 
@@ -232,9 +273,6 @@ def process_command_line(argv):
     if args.no_reassign and args.subsample == 1:
         logger.warn("When subsampling is 1 (or unspecified), "
                     "--no-reassign has no effect.")
-    if not args.no_reassign and mpi_mode and args.subsample > 1:
-        logger.warn("Reassignment is suppressed in MPI mode.")
-        args.no_reassign = True
 
     if args.trajectories:
         if os.path.splitext(args.center_features)[1] == '.h5':
@@ -264,13 +302,21 @@ def expand_files(pgroups):
 
 def load_features(features, stride):
     try:
-        if len(features) == 1:
+        if len(features) == 1 and features[0].endswith('.npy'):
+            with timed("Loading features took %.1f s.", logger.info):
+                lengths, data = mpi.io.load_ragged_npy_as_striped(
+                    features[0], stride, balance=True)
+
+        elif len(features) == 1:
             with timed("Loading features took %.1f s.", logger.info):
-                lengths, data = mpi.io.load_h5_as_striped(features[0], stride)
+                lengths, data = mpi.io.load_h5_as_striped(
+                    features[0], stride, processes=auto_nprocs(),
+                    balance=True)
 
         else:  # and len(features) > 1
             with timed("Loading features took %.1f s.", logger.info):
-                lengths, data = mpi.io.load_npy_as_striped(features, stride)
+                lengths, data = mpi.io.load_npy_as_striped(
+                    features, stride, balance=True, threads=auto_nprocs())
 
         with timed("Turned over array in %.2f min", logger.info):
             tmp_data = data.copy()
@@ -288,7 +334,8 @@ def load_features(features, stride):
     return lengths, data
 
 
-def load_trajectories(topologies, trajectories, selections, stride, processes):
+def load_trajectories(topologies, trajectories, selections, stride, processes,
+                      cache_atoms=False):
 
     for top, selection in zip(topologies, selections):
         sentinel_trj = md.load(top)
@@ -331,14 +378,33 @@ def load_trajectories(topologies, trajectories, selections, stride, processes):
         len(flat_trjs), len(top.select(selection)), processes, stride)
     assert len(top.select(selection)) > 0, "No atoms selected for clustering"
 
+    # trajectories are spread across ranks so that each holds about the
+    # same number of frames, which needs their lengths up front.
+    with timed("Sounding took %.1f sec", logger.info):
+        lengths = mpi.io.sound_trajectories_as_striped(
+            flat_trjs, stride=stride, processes=processes)
+
+    if cache_atoms:
+        local_trjs = np.flatnonzero(
+            mpi.ops.balanced_owners(lengths) == mpi.rank())
+        # extract every frame, rather than every stride-th, so that the
+        # same files serve any subsample as well as reassignment.
+        with timed("Extracting atoms took %.1f sec", logger.info):
+            extract_atoms(
+                [flat_trjs[i] for i in local_trjs],
+                args=[{'top': configs[i]['top'],
+                       'atom_indices': configs[i]['atom_indices']}
+                      for i in local_trjs],
+                processes=processes)
+        mpi.comm.barrier()
+
+    # xyz is a view of the shared memory it was loaded into (see
+    # shared_array_like_trj), which is ordinary anonymous memory once
+    # the loader's workers exit, so it isn't "turned over" with a copy.
     with timed("Loading took %.1f sec", logger.info):
         lengths, xyz = mpi.io.load_trajectory_as_striped(
-            flat_trjs, args=configs, processes=auto_nprocs())
-
-    with timed("Turned over array in %.2f min", logger.info):
-        tmp_xyz = xyz.copy()
-        del xyz
-        xyz = tmp_xyz
+            flat_trjs, args=configs, lengths=lengths,
+            processes=auto_nprocs(), balance=True)
 
     logger.info("Loaded %s frames.", len(xyz))
 
@@ -347,12 +413,13 @@ def load_trajectories(topologies, trajectories, selections, stride, processes):
 
 def load_asymm_frames(center_indices, trajectories, topology, subsample):
 
-    frames = []
+    frames = [None] * len(center_indices)
     begin_index = 0
     for topfile, trjset in zip(topology, trajectories):
         end_index = begin_index + len(trjset)
-        target_centers = [c for c in center_indices
-                          if begin_index <= c[0] < end_index]
+        positions = [i for i, c in enumerate(center_indices)
+                     if begin_index <= c[0] < end_index]
+        target_centers = [center_indices[i] for i in positions]
 
         try:
             subframes = load_frames(
@@ -365,7 +432,9 @@ def load_asymm_frames(center_indices, trajectories, topology, subsample):
                          topfile, target_centers)
             raise
 
-        frames.extend(subframes)
+        # keep centers in the order of center_indices (i.e. cluster id)
+        for i, frame in zip(positions, subframes):
+            frames[i] = frame
         begin_index += len(trjset)
 
     return frames
@@ -390,7 +459,8 @@ def load_trjs_or_features(args):
         with timed("Loading trajectories took %.1f s.", logger.info):
             lengths, xyz, select_top = load_trajectories(
                 args.topologies, args.trajectories, selections=args.atoms,
-                stride=args.subsample, processes=auto_nprocs())
+                stride=args.subsample, processes=auto_nprocs(),
+                cache_atoms=args.cache_atoms)
 
         logger.info("Clustering using %s atoms matching '%s'.", xyz.shape[1],
                     args.atoms)
@@ -430,18 +500,29 @@ def write_centers(result, args):
 
 
 def write_assignments_and_distances_with_reassign(result, args):
+    """Write assignments and distances, reassigning every frame first if
+    the data were subsampled. In MPI mode, this must be called on every
+    rank, since reassignment is distributed across them; only rank 0
+    writes.
+    """
+
     if args.subsample == 1:
         logger.debug("Subsampling was 1, not reassigning.")
-        ra.save(args.distances, result.distances)
-        ra.save(args.assignments, result.assignments)
+        if mpi.rank() == 0:
+            ra.save(args.distances, result.distances)
+            ra.save(args.assignments, result.assignments)
     elif not args.no_reassign:
         logger.debug("Reassigning data from subsampling of %s", args.subsample)
-        assig, dist = reassign(
+        reassigned = reassign(
             args.topologies, args.trajectories, args.atoms,
-            centers=result.centers)
-
-        ra.save(args.distances, dist)
-        ra.save(args.assignments, assig)
+            centers=result.centers, compact_dtypes=not args.exact_dtypes,
+            center_index=args.center_index, mpi_mode=mpi_mode)
+
+        # in MPI mode, results are only assembled on rank 0
+        if mpi.rank() == 0:
+            assig, dist = reassigned
+            ra.save(args.distances, dist)
+            ra.save(args.assignments, assig)
     else:
         logger.debug("Got --no-reassign, not doing reassigment")
 
@@ -457,6 +538,12 @@ def main(argv=None):
     kwargs = {}
     if args.cluster_iterations is not None:
         kwargs['kmedoids_updates'] = int(args.cluster_iterations)
+    if args.checkpoint is not None:
+        kwargs.update(
+            checkpoint=args.checkpoint,
+            checkpoint_every=args.checkpoint_every,
+            checkpoint_seconds=args.checkpoint_seconds,
+            resume=args.resume)
 
     clustering = args.Clusterer(
         metric=args.cluster_distance,
@@ -473,34 +560,57 @@ def main(argv=None):
         "Clustered %s frames into %s clusters in %s seconds.",
         sum(lengths), len(clustering.centers_), clustering.runtime_)
 
+    if args.center_index:
+        if mpi.rank() == 0:
+            with timed("Built and wrote center index in %.2f sec.",
+                       logger.info):
+                clustering.build_index()
+                clustering.index_.save(args.center_index)
+        # every rank reads the index to reassign
+        mpi.comm.barrier()
+
     result = clustering.result_
     if mpi_mode:
         local_ctr_inds, local_dists, local_assigs = \
             result.center_indices, result.distances, result.assignments
 
+        # compact before assembly, which holds the full arrays on rank 0
+        if not args.exact_dtypes:
+            local_dists = local_dists.astype(distance_dtype(), copy=False)
+            local_assigs = local_assigs.astype(
+                assignment_dtype(len(result.centers)), copy=False)
+
+        # only rank 0 writes output, so the full arrays are assembled
+        # there alone (they're None on other ranks). Data were loaded
+        # balanced across ranks, in the layout given by balanced_owners.
+        owners = mpi.ops.balanced_owners(lengths)
         with timed("Reassembled dist and assign arrays in %.2f sec",
                    logging.info):
             all_dists = mpi.ops.assemble_striped_ragged_array(
-                local_dists, lengths)
+                local_dists, lengths, root=0, owners=owners)
             all_assigs = mpi.ops.assemble_striped_ragged_array(
-                local_assigs, lengths)
-            ctr_inds = mpi.ops.convert_local_indices(local_ctr_inds, lengths)
+                local_assigs, lengths, root=0, owners=owners)
+            ctr_inds = mpi.ops.convert_local_indices(
+                local_ctr_inds, lengths, owners=owners)
 
         result = ClusterResult(
             center_indices=ctr_inds,
             distances=all_dists,
             assignments=all_assigs,
             centers=result.centers)
-    result = result.partition(lengths)
 
     if mpi.rank() == 0:
+        result = result.partition(
+            lengths, compact_dtypes=not args.exact_dtypes)
+
         with timed("Wrote center indices in %.2f sec.", logger.info):
             write_centers_indices(
                 args.center_indices,
                 [(t, f * args.subsample) for t, f in result.center_indices])
         with timed("Wrote center structures in %.2f sec.", logger.info):
             write_centers(result, args)
-        write_assignments_and_distances_with_reassign(result, args)
+
+    write_assignments_and_distances_with_reassign(result, args)
 
     mpi.comm.barrier()
 
@@ -11,6 +11,8 @@ import logging
 import pickle
 import time
 import resource
+import contextlib
+import multiprocessing as mp
 
 from functools import partial
 
@@ -19,8 +21,6 @@ import psutil
 import numpy as np
 import mdtraj as md
 
-from joblib import Parallel, delayed
-
 logging.basicConfig(
     level=logging.INFO,
     format=('%(asctime)s %(name)-8s %(levelname)-7s %(message)s'),
@@ -28,9 +28,13 @@ logging.basicConfig(
 
 import enspara
 
-from enspara.cluster.util import assign_to_nearest_center, partition_list
-from enspara.util.load import (concatenate_trjs, sound_trajectory,
-                               load_as_concatenated)
+from enspara import mpi
+from enspara.cluster.balltree import BallTree
+from enspara.cluster.util import (assign_to_nearest_center,
+                                  assignment_dtype, distance_dtype)
+from enspara.util import load
+from enspara.util.load import (concatenate_trjs, sound_trajectories,
+                               shared_array_like_trj)
 from enspara.util import array as ra
 from enspara.util.log import timed
 
@@ -61,10 +65,17 @@ def process_command_line(argv):
         '--output-path', default=None,
         help="Output path for results (distances, assignments). "
              "Default is in the same directory as the input centers.")
+    parser.add_argument(
+        '--center-index', default=None,
+        help="A ball-tree index over the centers (as written by the "
+             "--center-index option of cluster), used to find each "
+             "frame's nearest center without computing its RMSD to "
+             "every center, where that is faster (e.g. with thousands "
+             "of centers).")
     parser.add_argument(
         '-m', '--mem-fraction', default=0.5, type=float,
-        help="The fraction of total RAM to use in deciding the batch size. "
-             "Genrally, this number shouldn't be much higher than 0.5.")
+        help="The fraction of available RAM to use in deciding the batch "
+             "size. Genrally, this number shouldn't be much higher than 0.5.")
 
     # OUTPUT ARGS
     parser.add_argument(
@@ -75,6 +86,17 @@ def process_command_line(argv):
         '--assignments', required=True,
         help="Path to h5 file where assignments to nearest center will "
              "be ouput")
+    parser.add_argument(
+        '--exact-dtypes', default=False, action='store_true',
+        help="Write assignments as int64 and distances as float64, rather "
+             "than the smallest integer type that fits the number of "
+             "centers and float32. Use this to exactly reproduce output "
+             "from earlier versions.")
+    parser.add_argument(
+        '--resume', default=False, action='store_true',
+        help="If the --assignments and --distances files exist (e.g. from "
+             "an interrupted run), keep the trajectories they already "
+             "hold and reassign only the remainder.")
 
     args = parser.parse_args(argv[1:])
 
@@ -98,108 +120,334 @@ def process_command_line(argv):
     return args
 
 
-def compute_batches(lengths, batch_size):
-    """Compute batches (slices into lengths) of combined length at most
-    size batch_size.
-    """
+# bytes held for each frame being assigned, besides its coordinates:
+# its assignment (int64) and distance (float64), the distances to the
+# center being considered (float32) and the mask of frames it's closer
+# to (bool).
+ASSIGNMENT_BYTES_PER_FRAME = 8 + 8 + 4 + 1
 
-    batch_sizes = [[]]
-    batch_indices = [[]]
-    for i, l in enumerate(lengths):
-        if sum(batch_sizes[-1]) + l < batch_size:
-            batch_sizes[-1].append(l)
-            batch_indices[-1].append(i)
-        else:
-            batch_sizes.append([l])
-            batch_indices.append([i])
 
-    return batch_indices
+def plan_batches(lengths, batch_size):
+    """Split trajectories into batches of at most batch_size frames.
+
+    The number of batches is the fewest that fit, and frames are spread
+    evenly among them. Trajectories are split across batches wherever a
+    batch fills up, so no trajectory is too long to be batched.
+
+    Parameters
+    ----------
+    lengths : list of ints
+        Length of each trajectory.
+    batch_size : int
+        Maximum number of frames in a batch.
+
+    Returns
+    -------
+    batches : list of lists
+        Each batch is a list of (trajectory index, start, stop) frame
+        ranges. Ranges are in order, so each batch is a contiguous run
+        of the concatenated trajectories. Empty trajectories get a
+        (i, 0, 0) range, in the batch holding the frames before them
+        (if any), so they never make a batch of their own.
+    """
+
+    if batch_size < 1:
+        raise enspara.exception.ImproperlyConfigured(
+            "Batch size must be at least one frame, got %s." % batch_size)
+
+    total = sum(lengths)
+    n_batches = max(1, -(-total // batch_size))
+    target = -(-total // n_batches)
+
+    batches = []
+    batch, room = [], target
+    for i, length in enumerate(lengths):
+        if length == 0:
+            (batch if batch or not batches else batches[-1]).append(
+                (i, 0, 0))
+        start = 0
+        while start < length:
+            stop = min(length, start + room)
+            batch.append((i, start, stop))
+            room -= stop - start
+            start = stop
+            if room == 0:
+                batches.append(batch)
+                batch, room = [], target
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+
+def determine_batch_size(n_atoms, dtype_bytes, frac_mem, n_centers=0,
+                         n_buffers=1, reserved_bytes=0):
+    """Find the number of frames that can be assigned at once using a
+    fraction of the memory that is currently available.
 
+    Parameters
+    ----------
+    n_atoms : int
+        Number of atoms in each frame.
+    dtype_bytes : int
+        Size of each coordinate.
+    frac_mem : float
+        Fraction of available memory to use.
+    n_centers : int, default=0
+        Number of centers (with n_atoms atoms) held in memory, whose
+        size is taken out of the budget.
+    n_buffers : int, default=1
+        Number of batches in memory at once.
+    reserved_bytes : int, default=0
+        Other memory to take out of the budget (e.g. output arrays).
+
+    Returns
+    -------
+    batch_size : int
+        Number of frames in each batch.
+    batch_gb : float
+        Memory used by each batch, in GB.
+    """
 
-def determine_batch_size(n_atoms, dtype_bytes, frac_mem):
-    floats_per_frame = n_atoms * 3
-    bytes_per_frame = floats_per_frame * dtype_bytes
+    coord_bytes = n_atoms * 3 * dtype_bytes
+    bytes_per_frame = coord_bytes + ASSIGNMENT_BYTES_PER_FRAME
 
-    mem = psutil.virtual_memory()
-    bytes_total = mem.total
+    budget = (psutil.virtual_memory().available * frac_mem -
+              n_centers * coord_bytes - reserved_bytes)
 
-    batch_size = int(bytes_total * frac_mem / bytes_per_frame)
+    batch_size = max(0, int(budget / (bytes_per_frame * n_buffers)))
     batch_gb = batch_size * bytes_per_frame / (1024**3)
 
     return batch_size, batch_gb
 
 
-def batch_reassign(targets, centers, lengths, frac_mem, n_procs=None):
+def _start_loading(batch, targets, example_center, n_procs):
+    """Begin loading the frames of a batch in background processes.
 
-    example_center = centers[0]
+    Returns a handle to pass to `_finish_loading`.
+    """
 
-    DTYPE_BYTES = 4
-    batch_size, batch_gb = determine_batch_size(
-        example_center.n_atoms, DTYPE_BYTES, frac_mem)
+    positions = np.cumsum([0] + [stop - start for _, start, stop in batch])
+    full_shape, shared_xyz = shared_array_like_trj(
+        [positions[-1]], example_center)
 
-    logger.info(
-        'Batch max size set to %s frames (~%.2f GB, %.1f%% of total RAM).' %
-        (batch_size, batch_gb, frac_mem*100))
+    specs = [(pos, targets[t][0], start, stop, targets[t][1], targets[t][2])
+             for pos, (t, start, stop) in zip(positions, batch)
+             if stop > start]
 
-    if batch_size < max(lengths):
-        raise enspara.exception.ImproperlyConfigured(
-            'Batch size of %s was smaller than largest file (size %s).' %
-            (batch_size, max(lengths)))
+    pool = mp.Pool(processes=n_procs, initializer=load._init,
+                   initargs=(shared_xyz,))
+    result = pool.map_async(
+        partial(load._load_range_to_position, arr_shape=full_shape), specs)
+    pool.close()
 
-    batches = compute_batches(lengths, batch_size)
+    return pool, result, full_shape, shared_xyz
 
-    assignments = []
-    distances = []
 
-    for i, batch_indices in enumerate(batches):
-        tick = time.perf_counter()
-        logger.info("Starting batch %s of %s", i+1, len(batches))
-        batch_targets = [targets[i] for i in batch_indices]
-
-        with timed("Loaded frames for batch in %.1f seconds", logger.info):
-            batch_lengths, xyz = load_as_concatenated(
-                [tfile for tfile, top, aids in batch_targets],
-                lengths=[lengths[i] for i in batch_indices],
-                args=[{'top': top, 'atom_indices': aids}
-                      for t, top, aids in batch_targets],
-                processes=n_procs)
-
-        # mdtraj loads as float32, and load_as_concatenated should thus
-        # also load as float32. This should _never_ be hit, but there might be
-        # some platform-specific situation where double != float64?
-        assert xyz.dtype.itemsize == DTYPE_BYTES
-
-        trj = md.Trajectory(xyz, topology=example_center.top)
-
-        with timed("Precentered trajectories in %.1f seconds", logger.debug):
-            trj.center_coordinates()
-
-        with timed("Assigned trajectories in %.1f seconds", logger.debug):
-            batch_assignments, batch_distances = assign_to_nearest_center(
-                    trj, centers, partial(md.rmsd, precentered=True))
-
-        # clear memory of xyz and trj to allow cleanup to deallocate
-        # these large arrays; may help with memory high-water mark
-        with timed("Cleared array from memory in %.1f seconds", logger.debug):
-            xyz_size = xyz.size
-            del trj, xyz
-
-        assignments.extend(partition_list(batch_assignments, batch_lengths))
-        distances.extend(partition_list(batch_distances, batch_lengths))
-
-        logger.info(
-            "Finished batch %s of %s in %.1f seconds. Coordinates array had "
-            "memory footprint of %.2f GB (of memory high-water mark %.2f/%.2f "
-            "GB).",
-            i, len(batches), time.perf_counter() - tick,
-            xyz_size * DTYPE_BYTES / 1024**3,
-            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024**2,
-            psutil.virtual_memory().total / 1024**3)
+def _finish_loading(handle):
+    """Wait for a batch started by `_start_loading` and get its
+    coordinates."""
+
+    pool, result, full_shape, shared_xyz = handle
+
+    try:
+        result.get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return load._tonumpyarray(shared_xyz).reshape(full_shape)
+
+
+def batch_reassign(targets, centers, lengths, frac_mem, n_procs=None,
+                   writers=None, compact_dtypes=False, index=None):
+    """Assign the trajectories in `targets` to `centers` in batches
+    that fit in a fraction of available memory.
+
+    Batches are planned by `plan_batches`, and the frames of each batch
+    are loaded in the background while the previous batch is assigned.
+
+    Parameters
+    ----------
+    targets : list
+        List of (trajectory file, topology, atom indices) tuples.
+    centers : list
+        The (precentered) cluster centers, as md.Trajectory objects.
+    lengths : list
+        Length of each of `targets`, in frames.
+    frac_mem : float
+        The fraction of available RAM to use for batches (two of which,
+        the one being assigned and the one being loaded, are in memory
+        at a time).
+    n_procs : int, default=None
+        Number of processes to use for loading trajectories.
+    writers : (ra.RaggedArrayWriter, ra.RaggedArrayWriter), optional
+        If given, assignments and distances for each trajectory are
+        appended to these writers as each batch is finished rather than
+        being accumulated in memory. Trajectories already held by the
+        writers (e.g. from an interrupted run) are skipped.
+    compact_dtypes : bool, default=False
+        Store assignments in the smallest integer dtype that fits
+        len(centers) and distances as float32.
+    index : enspara.cluster.BallTree, default=None
+        If given, an index over `centers` (with precentered RMSD as its
+        metric) used to find each frame's nearest center where that is
+        faster (see `enspara.cluster.BallTree.prunes_well`).
+
+    Returns
+    -------
+    assignments, distances : np.ndarray, np.ndarray
+        Assignments and distances for all frames, concatenated in the
+        order of `targets`. These are None if `writers` are given.
+    """
+
+    example_center = centers[0]
+
+    assig_dtype = assignment_dtype(len(centers), compact=compact_dtypes)
+    dist_dtype = distance_dtype(compact=compact_dtypes)
+
+    n_done = 0
+    if writers is not None:
+        n_done = min(w.n_rows for w in writers)
+        for w in writers:
+            if w.n_rows > n_done:
+                w.truncate(n_done)
+            if not np.array_equal(w.lengths, lengths[:n_done]):
+                raise enspara.exception.DataInvalid(
+                    "The %s trajectories already in %s have lengths that "
+                    "don't match the trajectories being reassigned." %
+                    (n_done, w.filename))
+        if n_done:
+            logger.info("Resuming reassignment; %s of %s trajectories "
+                        "were already complete.", n_done, len(targets))
+
+    # outputs held in memory are allocated up front, so they come out of
+    # the budget for batches.
+    output_bytes = 0
+    if writers is None:
+        output_bytes = sum(lengths) * (np.dtype(assig_dtype).itemsize +
+                                       np.dtype(dist_dtype).itemsize)
+
+    DTYPE_BYTES = 4
+    batch_size, batch_gb = determine_batch_size(
+        example_center.n_atoms, DTYPE_BYTES, frac_mem,
+        n_centers=len(centers), n_buffers=2, reserved_bytes=output_bytes)
+
+    logger.info(
+        'Batch max size set to %s frames (~%.2f GB, of %.1f%% of the '
+        '%.2f GB of available RAM).', batch_size, batch_gb, frac_mem*100,
+        psutil.virtual_memory().available / 1024**3)
+
+    if batch_size < 1:
+        raise enspara.exception.InsufficientResourceError(
+            "Not enough memory is available to reassign even one frame "
+            "at a time with --mem-fraction %s." % frac_mem)
+
+    batches = [[(t + n_done, start, stop) for t, start, stop in batch]
+               for batch in plan_batches(lengths[n_done:], batch_size)]
+
+    starts = np.concatenate([[0], np.cumsum(lengths)]).astype(int)
+
+    assignments = None
+    distances = None
+    if writers is None:
+        assignments = np.empty(starts[-1], dtype=assig_dtype)
+        distances = np.empty(starts[-1], dtype=dist_dtype)
+
+    # pieces of the trajectory that is split across batches, held until
+    # its last batch so that it's written as a single row.
+    partial_rows = []
+
+    pending = None
+    if batches:
+        pending = _start_loading(
+            batches[0], targets, example_center, n_procs)
+
+    try:
+        for i, batch in enumerate(batches):
+            tick = time.perf_counter()
+            logger.info("Starting batch %s of %s", i+1, len(batches))
+
+            with timed("Waited %.1f seconds for frames of batch",
+                       logger.info):
+                xyz = _finish_loading(pending)
+
+            # load the next batch while this one is assigned
+            pending = None
+            if i + 1 < len(batches):
+                pending = _start_loading(
+                    batches[i+1], targets, example_center, n_procs)
+
+            # mdtraj loads as float32, and so should the shared array.
+            # This should _never_ be hit, but there might be some
+            # platform-specific situation where double != float64?
+            assert xyz.dtype.itemsize == DTYPE_BYTES
+
+            trj = md.Trajectory(xyz, topology=example_center.top)
+
+            with timed("Precentered trajectories in %.1f seconds",
+                       logger.debug):
+                trj.center_coordinates()
+
+            with timed("Assigned trajectories in %.1f seconds",
+                       logger.debug):
+                batch_assignments, batch_distances = \
+                    assign_to_nearest_center(
+                        trj, centers, partial(md.rmsd, precentered=True),
+                        index=index)
+
+            # clear memory of xyz and trj to allow cleanup to deallocate
+            # these large arrays; may help with memory high-water mark
+            with timed("Cleared array from memory in %.1f seconds",
+                       logger.debug):
+                xyz_size = xyz.size
+                del trj, xyz
+
+            if writers is None:
+                # batches are contiguous runs of frames
+                t, start, _ = batch[0]
+                begin = starts[t] + start
+                assignments[begin:begin+len(batch_assignments)] = \
+                    batch_assignments
+                distances[begin:begin+len(batch_distances)] = \
+                    batch_distances
+            else:
+                with timed("Wrote batch to disk in %.1f seconds",
+                           logger.debug):
+                    position = 0
+                    for t, start, stop in batch:
+                        end = position + stop - start
+                        partial_rows.append(
+                            (batch_assignments[position:end],
+                             batch_distances[position:end]))
+                        position = end
+                        if stop == lengths[t]:
+                            assig, dist = zip(*partial_rows)
+                            writers[0].append(np.concatenate(assig).astype(
+                                assig_dtype, copy=False))
+                            writers[1].append(np.concatenate(dist).astype(
+                                dist_dtype, copy=False))
+                            partial_rows = []
+
+            logger.info(
+                "Finished batch %s of %s in %.1f seconds. Coordinates array "
+                "had memory footprint of %.2f GB (of memory high-water mark "
+                "%.2f/%.2f GB).",
+                i+1, len(batches), time.perf_counter() - tick,
+                xyz_size * DTYPE_BYTES / 1024**3,
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024**2,
+                psutil.virtual_memory().total / 1024**3)
+    finally:
+        if pending is not None:
+            pending[0].terminate()
+            pending[0].join()
 
     return assignments, distances
 
 
-def reassign(topologies, trajectories, atoms, centers, frac_mem=0.5):
+def reassign(topologies, trajectories, atoms, centers, frac_mem=0.5,
+             assignments_file=None, distances_file=None, resume=False,
+             compact_dtypes=False, center_index=None, mpi_mode=False):
     """Reassign a set of trajectories based on a subset of atoms and centers.
 
     Parameters
@@ -215,15 +463,53 @@ def reassign(topologies, trajectories, atoms, centers, frac_mem=0.5):
         corresponding topology to choose which atoms will be used for
         the reassignment.
     centers : md.Trajectory or list of trajectories
-        The atoms representing the centers to reassign to.
+        The atoms representing the centers to reassign to. In MPI mode,
+        only rank 0's centers are used (and other ranks may pass None).
     frac_mem : float, default=0.5
-        The fraction of main RAM to use for trajectories. A lower number
-        will mean more batches.
+        The fraction of available RAM to use for trajectories. A lower number
+        will mean more batches. In MPI mode, this is shared between the
+        ranks on each node.
+    assignments_file, distances_file : str, optional
+        If given, assignments and distances are written to these HDF5
+        files (with ra.RaggedArrayWriter) as each batch is finished,
+        rather than being held in memory and returned.
+    resume : bool, default=False
+        If output files are given and already exist, keep the
+        trajectories they hold and reassign only the remainder.
+    compact_dtypes : bool, default=False
+        Store assignments in the smallest integer dtype that fits the
+        number of centers and distances as float32, rather than as int64
+        and float64.
+    center_index : str, optional
+        Path to a ball-tree index over `centers` (see
+        `enspara.cluster.BallTree.save`), used to find each frame's
+        nearest center without computing its RMSD to every center, where
+        that is faster.
+    mpi_mode : bool, default=False
+        Reassign across the ranks of an MPI swarm. Trajectories are
+        spread across ranks so that each reassigns about the same number
+        of frames (see `enspara.mpi.ops.balanced_owners`). Results
+        held in memory are assembled on rank 0 only, and other ranks
+        return None; output files are written by each rank to a shard of
+        its own (see `shard_filename`), which rank 0 merges into the
+        output file once every rank is done.
+
+    Returns
+    -------
+    assignments, distances : np.ndarray or ra.RaggedArray
+        Assignments and distances to the nearest center for each
+        trajectory, or None if output files were given (or, in MPI
+        mode, on ranks other than 0).
     """
 
     n_procs = enspara.util.parallel.auto_nprocs()
 
     # check input validity
+    if (assignments_file is None) != (distances_file is None):
+        raise enspara.exception.ImproperlyConfigured(
+            "Either both or neither of assignments_file (%s) and "
+            "distances_file (%s) must be given." %
+            (assignments_file, distances_file))
     if len(topologies) != len(trajectories):
         raise enspara.exception.ImproperlyConfigured(
             "Number of topologies (%s) didn't match number of sets of "
@@ -233,6 +519,14 @@ def reassign(topologies, trajectories, atoms, centers, frac_mem=0.5):
             "Number of topologies (%s) didn't match number of atom selection "
             "strings (%s)." % (len(topologies), len(atoms)))
 
+    if mpi_mode:
+        with timed("Broadcast centers in %.1f seconds.", logger.debug):
+            centers = mpi.comm.bcast(
+                centers if mpi.rank() == 0 else None, root=0)
+        # ranks on the same node share its memory and processors
+        frac_mem /= mpi.node_size()
+        n_procs = max(1, n_procs // mpi.node_size())
+
     # iteration across md.Trajectory is insanely slow. Do it only once here.
     if isinstance(centers, md.Trajectory):
         tick = time.perf_counter()
@@ -247,6 +541,12 @@ def reassign(topologies, trajectories, atoms, centers, frac_mem=0.5):
     for c in centers:
         c.center_coordinates()
 
+    index = None
+    if center_index is not None:
+        index = BallTree.load(center_index, centers,
+                              partial(md.rmsd, precentered=True))
+        logger.info("Loaded center index from %s.", center_index)
+
     with timed("Reassignment took %.1f seconds.", logger.info):
         # build flat list of targets
         targets = []
@@ -257,31 +557,160 @@ def reassign(topologies, trajectories, atoms, centers, frac_mem=0.5):
                 assert os.path.exists(trjfile)
                 targets.append((trjfile, t, atom_ids))
 
+        if mpi_mode and len(targets) < mpi.size():
+            raise enspara.exception.ImproperlyConfigured(
+                "To stripe files across MPI workers, at least 1 file per "
+                "node must be given. MPI size is %s, number of files "
+                "is %s." % (mpi.size(), len(targets)))
+
         # determine trajectory length
         tick_sounding = time.perf_counter()
         logger.info("Sounding dataset of %s trajectories and %s topologies.",
-                    sum(len(t) for t in trajectories), len(topologies))
-
-        lengths = Parallel(n_jobs=n_procs)(
-            delayed(sound_trajectory)(f) for f, _, _ in targets)
+                    len(targets), len(topologies))
+
+        if mpi_mode:
+            # every rank needs every length to balance the trajectories
+            # across ranks, so sounding is itself spread across ranks.
+            global_lengths = mpi.io.sound_trajectories_as_striped(
+                [f for f, _, _ in targets], processes=n_procs)
+            owners = mpi.ops.balanced_owners(global_lengths)
+            local_targets = np.flatnonzero(owners == mpi.rank())
+            targets = [targets[i] for i in local_targets]
+            lengths = [global_lengths[i] for i in local_targets]
+        else:
+            lengths = sound_trajectories(
+                [f for f, _, _ in targets], processes=n_procs)
 
         logger.info("Sounded %s trajectories with %s frames (median length "
                     "%i frames) in %.1f seconds.",
                     len(lengths), sum(lengths), np.median(lengths),
                     time.perf_counter() - tick_sounding)
 
-        assignments, distances = batch_reassign(
-            targets, centers, lengths, frac_mem=frac_mem, n_procs=n_procs)
-
-    if all([len(assignments[0]) == len(a) for a in assignments]):
+        if assignments_file is None:
+            assignments, distances = batch_reassign(
+                targets, centers, lengths, frac_mem=frac_mem,
+                n_procs=n_procs, compact_dtypes=compact_dtypes, index=index)
+        else:
+            assig_fname, dist_fname = assignments_file, distances_file
+            if mpi_mode:
+                assig_fname = shard_filename(assignments_file)
+                dist_fname = shard_filename(distances_file)
+
+            with ra.RaggedArrayWriter(assig_fname,
+                                      resume=resume) as assig_writer, \
+                    ra.RaggedArrayWriter(dist_fname,
+                                         resume=resume) as dist_writer:
+                batch_reassign(
+                    targets, centers, lengths, frac_mem=frac_mem,
+                    n_procs=n_procs, writers=(assig_writer, dist_writer),
+                    compact_dtypes=compact_dtypes, index=index)
+
+        if mpi_mode:
+            lengths = global_lengths
+
+            if assignments_file is None:
+                with timed("Assembled assignments and distances in %.1f "
+                           "seconds.", logger.info):
+                    assignments = mpi.ops.assemble_striped_ragged_array(
+                        assignments, lengths, owners=owners, root=0)
+                    distances = mpi.ops.assemble_striped_ragged_array(
+                        distances, lengths, owners=owners, root=0)
+            else:
+                mpi.comm.barrier()
+                if mpi.rank() == 0:
+                    with timed("Merged output shards in %.1f seconds.",
+                               logger.info):
+                        merge_shards(assignments_file, len(lengths),
+                                     owners=owners)
+                        merge_shards(distances_file, len(lengths),
+                                     owners=owners)
+                mpi.comm.barrier()
+
+    if assignments_file is not None or (mpi_mode and mpi.rank() != 0):
+        return None
+
+    if all(lengths[0] == l for l in lengths):
         logger.info("Trajectory lengths are homogenous. Output will "
                     "be np.ndarrays.")
-        assert all([len(distances[0]) == len(d) for d in distances])
-        return np.array(assignments), np.array(distances)
+        return (assignments.reshape(len(lengths), -1),
+                distances.reshape(len(lengths), -1))
     else:
         logger.info("Trajectory lengths are heterogenous. Output will "
                     "be ra.RaggedArrays.")
-        return ra.RaggedArray(assignments), ra.RaggedArray(distances)
+        return (ra.RaggedArray.from_buffer(assignments, lengths),
+                ra.RaggedArray.from_buffer(distances, lengths))
+
+
+def shard_filename(filename, rank=None, size=None):
+    """Name of the file in which an MPI rank writes its part of
+    `filename` (e.g. 'assignments.rank0-of-4.h5').
+
+    Parameters
+    ----------
+    filename : str
+        Path of the merged output file.
+    rank, size : int, optional
+        The rank writing the shard and the size of the swarm. Defaults
+        to this process's rank and the current swarm size.
+
+    Returns
+    -------
+    shard : str
+        Path of the shard file.
+    """
+
+    rank = mpi.rank() if rank is None else rank
+    size = mpi.size() if size is None else size
+
+    base, ext = os.path.splitext(filename)
+    return '%s.rank%s-of-%s%s' % (base, rank, size, ext)
+
+
+def merge_shards(filename, n_rows, size=None, owners=None):
+    """Merge the shards written by each MPI rank (see `shard_filename`)
+    into a single ragged array file, and remove them.
+
+    Row i is read from shard `owners[i]`, which holds its rows in their
+    original order. By default, rows are striped across shards, so row i
+    is read from shard i % n, where n is the number of shards. Rows are
+    copied one at a time.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the merged file to write.
+    n_rows : int
+        Total number of rows in the shards.
+    size : int, optional
+        Number of shards. Defaults to the current swarm size.
+    owners : np.ndarray, optional
+        The shard holding each row (e.g. from
+        `enspara.mpi.ops.balanced_owners`).
+    """
+
+    size = mpi.size() if size is None else size
+    if owners is None:
+        owners = mpi.ops.striped_owners(n_rows, size)
+    shards = [shard_filename(filename, r, size) for r in range(size)]
+
+    with contextlib.ExitStack() as stack:
+        sources = [stack.enter_context(ra.load(s, mmap_mode='r'))
+                   for s in shards]
+
+        n_held = sum(len(s) for s in sources)
+        if n_held != n_rows:
+            raise enspara.exception.DataInvalid(
+                "Shards of %s held %s rows, but %s were expected." %
+                (filename, n_held, n_rows))
+
+        next_row = [0] * size
+        with ra.RaggedArrayWriter(filename) as writer:
+            for owner in owners:
+                writer.append(sources[owner][next_row[owner]])
+                next_row[owner] += 1
+
+    for s in shards:
+        os.remove(s)
 
 
 def main(argv=None):
@@ -290,18 +719,25 @@ def main(argv=None):
 
     tick = time.perf_counter()
 
-    with open(args.centers, 'rb') as f:
-        centers = concatenate_trjs(
-            pickle.load(f), args.atoms,
-            enspara.util.parallel.auto_nprocs())
-    logger.info('Loaded %s centers with %s atoms using selection "%s" '
-                'in %.1f seconds.',
-                len(centers), centers.n_atoms, args.atoms,
-                time.perf_counter() - tick)
+    # in MPI mode, centers are loaded by rank 0 and broadcast by reassign
+    mpi_mode = mpi.size() > 1
+    centers = None
+    if mpi.rank() == 0:
+        with open(args.centers, 'rb') as f:
+            centers = concatenate_trjs(
+                pickle.load(f), args.atoms,
+                enspara.util.parallel.auto_nprocs())
+        logger.info('Loaded %s centers with %s atoms using selection "%s" '
+                    'in %.1f seconds.',
+                    len(centers), centers.n_atoms, args.atoms,
+                    time.perf_counter() - tick)
 
-    assig, dist = reassign(
+    reassign(
         args.topologies, args.trajectories, [args.atoms]*len(args.topologies),
-        centers=centers, frac_mem=args.mem_fraction)
+        centers=centers, frac_mem=args.mem_fraction,
+        assignments_file=args.assignments, distances_file=args.distances,
+        resume=args.resume, compact_dtypes=not args.exact_dtypes,
+        center_index=args.center_index, mpi_mode=mpi_mode)
 
     mem_highwater = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
     logger.info(
@@ -311,9 +747,6 @@ def main(argv=None):
         (mem_highwater / 1024**2),
         psutil.virtual_memory().total / 1024**3)
 
-    ra.save(args.distances, dist)
-    ra.save(args.assignments, assig)
-
     logger.info("Wrote distances at %s.", args.distances)
     logger.info("Wrote assignments at %s.", args.assignments)
 
@@ -36,9 +36,9 @@ def transitions(assignments):
         tt = np.where(d != 0)[0]
     else:
         d = assignments[:, 1:] - assignments[:, :-1]
-        rows, columns = ra.where(d != 0)
-        lengths = np.bincount(rows)
-        tt = ra.RaggedArray(columns, lengths=lengths)
+        changed = d != 0
+        rows, columns = ra.where(changed)
+        tt = ra.RaggedArray(columns, lengths=changed.sum(axis=1))
 
     return tt
 
@@ -17,6 +17,7 @@ from __future__ import print_function, division, absolute_import
 import logging
 
 from .. import geometry
+from ..util.load import TrajectoryStream
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -43,7 +44,9 @@ class RotamerFeaturizer(object):
         ----------
         trajectories: iterable, shape = n_trjs * (n_frames, n_features)
             Trajectories to consider for the calculation. Generators are
-            accepted and can be used to mitigate memory usage.
+            accepted and can be used to mitigate memory usage. So are
+            TrajectoryStreams, which load each trajectory in the
+            background while the previous one is featurized.
 
         References
         -------------
@@ -55,6 +58,8 @@ class RotamerFeaturizer(object):
 
         # to support both lists and generators, we use an iterator over
         # trajectories, so we have a consistent API.
+        if isinstance(trajectories, TrajectoryStream):
+            trajectories = trajectories.trajectories()
         trj_iter = iter(trajectories)
 
         # we need the first trajectory so we can call all_rotamers and get
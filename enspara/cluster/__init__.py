@@ -1,9 +1,11 @@
 """Library code for clustering tasks, including KCenters and KHybrid.
 """
 
+from . import balltree
 from . import hybrid
 from . import kcenters
 from . import kmedoids
 
+from .balltree import BallTree
 from .hybrid import KHybrid
 from .kcenters import KCenters
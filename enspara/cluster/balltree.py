@@ -0,0 +1,399 @@
+"""A metric ball tree over cluster centers, for finding the nearest
+center to many frames without computing the distance to every center.
+"""
+
+import logging
+
+import mdtraj as md
+import numpy as np
+
+from .. import exception
+from ..util.load import TrajectoryStream
+from ..geometry import libdist
+from .util import (
+    assign_to_nearest_center, _BLOCKED_METRICS, _centers_xyz,
+    _rmsd_kernel_kwargs)
+
+logger = logging.getLogger(__name__)
+
+# relative tolerance on the triangle-inequality bound, so that rounding
+# error in distances doesn't prune a ball holding the nearest center.
+PRUNE_SLACK = 1e-5
+
+# querying the tree only beats assign_to_nearest_center's native kernels
+# with about this many centers or more, and only where it skips most
+# distances, which it doesn't for unstructured, high-dimensional centers
+# (see BallTree.prunes_well and benchmarks/balltree_query.py).
+MIN_CENTERS = 2000
+MIN_PRUNED = 0.9
+N_PROBE_FRAMES = 32
+
+
+class BallTree:
+    """Index of cluster centers answering nearest-center queries.
+
+    Each node of the tree is a ball centered on one of the cluster
+    centers (its pivot) that contains every center below it. Queries
+    descend from the root, nearer balls first, and skip any ball that,
+    by the triangle inequality, can't contain a center nearer than the
+    nearest one found so far. The tree only requires that `metric` is a
+    metric (e.g. `md.rmsd` or the metrics in `enspara.geometry.libdist`),
+    and the number of distances computed grows sub-linearly with the
+    number of centers when centers are well-separated.
+
+    Queries are batched: each visit to a node computes the distance to
+    its pivot for every query frame still in contention at once, and
+    each leaf is scanned for every such frame in one pass, with
+    libdist's native kernels for RMSD and libdist's metrics (see
+    `assign_to_nearest_center`).
+
+    Parameters
+    ----------
+    centers : md.Trajectory, np.ndarray or list, shape=(n_centers, ...)
+        The cluster centers to index. A list of frames (e.g. the centers
+        found by k-centers) is joined into a single trajectory or array.
+    metric : callable(X, y)
+        Distance function between a set of frames `X` and a single
+        frame `y`, as used in clustering.
+    leaf_size : int, default=8
+        Largest number of centers in a leaf of the tree, whose distances
+        are computed without further pruning.
+
+    Attributes
+    ----------
+    n_centers : int
+        Number of centers in the index.
+    """
+
+    def __init__(self, centers, metric, leaf_size=8):
+
+        if leaf_size < 1:
+            raise exception.ImproperlyConfigured(
+                "BallTree leaf_size must be at least 1, got %s." % leaf_size)
+
+        if isinstance(centers, list):
+            if hasattr(centers[0], 'xyz'):
+                centers = md.join(centers)
+            else:
+                centers = np.array(centers)
+
+        self.centers = centers
+        self.metric = metric
+        self.n_centers = len(centers)
+
+        self._build(leaf_size)
+
+    def _build(self, leaf_size):
+
+        pivots, radii, children, leaf_bounds = [], [], [], []
+        leaf_members = []
+
+        def new_node(pivot):
+            pivots.append(pivot)
+            radii.append(0)
+            children.append((-1, -1))
+            leaf_bounds.append((-1, -1))
+            return len(pivots) - 1
+
+        members = np.arange(self.n_centers)
+        root_dists = _as_1d(self.metric(self.centers, self.centers[0]))
+
+        stack = [(new_node(0), members, root_dists)]
+        while stack:
+            node, members, dists = stack.pop()
+            radii[node] = np.max(dists)
+
+            # a farthest-point split: one child is centered on the member
+            # farthest from this pivot, the other on the member farthest
+            # from that, and the rest go to the nearer of the two.
+            if len(members) > leaf_size:
+                a = members[np.argmax(dists)]
+                dists_a = _as_1d(
+                    self.metric(self.centers[members], self.centers[a]))
+                b = members[np.argmax(dists_a)]
+                dists_b = _as_1d(
+                    self.metric(self.centers[members], self.centers[b]))
+
+                near_a = dists_a <= dists_b
+                if np.all(near_a):
+                    # every member is the same distance from both (e.g.
+                    # duplicate centers); it can't be split.
+                    near_a = None
+
+            if len(members) <= leaf_size or near_a is None:
+                leaf_bounds[node] = (len(leaf_members),
+                                     len(leaf_members) + len(members))
+                leaf_members.extend(members)
+            else:
+                left, right = new_node(a), new_node(b)
+                children[node] = (left, right)
+                stack.append((left, members[near_a], dists_a[near_a]))
+                stack.append((right, members[~near_a], dists_b[~near_a]))
+
+        self._pivots = np.array(pivots, dtype=np.int64)
+        self._radii = np.array(radii, dtype=np.float64)
+        self._children = np.array(children, dtype=np.int64).reshape(-1, 2)
+        self._leaf_bounds = np.array(
+            leaf_bounds, dtype=np.int64).reshape(-1, 2)
+        self._leaf_members = np.array(leaf_members, dtype=np.int64)
+
+        logger.debug("Built BallTree with %s nodes over %s centers.",
+                     len(self._pivots), self.n_centers)
+
+    def query(self, X, batch_size=65536):
+        """Find the nearest center to each frame of `X`.
+
+        Parameters
+        ----------
+        X : md.Trajectory, np.ndarray or TrajectoryStream
+            The frames to assign to centers. If a TrajectoryStream,
+            frames are assigned block by block.
+        batch_size : int, default=65536
+            Frames are assigned this many at a time, which bounds the
+            memory used by copies of the frames still in contention at
+            each node.
+
+        Returns
+        -------
+        assignments : np.ndarray, shape=(n_frames,)
+            The index of the nearest center to each frame in `X`. Ties
+            go to the first such center.
+        distances : np.ndarray, shape=(n_frames,)
+            The distance between each frame in `X` and its nearest
+            center.
+        """
+
+        if isinstance(X, TrajectoryStream) or len(X) > batch_size:
+            blocks = X if isinstance(X, TrajectoryStream) else (
+                X[start:start+batch_size]
+                for start in range(0, len(X), batch_size))
+
+            assignments = np.zeros(len(X), dtype=int)
+            distances = np.empty(len(X), dtype=float)
+
+            start = 0
+            for block in blocks:
+                stop = start + len(block)
+                assignments[start:stop], distances[start:stop] = \
+                    self.query(block, batch_size=batch_size)
+                start = stop
+
+            return assignments, distances
+
+        return self._query(X)
+
+    def prunes_well(self, X):
+        """Decide whether querying the tree would find the nearest
+        centers to the frames of `X` faster than comparing them to every
+        center with `assign_to_nearest_center`.
+
+        The tree is only worthwhile with at least `MIN_CENTERS` centers,
+        and if it skips at least `MIN_PRUNED` of the distances for a
+        sample of `N_PROBE_FRAMES` frames from `X`. The sample is
+        abandoned as soon as it computes more distances than that.
+
+        Parameters
+        ----------
+        X : md.Trajectory or np.ndarray
+            The frames to be assigned to centers.
+
+        Returns
+        -------
+        prunes_well : bool
+        """
+
+        if self.n_centers < MIN_CENTERS or len(X) == 0:
+            return False
+
+        sample = np.linspace(
+            0, len(X) - 1, min(len(X), N_PROBE_FRAMES)).astype(int)
+        max_evaluated = (1 - MIN_PRUNED) * len(sample) * self.n_centers
+
+        return self._query(_take(X, sample), max_evaluated) is not None
+
+    def _query(self, X, max_evaluated=np.inf):
+        # nearest centers for a batch of frames, or None if that takes
+        # more than max_evaluated distances.
+
+        assignments = np.zeros(len(X), dtype=int)
+        distances = np.full(len(X), np.inf)
+        if len(X) == 0:
+            return assignments, distances
+
+        is_pivot = np.zeros(self.n_centers, dtype=bool)
+        is_pivot[self._pivots] = True
+
+        n_evaluated = [0]
+        scan = self._scanner(X)
+
+        def visit_centers(queries, centers):
+            # distance from `queries` (indices into X) to the nearest of
+            # `centers`, updating each query's nearest center so far.
+            nearest, d = scan(queries, centers)
+            nearest = centers[nearest]
+            d = _as_1d(d)
+            n_evaluated[0] += len(queries) * len(centers)
+
+            nearer = (d < distances[queries]) | (
+                (d == distances[queries]) & (nearest < assignments[queries]))
+            distances[queries[nearer]] = d[nearer]
+            assignments[queries[nearer]] = nearest[nearer]
+            return d
+
+        queries = np.arange(len(X))
+        stack = [(0, queries, visit_centers(queries, self._pivots[:1]))]
+
+        while stack:
+            if n_evaluated[0] > max_evaluated:
+                return None
+
+            node, queries, pivot_dists = stack.pop()
+
+            # no center in this ball is nearer than pivot_dist - radius
+            bound = (pivot_dists - self._radii[node]) / (1 + PRUNE_SLACK)
+            keep = bound <= distances[queries]
+            queries = queries[keep]
+            pivot_dists = pivot_dists[keep]
+            if len(queries) == 0:
+                continue
+
+            left, right = self._children[node]
+            if left < 0:
+                # pivots were visited on the way down the tree; the rest
+                # are in order, so ties go to the first center.
+                start, stop = self._leaf_bounds[node]
+                members = np.sort(self._leaf_members[start:stop])
+                members = members[~is_pivot[members]]
+                if len(members):
+                    visit_centers(queries, members)
+                continue
+
+            left_dists = visit_centers(queries, self._pivots[left:left+1])
+            right_dists = visit_centers(queries,
+                                        self._pivots[right:right+1])
+
+            # each query visits the nearer child first, and the farther
+            # one once the nearer has tightened its bound (i.e., the
+            # farther visits are pushed onto the stack first).
+            left_first = left_dists <= right_dists
+            stack.append((right, queries[left_first],
+                          right_dists[left_first]))
+            stack.append((left, queries[~left_first],
+                          left_dists[~left_first]))
+            stack.append((left, queries[left_first],
+                          left_dists[left_first]))
+            stack.append((right, queries[~left_first],
+                          right_dists[~left_first]))
+
+        n_total = len(X) * self.n_centers
+        logger.debug(
+            "Evaluated %s of %s distances to find nearest centers "
+            "(%.1f%% pruned).", n_evaluated[0], n_total,
+            100 * (1 - n_evaluated[0] / n_total))
+
+        return assignments, distances
+
+    def _scanner(self, X):
+        # a function giving the nearest of some centers to some frames of
+        # X (each by index), and the distance to it, which uses libdist's
+        # kernels on the raw coordinates where the metric has one.
+        blocked_metric = _BLOCKED_METRICS.get(self.metric)
+        if (blocked_metric is not None and isinstance(X, np.ndarray) and
+                X.ndim == 2):
+            centers = np.asarray(self.centers)
+            return lambda queries, ids: libdist.cdist_argmin(
+                X[queries], centers[ids], blocked_metric)
+
+        rmsd_kwargs = _rmsd_kernel_kwargs(self.metric)
+        if rmsd_kwargs is not None and hasattr(X, 'xyz'):
+            centers_xyz = _centers_xyz(self.centers)
+            if (centers_xyz is not None and
+                    centers_xyz.shape[1] == X.xyz.shape[1]):
+                return lambda queries, ids: libdist.rmsd_argmin(
+                    X.xyz[queries], centers_xyz[ids], **rmsd_kwargs)
+
+        def scan(queries, ids):
+            frames = X if len(queries) == len(X) else _take(X, queries)
+            if isinstance(self.centers, list):
+                centers = [self.centers[i] for i in ids]
+            else:
+                centers = self.centers[ids]
+            return assign_to_nearest_center(
+                frames, centers, self.metric, prune=False)
+
+        return scan
+
+    def save(self, filename):
+        """Save the structure of the tree (but not the centers or
+        metric, which are saved with the clustering) to an .npz file.
+
+        Parameters
+        ----------
+        filename : str
+            Path to write the index to.
+        """
+
+        with open(filename, 'wb') as f:
+            np.savez(
+                f, n_centers=self.n_centers, pivots=self._pivots,
+                radii=self._radii, children=self._children,
+                leaf_bounds=self._leaf_bounds,
+                leaf_members=self._leaf_members)
+
+    @classmethod
+    def load(cls, filename, centers, metric):
+        """Load a tree saved with `save`, over the same centers.
+
+        Parameters
+        ----------
+        filename : str
+            Path to the saved index.
+        centers : md.Trajectory, np.ndarray or list
+            The centers the index was built over, in the same order.
+            Since loaded trees only look up individual centers, this may
+            also be a list of frames.
+        metric : callable(X, y)
+            The distance function the index was built with.
+
+        Returns
+        -------
+        tree : BallTree
+            The loaded index.
+        """
+
+        with np.load(filename) as f:
+            n_centers = int(f['n_centers'])
+            if n_centers != len(centers):
+                raise exception.DataInvalid(
+                    "Center index %s was built over %s centers, but %s "
+                    "centers were given." % (filename, n_centers,
+                                             len(centers)))
+
+            tree = cls.__new__(cls)
+            tree.centers = centers
+            tree.metric = metric
+            tree.n_centers = n_centers
+            tree._pivots = f['pivots']
+            tree._radii = f['radii']
+            tree._children = f['children']
+            tree._leaf_bounds = f['leaf_bounds']
+            tree._leaf_members = f['leaf_members']
+
+        return tree
+
+
+def _take(X, indices):
+    frames = X[indices]
+
+    # mdtraj copies, rather than slices, the traces of precentered
+    # trajectories, which precentered md.rmsd would then misread.
+    traces = getattr(X, '_rmsd_traces', None)
+    if traces is not None:
+        frames._rmsd_traces = traces[indices]
+
+    return frames
+
+
+def _as_1d(dists):
+    # some metrics (e.g. scipy's) give shape (n, 1) rather than (n,)
+    return np.asarray(dists, dtype=np.float64).reshape(-1)
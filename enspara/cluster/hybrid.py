@@ -44,6 +44,16 @@ class KHybrid(BaseEstimator, ClusterMixin, util.MolecularClusterMixin):
         Use the MPI version of the algorithm. This assumes that each node
         in the MPI swarm owns its own data. If None, it is determined
         automatically.
+    checkpoint : str, default=None
+        Periodically save the state of clustering to this file (see
+        `hybrid`).
+    checkpoint_every : int, default=None
+        Checkpoint every this many new k-centers centers.
+    checkpoint_seconds : float, default=None
+        Checkpoint when this many seconds have passed since the last
+        checkpoint.
+    resume : bool, default=False
+        If `checkpoint` exists, continue clustering from it.
 
     References
     ----------
@@ -54,7 +64,9 @@ class KHybrid(BaseEstimator, ClusterMixin, util.MolecularClusterMixin):
 
     def __init__(self, metric, n_clusters=None, cluster_radius=None,
                  kmedoids_updates=5, random_first_center=False,
-                 random_state=None, mpi_mode=None):
+                 random_state=None, mpi_mode=None, checkpoint=None,
+                 checkpoint_every=None, checkpoint_seconds=None,
+                 resume=False):
 
         if n_clusters is None and cluster_radius is None:
             raise ImproperlyConfigured("Either n_clusters or cluster_radius "
@@ -69,6 +81,11 @@ class KHybrid(BaseEstimator, ClusterMixin, util.MolecularClusterMixin):
         self.random_state = check_random_state(random_state)
         self.mpi_mode = mpi_mode if mpi_mode is not None else mpi.size() != 1
 
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_seconds = checkpoint_seconds
+        self.resume = resume
+
     def fit(self, X, init_centers=None):
         """Takes trajectories, X, and performs KHybrid clustering.
         Optionally continues clustering from an initial set of cluster
@@ -90,7 +107,11 @@ class KHybrid(BaseEstimator, ClusterMixin, util.MolecularClusterMixin):
             random_first_center=self.random_first_center,
             init_centers=init_centers,
             random_state=self.random_state,
-            mpi_mode=self.mpi_mode)
+            mpi_mode=self.mpi_mode,
+            checkpoint=self.checkpoint,
+            checkpoint_every=self.checkpoint_every,
+            checkpoint_seconds=self.checkpoint_seconds,
+            resume=self.resume)
 
         self.runtime_ = time.perf_counter() - t0
 
@@ -100,20 +121,53 @@ class KHybrid(BaseEstimator, ClusterMixin, util.MolecularClusterMixin):
 def hybrid(
         X, distance_method, n_iters=5, n_clusters=np.inf,
         dist_cutoff=0, random_first_center=False,
-        init_centers=None, random_state=None, mpi_mode=False):
+        init_centers=None, random_state=None, mpi_mode=False,
+        checkpoint=None, checkpoint_every=None, checkpoint_seconds=None,
+        resume=False):
+    """Function implementation of k-hybrid clustering, i.e. k-centers
+    followed by rounds of k-medoids updates.
+
+    With a `checkpoint`, k-centers is checkpointed as described in
+    `enspara.cluster.kcenters.kcenters`, and the state of clustering is
+    also checkpointed after every k-medoids update. On `resume`, the
+    k-medoids updates already made (and k-centers, if any were made)
+    are skipped.
+    """
 
     distance_method = util._get_distance_method(distance_method)
 
-    result = kcenters.kcenters(
-        X, distance_method, n_clusters=n_clusters, dist_cutoff=dist_cutoff,
-        init_centers=init_centers, random_first_center=random_first_center,
-        mpi_mode=mpi_mode)
-
-    cluster_center_inds, assignments, distances, centers = (
-        result.center_indices, result.assignments, result.distances,
-        result.centers)
-
-    for i in range(n_iters):
+    checkpointer, state = None, None
+    if checkpoint is not None:
+        checkpointer = kcenters._Checkpointer(checkpoint, mpi_mode=mpi_mode)
+        if resume:
+            state = checkpointer.load(X)
+
+    if state is not None and 'kmedoids_updates' in state:
+        cluster_center_inds, assignments, distances, centers = (
+            state['center_indices'], state['assignments'],
+            state['distances'], state['centers'])
+        first_update = int(state['kmedoids_updates'])
+        if isinstance(random_state, np.random.RandomState):
+            pos, has_gauss, cached_gaussian = state['rng_params']
+            random_state.set_state(
+                ('MT19937', state['rng_keys'], int(pos), int(has_gauss),
+                 cached_gaussian))
+        logger.info("Resuming after KMedoids update %s of %s from %s.",
+                    first_update, n_iters, checkpointer.filename)
+    else:
+        result = kcenters.kcenters(
+            X, distance_method, n_clusters=n_clusters,
+            dist_cutoff=dist_cutoff, init_centers=init_centers,
+            random_first_center=random_first_center, mpi_mode=mpi_mode,
+            checkpoint=checkpoint, checkpoint_every=checkpoint_every,
+            checkpoint_seconds=checkpoint_seconds, resume=resume)
+
+        cluster_center_inds, assignments, distances, centers = (
+            result.center_indices, result.assignments, result.distances,
+            result.centers)
+        first_update = 0
+
+    for i in range(first_update, n_iters):
         cluster_center_inds, distances, assignments, centers = \
             kmedoids._kmedoids_pam_update(
                 X, distance_method,
@@ -122,6 +176,18 @@ def hybrid(
 
         logger.info("KMedoids update %s of %s", i, n_iters)
 
+        if checkpointer is not None:
+            extra = {}
+            if isinstance(random_state, np.random.RandomState):
+                # so that a resumed run proposes the same medoids
+                _, keys, pos, has_gauss, cached_gaussian = \
+                    random_state.get_state()
+                extra['rng_keys'] = keys
+                extra['rng_params'] = [pos, has_gauss, cached_gaussian]
+            checkpointer.save(
+                cluster_center_inds, centers, assignments, distances,
+                kmedoids_updates=i + 1, **extra)
+
     return util.ClusterResult(
         center_indices=cluster_center_inds,
         assignments=assignments,
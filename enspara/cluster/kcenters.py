@@ -1,3 +1,4 @@
+import os
 import time
 import logging
 
@@ -7,7 +8,7 @@ from sklearn.base import BaseEstimator, ClusterMixin
 from sklearn.utils import check_random_state
 
 from ..util import log
-from ..exception import ImproperlyConfigured
+from ..exception import ImproperlyConfigured, DataInvalid
 from .. import mpi
 
 from . import util
@@ -47,17 +48,45 @@ class KCenters(BaseEstimator, ClusterMixin, util.MolecularClusterMixin):
         Use the MPI version of the algorithm. This assumes that each node
         in the MPI swarm owns its own data. If None, it is determined
         automatically.
+    checkpoint : str, default=None
+        Periodically save the state of clustering to this file (see
+        `kcenters`).
+    checkpoint_every : int, default=None
+        Checkpoint every this many new centers.
+    checkpoint_seconds : float, default=None
+        Checkpoint when this many seconds have passed since the last
+        checkpoint.
+    resume : bool, default=False
+        If `checkpoint` exists, continue clustering from it.
 
     References
     ----------
     .. [1] Gonzalez, T. F. Clustering to minimize the maximum
         intercluster distance. Theoretical Computer Science 38, 293–306
         (1985).
+
+    Attributes
+    ----------
+    comm_times_ : np.ndarray
+        In MPI mode, the time spent finding and distributing each new
+        center, plus the final search that ends clustering.
+    cluster_radii_ : np.ndarray, shape=(n_centers,)
+        The largest distance between each center and a frame assigned
+        to it, over all the data seen by `fit` and `partial_fit`. (Not
+        set in MPI mode.)
+    cluster_counts_ : np.ndarray, shape=(n_centers,)
+        The number of frames assigned to each center, over all the data
+        seen by `fit` and `partial_fit`. (Not set in MPI mode.)
+    n_frames_seen_ : int
+        The number of frames seen by `fit` and `partial_fit`. (Not set
+        in MPI mode.)
     """
 
     def __init__(
             self, metric, n_clusters=None, cluster_radius=None,
-            random_first_center=False, random_state=None, mpi_mode=None):
+            random_first_center=False, random_state=None, mpi_mode=None,
+            checkpoint=None, checkpoint_every=None, checkpoint_seconds=None,
+            resume=False):
 
         if n_clusters is None and cluster_radius is None:
             raise ImproperlyConfigured("Either n_clusters or cluster_radius "
@@ -72,6 +101,11 @@ class KCenters(BaseEstimator, ClusterMixin, util.MolecularClusterMixin):
         self.random_state = check_random_state(random_state)
         self.mpi_mode = mpi.size() != 1 if mpi_mode is None else mpi_mode
 
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_seconds = checkpoint_seconds
+        self.resume = resume
+
     def fit(self, X, init_centers=None):
         """Takes trajectories, X, and performs KCenters clustering.
         Optionally continues clustering from an initial set of cluster
@@ -87,6 +121,7 @@ class KCenters(BaseEstimator, ClusterMixin, util.MolecularClusterMixin):
 
         t0 = time.clock()
 
+        comm_times = []
         self.result_ = kcenters(
             X,
             distance_method=self.metric,
@@ -94,11 +129,121 @@ class KCenters(BaseEstimator, ClusterMixin, util.MolecularClusterMixin):
             dist_cutoff=self.cluster_radius,
             init_centers=init_centers,
             random_first_center=self.random_first_center,
-            mpi_mode=self.mpi_mode)
+            mpi_mode=self.mpi_mode,
+            comm_times=comm_times,
+            checkpoint=self.checkpoint,
+            checkpoint_every=self.checkpoint_every,
+            checkpoint_seconds=self.checkpoint_seconds,
+            resume=self.resume)
 
         self.runtime_ = time.clock() - t0
+        if self.mpi_mode:
+            self.comm_times_ = np.array(comm_times)
+        else:
+            n_centers = len(self.result_.centers)
+            self.cluster_radii_ = np.zeros(n_centers)
+            self.cluster_counts_ = np.zeros(n_centers, dtype=int)
+            self.n_frames_seen_ = 0
+            self._update_summary(
+                self.result_.assignments, self.result_.distances)
+        return self
+
+    def partial_fit(self, X):
+        """Update the clustering with new data, X, without revisiting
+        any data seen before.
+
+        The new frames are assigned to the existing centers, and then
+        k-centers continues among the new frames only, adding centers
+        until every new frame is within `cluster_radius` of a center
+        (or there are `n_clusters` centers). The cost is thus
+        proportional to the number of new frames, not to all the data
+        seen so far. The first call (with no previous `fit`) is
+        equivalent to `fit`.
+
+        Since frames seen before aren't revisited, they keep the center
+        they were assigned to even if a new center is nearer, so
+        `cluster_radii_` is an upper bound on each cluster's radius.
+
+        Parameters
+        ----------
+        X : array-like, shape=(n_observations, n_features(, n_atoms))
+            New data to cluster.
+
+        Returns
+        -------
+        self
+
+        Notes
+        -----
+        Afterwards, `labels_` and `distances_` are the assignments and
+        distances of the frames in `X` only, while `center_indices_`
+        gives the position of each center among all the frames seen so
+        far, in the order they were seen. Adding centers discards any
+        center index built with `build_index`.
+        """
+
+        if self.mpi_mode:
+            raise ImproperlyConfigured(
+                "KCenters.partial_fit isn't supported in MPI mode.")
+
+        if not hasattr(self, 'result_'):
+            return self.fit(X)
+
+        t0 = time.perf_counter()
+
+        centers = list(self.result_.centers)
+        center_inds = list(self.result_.center_indices)
+        n_old_centers = len(centers)
+
+        assignments, distances = util.assign_to_nearest_center(
+            X, centers, self.metric)
+        assignments = assignments.astype(int)
+        distances = distances.astype(float)
+
+        n_clusters = np.inf if self.n_clusters is None else self.n_clusters
+        dist_cutoff = 0 if self.cluster_radius is None else \
+            self.cluster_radius
+
+        while (len(X) > 0 and len(centers) < n_clusters and
+               distances.max() > dist_cutoff):
+            new_center_index = np.argmax(distances)
+            new_center = X[new_center_index]
+
+            dist = self.metric(X, new_center)
+            inds = dist < distances
+            distances[inds] = dist[inds]
+            assignments[inds] = len(centers)
+
+            centers.append(new_center)
+            center_inds.append(self.n_frames_seen_ + new_center_index)
+
+        n_new_centers = len(centers) - n_old_centers
+        if n_new_centers > 0:
+            self.cluster_radii_ = np.concatenate(
+                [self.cluster_radii_, np.zeros(n_new_centers)])
+            self.cluster_counts_ = np.concatenate(
+                [self.cluster_counts_, np.zeros(n_new_centers, dtype=int)])
+            self.index_ = None
+
+        self.result_ = util.ClusterResult(
+            center_indices=center_inds,
+            assignments=assignments,
+            distances=distances,
+            centers=centers)
+        self._update_summary(assignments, distances)
+
+        logger.info(
+            "Added %s centers (%s in total) for %s new frames in %.2f sec.",
+            n_new_centers, len(centers), len(X), time.perf_counter() - t0)
+
         return self
 
+    def _update_summary(self, assignments, distances):
+        np.maximum.at(self.cluster_radii_, assignments, distances)
+        self.cluster_counts_ += np.bincount(
+            assignments, minlength=len(self.cluster_counts_))
+        self.n_frames_seen_ += len(assignments)
+
 
 def kcenters_mpi(*args, **kwargs):
     kwargs.pop('mpi_mode', None)
@@ -107,7 +252,9 @@ def kcenters_mpi(*args, **kwargs):
 
 def kcenters(traj, distance_method, n_clusters=np.inf, dist_cutoff=0,
              init_centers=None, random_first_center=False,
-             use_triangle_inequality=False, mpi_mode=False):
+             use_triangle_inequality=False, mpi_mode=False, comm_times=None,
+             checkpoint=None, checkpoint_every=None, checkpoint_seconds=None,
+             resume=False):
     """Function implementation of the k-centers clustering algorithm.
 
     K-centers is essentially an outlier detection algorithm. It
@@ -154,6 +301,28 @@ def kcenters(traj, distance_method, n_clusters=np.inf, dist_cutoff=0,
         greater than half than its nearest intercluster distance to avoid
         recomputing some distances. This optimization was developed in
         ref [3]_.
+    mpi_mode : bool, default=False
+        Cluster data distributed across the nodes of an MPI swarm.
+    comm_times : list, default=None
+        In MPI mode, if a list is given, the time taken to find and
+        distribute each new center across nodes (which is mostly
+        communication latency) is appended to it.
+    checkpoint : str, default=None
+        Save the centers found so far, along with the assignments and
+        distances of every frame, to this .npz file whenever
+        `checkpoint_every` or `checkpoint_seconds` calls for it, and
+        once clustering finishes. In MPI mode, each node saves its own
+        frames to a file of its own (see `checkpoint_filename`).
+    checkpoint_every : int, default=None
+        Checkpoint every this many new centers.
+    checkpoint_seconds : float, default=None
+        Checkpoint when this many seconds have passed since the last
+        checkpoint. In MPI mode, rank 0's clock decides for every node,
+        and is checked every `MPI_CLOCK_EVERY` centers.
+    resume : bool, default=False
+        If `checkpoint` exists, continue clustering from the state it
+        holds rather than from `init_centers`. No distances to the
+        centers it holds are recomputed.
 
     Returns
     -------
@@ -192,7 +361,21 @@ def kcenters(traj, distance_method, n_clusters=np.inf, dist_cutoff=0,
         raise NotImplementedError(
             "We haven't implemented kcenters 'random_first_center' yet.")
 
-    if init_centers is None:
+    checkpointer = None
+    if checkpoint is not None:
+        checkpointer = _Checkpointer(
+            checkpoint, every=checkpoint_every, seconds=checkpoint_seconds,
+            mpi_mode=mpi_mode)
+
+    state = checkpointer.load(traj) if resume and checkpointer else None
+
+    if state is not None:
+        ctr_inds, centers, assignments, distances = (
+            state['center_indices'], state['centers'],
+            state['assignments'], state['distances'])
+        logger.info("Resuming k-centers from %s with %s centers.",
+                    checkpointer.filename, len(ctr_inds))
+    elif init_centers is None:
         ctr_inds = []
         centers = []
         assignments = np.full(len(traj), -1, dtype=int)
@@ -212,26 +395,48 @@ def kcenters(traj, distance_method, n_clusters=np.inf, dist_cutoff=0,
         iteration = _kcenters_iteration
         kwargs = {}
 
-    maxdist = (mpi.ops.striped_array_max(distances) if mpi_mode
-               else distances.max())
+    if mpi_mode:
+        if comm_times is None:
+            comm_times = []
+        next_center = _find_next_center_mpi(traj, distances, comm_times)
+        maxdist = next_center[0]
+    else:
+        maxdist = distances.max()
+
     while (len(ctr_inds) < n_clusters) and (maxdist > dist_cutoff):
 
+        if mpi_mode:
+            kwargs['next_center'] = next_center
+
         new_center, distances, assignments, center_inds = \
             iteration(traj, distance_method, distances, assignments, ctr_inds,
                       use_triangle_inequality=use_triangle_inequality,
                       **kwargs)
 
         centers.append(new_center)
-        maxdist = (mpi.ops.striped_array_max(distances) if mpi_mode
-                   else distances.max())
+
+        if mpi_mode:
+            next_center = _find_next_center_mpi(traj, distances, comm_times)
+            maxdist = next_center[0]
+        else:
+            maxdist = distances.max()
 
         if mpi.rank() == 0:
             logger.info(
                 "Center %s gives max dist of %.6f (stopping @ d=%.6f/n=%s).",
                 len(center_inds), maxdist, dist_cutoff, n_clusters)
 
+        if checkpointer is not None and checkpointer.due(len(ctr_inds)):
+            checkpointer.save(ctr_inds, centers, assignments, distances)
+
     logger.info("Terminated k-centers with n=%s and d=%0.6f.",
-                len(center_inds), maxdist,)
+                len(ctr_inds), maxdist,)
+    if checkpointer is not None and checkpointer.n_saved != len(ctr_inds):
+        checkpointer.save(ctr_inds, centers, assignments, distances)
+    if mpi_mode:
+        logger.info("Finding and distributing centers took %.2f sec "
+                    "(%.2f ms per center).", np.sum(comm_times),
+                    1000 * np.mean(comm_times))
 
     return util.ClusterResult(
         center_indices=ctr_inds,
@@ -240,6 +445,154 @@ def kcenters(traj, distance_method, n_clusters=np.inf, dist_cutoff=0,
         centers=centers)
 
 
+# in MPI mode, rank 0's clock is only shared (which takes a collective
+# operation) every this many centers, so that finding a new center is
+# otherwise still the only collective operation per center.
+MPI_CLOCK_EVERY = 50
+
+
+def checkpoint_filename(filename, mpi_mode=False):
+    """Name of the file in which this node saves its k-centers checkpoint
+    (e.g. 'kcenters.rank0-of-4.npz' in MPI mode).
+
+    Parameters
+    ----------
+    filename : str
+        Path of the checkpoint, as given to `kcenters`.
+    mpi_mode : bool, default=False
+        If True, give the path of this node's checkpoint.
+
+    Returns
+    -------
+    filename : str
+        Path of the checkpoint file.
+    """
+
+    if not mpi_mode:
+        return filename
+
+    base, ext = os.path.splitext(filename)
+    return '%s.rank%s-of-%s%s' % (base, mpi.rank(), mpi.size(), ext)
+
+
+class _Checkpointer(object):
+    """Decides when k-centers is due for a checkpoint, and saves and
+    loads checkpoints.
+    """
+
+    def __init__(self, filename, every=None, seconds=None, mpi_mode=False):
+        self.filename = checkpoint_filename(filename, mpi_mode)
+        self.every = every
+        self.seconds = seconds
+        self.mpi_mode = mpi_mode
+
+        self.n_saved = None
+        self.last_save = time.perf_counter()
+
+    def due(self, n_centers):
+        """Is a checkpoint due now that there are `n_centers` centers?"""
+
+        due = False
+        if self.every is not None:
+            due = n_centers - (self.n_saved or 0) >= self.every
+
+        if self.seconds is not None and self.mpi_mode:
+            # every node must checkpoint at the same center, so they go
+            # by rank 0's clock, which is only checked now and then.
+            if n_centers % MPI_CLOCK_EVERY == 0:
+                late = time.perf_counter() - self.last_save >= self.seconds
+                due = due or mpi.comm.bcast(late, root=0)
+        elif self.seconds is not None:
+            late = time.perf_counter() - self.last_save >= self.seconds
+            due = due or late
+
+        return due
+
+    def save(self, center_indices, centers, assignments, distances,
+             **extra):
+        """Atomically save the state of clustering, plus any `extra`
+        arrays, to the checkpoint file."""
+
+        if len(centers) and hasattr(centers[0], 'xyz'):
+            if centers[0].unitcell_vectors is not None:
+                extra['center_unitcell_lengths'] = np.concatenate(
+                    [c.unitcell_lengths for c in centers])
+                extra['center_unitcell_angles'] = np.concatenate(
+                    [c.unitcell_angles for c in centers])
+            centers = np.concatenate([c.xyz for c in centers])
+
+        tick = time.perf_counter()
+        tmp_fname = self.filename + '.tmp'
+        with open(tmp_fname, 'wb') as f:
+            np.savez(
+                f, center_indices=np.array(center_indices),
+                centers=np.array(centers), assignments=assignments,
+                distances=distances, n_frames=len(distances), **extra)
+        os.replace(tmp_fname, self.filename)
+
+        self.n_saved = len(center_indices)
+        self.last_save = time.perf_counter()
+        logger.info("Checkpointed %s centers to %s in %.2f sec.",
+                    self.n_saved, self.filename, self.last_save - tick)
+
+    def load(self, traj):
+        """Load the state saved in the checkpoint file for the frames in
+        `traj`, or None if there isn't a checkpoint.
+
+        Returns
+        -------
+        state : dict or None
+            Center indices, centers (as frames of `traj`), assignments,
+            distances and any extra arrays that were saved.
+        """
+
+        exists = os.path.exists(self.filename)
+        if self.mpi_mode:
+            all_exist = mpi.comm.allgather(exists)
+            if any(all_exist) and not all(all_exist):
+                raise DataInvalid(
+                    "Only ranks %s found their checkpoint file (e.g. %s)." %
+                    ([r for r, e in enumerate(all_exist) if e],
+                     self.filename))
+
+        if not exists:
+            logger.info("No checkpoint found at %s; starting afresh.",
+                        self.filename)
+            return None
+
+        with np.load(self.filename) as f:
+            state = {k: f[k] for k in f.files}
+
+        if state.pop('n_frames') != len(traj):
+            raise DataInvalid(
+                "Checkpoint %s holds %s frames, but %s were given." %
+                (self.filename, len(state['distances']), len(traj)))
+
+        n_centers = len(state['center_indices'])
+        if self.mpi_mode and len(set(mpi.comm.allgather(n_centers))) > 1:
+            raise DataInvalid(
+                "Checkpoints of different ranks (e.g. %s) hold different "
+                "numbers of centers." % self.filename)
+
+        state['center_indices'] = [
+            tuple(int(i) for i in c) if np.ndim(c) else int(c)
+            for c in state['center_indices']]
+
+        if hasattr(traj, 'xyz'):
+            n_centers = len(state['centers'])
+            lengths = state.pop('center_unitcell_lengths', [None]*n_centers)
+            angles = state.pop('center_unitcell_angles', [None]*n_centers)
+            state['centers'] = [
+                type(traj)(xyz=xyz[None], topology=traj.top,
+                           unitcell_lengths=l, unitcell_angles=a)
+                for xyz, l, a in zip(state['centers'], lengths, angles)]
+        else:
+            state['centers'] = list(state['centers'])
+
+        self.n_saved = n_centers
+        return state
+
+
 def _kcenters_iteration(
         traj, distance_method, distances, assignments, center_inds,
         use_triangle_inequality=False):
@@ -311,42 +664,49 @@ def _kcenters_iteration(
     return new_center, distances, assignments, center_inds
 
 
+def _find_next_center_mpi(traj, distances, comm_times):
+    """Find the frame farthest from every center across all nodes, and
+    distribute it to every node, in a single collective operation (see
+    `mpi.ops.striped_array_argmax`). The time this takes is appended to
+    `comm_times`.
+    """
+
+    tick = time.perf_counter()
+    next_center = mpi.ops.striped_array_argmax(distances, traj)
+    comm_times.append(time.perf_counter() - tick)
+
+    logger.debug("Found and distributed next center in %.4f sec",
+                 comm_times[-1])
+
+    return next_center
+
+
 def _kcenters_iteration_mpi(
         traj, distance_method, distances, assignments, center_inds,
-        centers, use_triangle_inequality=False):
+        centers, use_triangle_inequality=False, next_center=None):
     """The core inner loop of the kcenters iteration protocol. This can
     be used to start and stop doing kcenters (for example to save
     frequently or do checkpointing).
+
+    If `next_center`, the result of `mpi.ops.striped_array_argmax` for
+    `distances` and `traj`, is given, it's used as the new center rather
+    than being found again.
     """
 
     assert len(traj) == len(distances)
     assert len(traj) == len(assignments)
     assert np.issubdtype(type(assignments[0]), np.integer)
 
-    if len(center_inds) == 0:
-        new_cluster_center_index = 0
-        new_cluster_center_owner = 0
-    else:
-        with log.timed("Gathered distances in %.2f sec", logger.debug):
-            # this could likely be accomplished with mpi.reduce instead...
-            dist_locs = np.array(
-                mpi.comm.allgather(np.argmax(distances)))
-            dist_vals = np.array(
-                mpi.comm.allgather(np.max(distances)))
-
-        new_cluster_center_owner = np.argmax(dist_vals)
-        new_cluster_center_index = dist_locs[new_cluster_center_owner]
+    # with no centers, every distance is inf, and the first frame of
+    # rank 0 is chosen.
+    if next_center is None:
+        next_center = mpi.ops.striped_array_argmax(distances, traj)
+    _, new_cluster_center_owner, new_cluster_center_index, new_center = \
+        next_center
 
     logger.debug("Chose frame %s (node %s) as new center",
                  new_cluster_center_index, new_cluster_center_owner)
 
-    with log.timed("Distributed cluster ctr in %.2f sec",
-                   log_func=logger.info):
-        new_center = mpi.ops.distribute_frame(
-            data=traj,
-            world_index=new_cluster_center_index,
-            owner_rank=new_cluster_center_owner)
-
     with log.timed("Computed distance in %.2f sec", log_func=logger.info):
         if use_triangle_inequality and np.all(assignments >= 0):
             if hasattr(centers[0], 'xyz'):
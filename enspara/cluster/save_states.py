@@ -64,10 +64,15 @@ def save_states(
     reduced_iis = np.where((distances>-0.1)*(distances < largest_center))
     reduced_assignments = assignments[reduced_iis]
     reduced_distances = distances[reduced_iis]
+    # group frames by state, nearest to the center first, with a single
+    # sort rather than a scan over all frames for every state.
+    order = np.lexsort((reduced_distances, reduced_assignments))
+    sorted_assignments = reduced_assignments[order]
+    state_starts = np.searchsorted(sorted_assignments, state_nums, side='left')
+    state_stops = np.searchsorted(sorted_assignments, state_nums, side='right')
     centers_location = []
-    for state in state_nums:
-        state_iis = np.where(reduced_assignments == state)
-        nconfs_in_state = len(state_iis[0])
+    for state, start, stop in zip(state_nums, state_starts, state_stops):
+        nconfs_in_state = stop - start
         if nconfs_in_state >= n_confs:
             center_picks = np.array([0])
             if n_confs > 1:
@@ -79,10 +84,10 @@ def save_states(
             center_picks = np.array([0])
             center_picks = np.append(
                 center_picks, np.random.choice(nconfs_in_state, n_confs - 1))
-        state_centers = np.argsort(reduced_distances[state_iis])[center_picks]
+        state_centers = order[start:stop][center_picks]
         # Obtain information on conformation locations within trajectories
-        traj_locations = reduced_iis[0][state_iis[0][state_centers]]
-        frame_nums = reduced_iis[1][state_iis[0][state_centers]]
+        traj_locations = reduced_iis[0][state_centers]
+        frame_nums = reduced_iis[1][state_centers]
         for conf_num in range(n_confs):
             traj_num = traj_locations[conf_num]
             centers_location.append(
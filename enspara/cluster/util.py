@@ -8,16 +8,22 @@
 # Proprietary and confidential
 
 import logging
+import multiprocessing as mp
+import os
 from collections import namedtuple
+from functools import partial
 
 import mdtraj as md
 import numpy as np
 
+from ..geometry import libdist
 from ..geometry.libdist import euclidean
 
 from ..exception import ImproperlyConfigured, DataInvalid
-from ..util import partition_list, partition_indices
+from ..util import partition_indices
 from ..util import array as ra
+from ..util.load import frame_offsets, TrajectoryStream, \
+    _SEEKABLE_FORMATS
 
 logger = logging.getLogger(__name__)
 
@@ -27,10 +33,41 @@ class MolecularClusterMixin:
     trajectories.
     """
 
+    def build_index(self, leaf_size=8):
+        """Build a BallTree over the fitted centers, which `predict`
+        then uses to find each frame's nearest center without computing
+        its distance to every center.
+
+        Parameters
+        ----------
+        leaf_size : int, default=8
+            Largest number of centers in a leaf of the tree.
+
+        Returns
+        -------
+        self
+        """
+
+        if not hasattr(self, 'result_'):
+            raise ImproperlyConfigured(
+                "To build a center index, the clusterer first must have "
+                "fit some data.")
+
+        # balltree uses this module's assignment kernels
+        from .balltree import BallTree
+
+        self.index_ = BallTree(self.centers_, self.metric,
+                               leaf_size=leaf_size)
+        return self
+
     def predict(self, X):
         """Use an existing clustring fit to predict the assignments,
         distances, and center indices of on new data.new
 
+        If a center index has been built (see `build_index`) or loaded
+        into `index_`, it is used to find the nearest centers where that
+        is faster (see `BallTree.prunes_well`).
+
         See also: assign_to_nearest_center()
 
         Parameters
@@ -53,7 +90,8 @@ class MolecularClusterMixin:
         pred_assigs, pred_dists = assign_to_nearest_center(
             trajectory=X,
             cluster_centers=self.centers_,
-            distance_method=self.metric)
+            distance_method=self.metric,
+            index=getattr(self, 'index_', None))
         pred_centers = find_cluster_centers(pred_assigs, pred_dists)
 
         result = ClusterResult(
@@ -87,7 +125,7 @@ class ClusterResult(namedtuple('ClusterResult',
                                 'assignments',
                                 'centers'])):
 
-    def partition(self, lengths):
+    def partition(self, lengths, compact_dtypes=False):
         """Split each array in this ClusterResult into multiple
         subarrays of variable length.
 
@@ -95,6 +133,10 @@ class ClusterResult(namedtuple('ClusterResult',
         ----------
         lengths : array, shape=(n_subarrays)
             Length of each individual subarray.
+        compact_dtypes : bool, default=False
+            Store assignments in the smallest integer dtype that fits
+            the number of clusters and distances as float32 (see
+            `assignment_dtype` and `distance_dtype`).
 
         Returns
         -------
@@ -111,6 +153,13 @@ class ClusterResult(namedtuple('ClusterResult',
             partitioned arrays
         """
 
+        assignments = np.asarray(self.assignments)
+        distances = np.asarray(self.distances)
+        if compact_dtypes:
+            assignments = assignments.astype(
+                assignment_dtype(len(self.center_indices)), copy=False)
+            distances = distances.astype(distance_dtype(), copy=False)
+
         square = all(lengths[0] == l for l in lengths)
 
         if square:
@@ -118,9 +167,8 @@ class ClusterResult(namedtuple('ClusterResult',
                 'Lengths are homogenous (%s); using numpy arrays '
                 'as output to partitioning.', lengths[0])
             return ClusterResult(
-                assignments=np.array(partition_list(self.assignments,
-                                                    lengths)),
-                distances=np.array(partition_list(self.distances, lengths)),
+                assignments=assignments.reshape(len(lengths), -1),
+                distances=distances.reshape(len(lengths), -1),
                 center_indices=partition_indices(self.center_indices, lengths),
                 centers=self.centers)
         else:
@@ -129,21 +177,72 @@ class ClusterResult(namedtuple('ClusterResult',
                 'using RaggedArray as output to partitioning.',
                 np.median(lengths), np.min(lengths), np.max(lengths))
             return ClusterResult(
-                assignments=ra.RaggedArray(self.assignments, lengths=lengths),
-                distances=ra.RaggedArray(self.distances, lengths=lengths),
+                assignments=ra.RaggedArray.from_buffer(assignments, lengths),
+                distances=ra.RaggedArray.from_buffer(distances, lengths),
                 center_indices=partition_indices(self.center_indices, lengths),
                 centers=self.centers)
 
 
-def assign_to_nearest_center(trajectory, cluster_centers, distance_method):
+def assignment_dtype(n_clusters, compact=True):
+    """Choose the dtype used to store assignments to `n_clusters`
+    clusters.
+
+    The smallest signed integer type is chosen such that -1 (for
+    unassigned frames) and n_clusters both fit, so that expressions like
+    ``assignments.max() + 1`` cannot overflow.
+
+    Parameters
+    ----------
+    n_clusters : int
+        The number of clusters frames are assigned to.
+    compact : bool, default=True
+        If False, always use the default integer type (int64 on most
+        platforms), as earlier versions of enspara did.
+
+    Returns
+    -------
+    dtype : np.dtype
+    """
+
+    if not compact:
+        return np.dtype(int)
+
+    for dtype in [np.int8, np.int16, np.int32]:
+        if n_clusters <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def distance_dtype(compact=True):
+    """Choose the dtype used to store distances to cluster centers.
+
+    Parameters
+    ----------
+    compact : bool, default=True
+        If True, use float32, which is the precision of the coordinates
+        most distances are computed from. Otherwise, use float64.
+
+    Returns
+    -------
+    dtype : np.dtype
+    """
+
+    return np.dtype(np.float32 if compact else np.float64)
+
+
+def assign_to_nearest_center(trajectory, cluster_centers, distance_method,
+                             prune=None, index=None):
     """Assign each frame from trajectory to one of the given cluster centers
     using the given distance metric.
 
     Parameters
     ----------
-    trajectory: md.Trajectory or ndarray, shape=(n_frames, n_features, ...)
-        The frames to assign to a cluster_center. This parameter need
-        only implement `__len__` and  be accepted by `distance_method`.
+    trajectory: md.Trajectory, ndarray or TrajectoryStream
+        The frames to assign to a cluster_center, with shape (n_frames,
+        n_features, ...). This parameter need only implement `__len__`
+        and  be accepted by `distance_method`. If a TrajectoryStream,
+        frames are assigned block by block while the stream reads
+        ahead, and never need to be in memory all at once.
     cluster_centers : iterable
         Iterable containing some number of exemplar data that each datum
         in `trajectory` can be compared to using distance_method.
@@ -151,6 +250,19 @@ def assign_to_nearest_center(trajectory, cluster_centers, distance_method):
         The distance method to use for assigning each observation in
         trajectorys to one of the cluster_centers. Must take the entire
         trajectory and one item from cluster_centers as parameters.
+    prune : bool, default=None
+        Compute the distance between each pair of centers, and use the
+        triangle inequality to skip distances from frames to centers
+        that can't be nearest (i.e., center c can't be nearer to frame
+        x than center b if d(b, c) >= 2 d(x, b)). This requires that
+        `distance_method` is a metric. If None, prune if
+        `distance_method` is RMSD or one of libdist's metrics, there
+        are more frames than centers, and the tables of center-center
+        distances would take less than 2 GB.
+    index : BallTree, default=None
+        An index over `cluster_centers` (see
+        `MolecularClusterMixin.build_index`). It is queried instead if
+        it would be faster (see `BallTree.prunes_well`).
 
     Returns
     ----------
@@ -162,6 +274,45 @@ def assign_to_nearest_center(trajectory, cluster_centers, distance_method):
         frame in cluster_centers.
     """
 
+    if isinstance(trajectory, TrajectoryStream):
+        return _assign_stream_to_nearest_center(
+            trajectory, cluster_centers, distance_method, prune, index)
+
+    if index is not None and index.prunes_well(trajectory):
+        return index.query(trajectory)
+
+    blocked_metric = _BLOCKED_METRICS.get(distance_method)
+    rmsd_kwargs = _rmsd_kernel_kwargs(distance_method)
+
+    if prune is None:
+        prune = ((blocked_metric is not None or rmsd_kwargs is not None)
+                 and len(trajectory) > len(cluster_centers) > 1
+                 and 8 * len(cluster_centers)**2 <= _AUTO_PRUNE_MAX_BYTES)
+
+    # libdist's metrics have a kernel that compares each frame to every
+    # center in one pass over the data, rather than one pass per center.
+    if (blocked_metric is not None and len(cluster_centers) > 0 and
+            isinstance(trajectory, np.ndarray) and trajectory.ndim == 2):
+        return libdist.cdist_argmin(
+            trajectory, np.asarray(cluster_centers), blocked_metric,
+            prune=prune)
+
+    # likewise for RMSD, which is computed by libdist for every frame
+    # and center at once.
+    if (rmsd_kwargs is not None and len(cluster_centers) > 0 and
+            hasattr(trajectory, 'xyz')):
+        centers_xyz = _centers_xyz(cluster_centers)
+        if (centers_xyz is not None and
+                centers_xyz.shape[1] == trajectory.xyz.shape[1]):
+            return libdist.rmsd_argmin(
+                trajectory.xyz, centers_xyz, prune=prune, **rmsd_kwargs)
+
+    if prune and len(cluster_centers) > 1 and (
+            hasattr(cluster_centers, 'xyz') or
+            isinstance(cluster_centers, np.ndarray)):
+        return _assign_to_nearest_center_pruned(
+            trajectory, cluster_centers, distance_method)
+
     assignments = np.zeros(len(trajectory), dtype=int)
     distances = np.empty(len(trajectory), dtype=float)
     distances.fill(np.inf)
@@ -184,6 +335,64 @@ def assign_to_nearest_center(trajectory, cluster_centers, distance_method):
     return assignments, distances
 
 
+def _assign_to_nearest_center_pruned(trajectory, cluster_centers,
+                                     distance_method):
+    """Center-by-center assignment, as in assign_to_nearest_center, but
+    skipping frames that, by the triangle inequality, can't be nearer
+    the next center than to their current one.
+    """
+
+    assignments = np.zeros(len(trajectory), dtype=int)
+    distances = np.empty(len(trajectory), dtype=float)
+    distances.fill(np.inf)
+
+    center_dists = np.array([distance_method(cluster_centers, center)
+                             for center in cluster_centers])
+
+    n_evaluated = 0
+    for i, center in enumerate(cluster_centers):
+        # center i can only be nearer to frame x than its current center
+        # b if d(b, i) < 2 d(x, b). A little slack keeps rounding error
+        # from pruning ties, which go to the earlier center.
+        recompute = np.where(
+            2 * distances * (1 + 1e-5) >= center_dists[assignments, i])[0]
+        if len(recompute) == 0:
+            continue
+
+        dist = distance_method(trajectory[recompute], center)
+        n_evaluated += len(recompute)
+
+        inds = (dist < distances[recompute])
+        distances[recompute[inds]] = dist[inds]
+        assignments[recompute[inds]] = i
+
+    n_total = len(trajectory) * len(cluster_centers)
+    logger.debug(
+        "Evaluated %s of %s distances to find nearest centers "
+        "(%.1f%% pruned), plus %s center-center distances.",
+        n_evaluated, n_total, 100 * (1 - n_evaluated / max(n_total, 1)),
+        len(cluster_centers)**2)
+
+    return assignments, distances
+
+
+def _assign_stream_to_nearest_center(stream, cluster_centers,
+                                     distance_method, prune=None,
+                                     index=None):
+    assignments = np.zeros(len(stream), dtype=int)
+    distances = np.empty(len(stream), dtype=float)
+
+    start = 0
+    for block in stream:
+        stop = start + len(block)
+        assignments[start:stop], distances[start:stop] = \
+            assign_to_nearest_center(block, cluster_centers, distance_method,
+                                     prune=prune, index=index)
+        start = stop
+
+    return assignments, distances
+
+
 def find_cluster_centers(assignments, distances):
     """Given a list of distances and assignments, find the
     lowest-distance frame to each label in assignments.
@@ -221,7 +430,7 @@ def find_cluster_centers(assignments, distances):
     return center_inds
 
 
-def load_frames(filenames, indices, **kwargs):
+def load_frames(filenames, indices, processes=None, **kwargs):
     """Load specific frame indices from a list of trajectory files.
 
     Given a list of trajectory file names (`filenames`) and tuples
@@ -229,6 +438,11 @@ def load_frames(filenames, indices, **kwargs):
     given frames into a list of md.Trajectory objects. All additional
     kwargs are passed on to md.load_frame.
 
+    Each file is opened once and its frames are read in the order they
+    appear on disk. For XTC and TRR files, frames are found using a
+    cached index of frame offsets (see `enspara.util.load.frame_offsets`)
+    rather than by scanning the file.
+
     Parameters
     ----------
     indices: list, shape=(n_frames, 2)
@@ -237,6 +451,9 @@ def load_frames(filenames, indices, **kwargs):
     filenames: list, shape=(n_files)
         List of files to load frames from. The first position in indices
         is taken to refer to a position in this list.
+    processes : int, default=None
+        Number of processes to read files with in parallel. By default,
+        one per CPU.
     stride: int
         Treat the indices as having been computed using a stride, so
         mulitply the second index (frame number) by this number (e.g.
@@ -245,26 +462,115 @@ def load_frames(filenames, indices, **kwargs):
     Returns
     ----------
     centers: list
-        List of loaded trajectories.
+        List of loaded trajectories, in the order given by `indices`.
     """
 
     stride = kwargs.pop('stride', 1)
     if stride is None:
         stride = 1
 
-    centers = []
-    for i, j in indices:
-        try:
-            c = md.load_frame(filenames[i], index=j*stride, **kwargs)
-        except ValueError:
-            raise ImproperlyConfigured(
-                'Failed to load frame {fr} of {fn} using args {kw}.'.format(
-                    fn=filenames[i], fr=j*stride, kw=kwargs))
-        centers.append(c)
+    frames_by_file = {}
+    for position, (i, j) in enumerate(indices):
+        frames_by_file.setdefault(int(i), []).append((j*stride, position))
+
+    file_ids = sorted(frames_by_file)
+    for i in file_ids:
+        frames_by_file[i].sort()
+
+    jobs = [(filenames[i], [fr for fr, _ in frames_by_file[i]])
+            for i in file_ids]
+    load = partial(_load_frames_from_file, **kwargs)
+
+    if processes != 1 and len(jobs) > 1:
+        with mp.Pool(processes=processes) as pool:
+            loaded = pool.starmap(load, jobs)
+    else:
+        loaded = [load(*job) for job in jobs]
+
+    centers = [None] * len(indices)
+    for i, trjs in zip(file_ids, loaded):
+        for (_, position), trj in zip(frames_by_file[i], trjs):
+            centers[position] = trj
 
     return centers
 
 
+def _load_frames_from_file(filename, frames, **kwargs):
+    """Load the given (sorted) frames from one trajectory file."""
+
+    top = kwargs.get('top')
+    if isinstance(top, str):
+        top = md.load_topology(top)
+    elif isinstance(top, md.Trajectory):
+        top = top.topology
+
+    seekable = (os.path.splitext(filename)[1].lower() in _SEEKABLE_FORMATS
+                and isinstance(top, md.Topology)
+                and not set(kwargs) - {'top', 'atom_indices'})
+
+    try:
+        if not seekable:
+            return [md.load_frame(filename, index=fr, **kwargs)
+                    for fr in frames]
+
+        offsets = frame_offsets(filename)
+        trjs = []
+        with md.open(filename) as f:
+            if offsets is not None:
+                f.offsets = offsets
+            for fr in frames:
+                f.seek(fr)
+                trjs.append(f.read_as_traj(
+                    top, n_frames=1, atom_indices=kwargs.get('atom_indices')))
+                if len(trjs[-1]) != 1:
+                    raise ValueError("Frame %s is past the end of the file."
+                                     % fr)
+        return trjs
+    except (ValueError, OSError):
+        raise ImproperlyConfigured(
+            'Failed to load frames {fr} of {fn} using args {kw}.'.format(
+                fn=filename, fr=frames, kw=kwargs))
+
+
+# when pruning isn't specified, the largest tables of center-center
+# distances (8 bytes per pair of centers) to build automatically.
+_AUTO_PRUNE_MAX_BYTES = 2 * 1024**3
+
+_BLOCKED_METRICS = {
+    libdist.euclidean: 'euclidean',
+    libdist.manhattan: 'manhattan',
+    libdist.hamming: 'hamming',
+}
+
+
+def _rmsd_kernel_kwargs(distance_method):
+    """If `distance_method` is md.rmsd, perhaps with `precentered` bound
+    by functools.partial, the keyword arguments for libdist.rmsd_argmin
+    that compute the same distance. Otherwise, None.
+    """
+
+    if distance_method is md.rmsd:
+        return {}
+    if (isinstance(distance_method, partial) and
+            distance_method.func is md.rmsd and
+            not distance_method.args and
+            set(distance_method.keywords) <= {'precentered'}):
+        return dict(distance_method.keywords)
+    return None
+
+
+def _centers_xyz(cluster_centers):
+    """Coordinates of cluster centers given as an md.Trajectory or as a
+    list of them (e.g. individual frames), or None for other centers.
+    """
+
+    if hasattr(cluster_centers, 'xyz'):
+        return cluster_centers.xyz
+    if all(hasattr(c, 'xyz') for c in cluster_centers):
+        return np.concatenate([c.xyz for c in cluster_centers])
+    return None
+
+
 def _get_distance_method(metric):
     if metric == 'rmsd':
         return md.rmsd
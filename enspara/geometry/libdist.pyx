@@ -1,3 +1,5 @@
+import logging
+
 import numpy as np
 from cython.parallel import prange
 
@@ -6,6 +8,8 @@ from enspara import exception
 cimport cython
 cimport numpy as np
 
+logger = logging.getLogger(__name__)
+
 ctypedef fused FLOAT_TYPE_T:
     np.int8_t
     np.int16_t
@@ -24,10 +28,47 @@ ctypedef fused INTEGRAL_TYPE_T:
     np.int32_t
     np.int64_t
 
+ctypedef fused NUMERIC_T:
+    np.uint8_t
+    np.uint16_t
+    np.uint32_t
+    np.uint64_t
+    np.int8_t
+    np.int16_t
+    np.int32_t
+    np.int64_t
+    np.float32_t
+    np.float64_t
+
+ctypedef fused ACCUM_T:
+    np.float32_t
+    np.float64_t
+
 cdef extern from "math.h" nogil:
     double sqrt(double x)
     double fabs(double x)
     float fabs(float x)
+    double INFINITY
+
+# metrics implemented by the many-to-many kernels (cdist, cdist_argmin)
+cdef enum:
+    EUCLIDEAN = 0
+    MANHATTAN = 1
+    HAMMING = 2
+
+BLOCKED_METRICS = {'euclidean': EUCLIDEAN, 'manhattan': MANHATTAN,
+                   'hamming': HAMMING}
+
+# bytes of centers kept in cache while a tile of rows is compared to
+# them (about the size of an L1 data cache), and rows per tile.
+cdef enum:
+    _CENTER_TILE_BYTES = 32 * 1024
+    _ROW_TILE = 64
+
+# relative tolerance on triangle-inequality bounds when pruning, so
+# that rounding error in (single-precision) center-center distances
+# doesn't prune a center that is actually nearest.
+cdef double _PRUNE_SLACK = 1e-5
 
 def _check_is_2d(X):
     if len(X.shape) != 2:
@@ -201,3 +242,728 @@ def hamming(X, y, out=None):
     out = _prepare_for_2d_to_1d_distance(X, y, out)
     _hamming(X, y, out)
     return out
+
+
+def _prepare_for_2d_to_2d_distance(X, Y, metric, dtype):
+
+    _check_is_2d(X)
+    _check_is_2d(Y)
+    if X.shape[1] != Y.shape[1]:
+        raise exception.DataInvalid(
+            ("Center dimension (%s) must match data array dimension "
+             "(%s)") % (Y.shape[1], X.shape[1]))
+
+    if metric not in BLOCKED_METRICS:
+        raise exception.ImproperlyConfigured(
+            "Metric '%s' isn't one of the supported metrics, %s." %
+            (metric, sorted(BLOCKED_METRICS)))
+    if metric == 'hamming':
+        # single characters compare the same as their bytes
+        if X.dtype == np.dtype('S1'):
+            X = X.view(np.uint8)
+        if Y.dtype == np.dtype('S1'):
+            Y = Y.view(np.uint8)
+        if not (np.issubdtype(X.dtype, np.integer) and
+                np.issubdtype(Y.dtype, np.integer)):
+            raise exception.DataInvalid(
+                "Hamming distances require integer data, got '%s' and "
+                "'%s'." % (X.dtype, Y.dtype))
+
+    dtype = np.dtype(dtype)
+    if dtype not in (np.float32, np.float64):
+        raise exception.ImproperlyConfigured(
+            "Distances can be accumulated in np.float32 or np.float64, "
+            "not '%s'." % dtype)
+
+    # both operands must have the same type; this is usually free, since
+    # centers are generally frames of X.
+    common = np.result_type(X, Y)
+    X = np.ascontiguousarray(X, dtype=common)
+    Y = np.ascontiguousarray(Y, dtype=common)
+
+    center_tile = max(
+        _CENTER_TILE_BYTES // max(X.shape[1] * X.dtype.itemsize, 1), 1)
+
+    return X, Y, dtype, center_tile
+
+
+def _check_out(out, shape, dtype, name):
+    if out.dtype != dtype:
+        raise exception.DataInvalid(
+            "In-place %s array must be %s, got '%s'." %
+            (name, dtype, out.dtype))
+    if out.shape != shape:
+        raise exception.DataInvalid(
+            "In-place %s array must have shape %s, got %s." %
+            (name, shape, out.shape))
+    if not out.flags.c_contiguous:
+        raise exception.DataInvalid(
+            "In-place %s array must be C-contiguous." % name)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline ACCUM_T _distance(NUMERIC_T* x, NUMERIC_T* y, long n_features,
+                              int metric, ACCUM_T acc) nogil:
+    """Distance between the rows x and y, accumulated onto `acc` (which
+    should be 0, and whose type sets the precision)."""
+
+    cdef long j
+    cdef ACCUM_T diff
+
+    if metric == EUCLIDEAN:
+        for j in range(n_features):
+            diff = <ACCUM_T>x[j] - <ACCUM_T>y[j]
+            acc += diff * diff
+        return <ACCUM_T>sqrt(acc)
+    elif metric == MANHATTAN:
+        for j in range(n_features):
+            diff = <ACCUM_T>x[j] - <ACCUM_T>y[j]
+            acc += diff if diff >= 0 else -diff
+        return acc
+    else:
+        for j in range(n_features):
+            if x[j] != y[j]:
+                acc += 1
+        return acc / n_features
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _cdist(NUMERIC_T[:, ::1] X, NUMERIC_T[:, ::1] Y, ACCUM_T[:, ::1] out,
+           int metric, long center_tile):
+
+    cdef long n_samples = X.shape[0]
+    cdef long n_centers = Y.shape[0]
+    cdef long n_features = X.shape[1]
+    cdef long n_row_tiles = (n_samples + _ROW_TILE - 1) // _ROW_TILE
+    cdef long n_center_tiles = (n_centers + center_tile - 1) // center_tile
+
+    cdef long t, c, i, k
+
+    # each thread takes a tile of rows, and compares it to one cache-
+    # sized tile of centers at a time.
+    for t in prange(n_row_tiles, nogil=True, schedule='static'):
+        for c in range(n_center_tiles):
+            for i in range(t * _ROW_TILE, min((t + 1) * _ROW_TILE, n_samples)):
+                for k in range(c * center_tile,
+                               min((c + 1) * center_tile, n_centers)):
+                    out[i, k] = _distance(&X[i, 0], &Y[k, 0], n_features,
+                                          metric, <ACCUM_T>0)
+
+    return out
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _cdist_argmin(NUMERIC_T[:, ::1] X, NUMERIC_T[:, ::1] Y,
+                  np.int64_t[::1] assignments, ACCUM_T[::1] distances,
+                  int metric, long center_tile):
+
+    cdef long n_samples = X.shape[0]
+    cdef long n_centers = Y.shape[0]
+    cdef long n_features = X.shape[1]
+    cdef long n_row_tiles = (n_samples + _ROW_TILE - 1) // _ROW_TILE
+    cdef long n_center_tiles = (n_centers + center_tile - 1) // center_tile
+
+    cdef long t, c, i, k, best_k
+    cdef ACCUM_T d, best
+
+    for t in prange(n_row_tiles, nogil=True, schedule='static'):
+        for i in range(t * _ROW_TILE, min((t + 1) * _ROW_TILE, n_samples)):
+            distances[i] = INFINITY
+            assignments[i] = -1
+
+        for c in range(n_center_tiles):
+            for i in range(t * _ROW_TILE, min((t + 1) * _ROW_TILE, n_samples)):
+                best = distances[i]
+                best_k = assignments[i]
+                for k in range(c * center_tile,
+                               min((c + 1) * center_tile, n_centers)):
+                    d = _distance(&X[i, 0], &Y[k, 0], n_features,
+                                  metric, <ACCUM_T>0)
+                    # strictly less, so ties go to the first center
+                    if d < best:
+                        best = d
+                        best_k = k
+                distances[i] = best
+                assignments[i] = best_k
+
+    return assignments, distances
+
+
+def cdist(X, Y, metric='euclidean', out=None, dtype=np.float64):
+    """Compute the distance between every point in `X` and every point
+    in `Y`, in a single pass over `X`. Uses thread-parallelism with
+    OpenMP.
+
+    Rows of `X` are compared to cache-sized tiles of `Y`, so that each
+    is read from memory only once, rather than once per point in `Y` as
+    when calling `euclidean` for each of them.
+
+    Parameters
+    ----------
+    X : array, shape=(n_samples, n_features)
+        The group of points for which to compute distances.
+    Y : array, shape=(n_centers, n_features)
+        The points (e.g. cluster centers) to compute distances to.
+    metric : {'euclidean', 'manhattan', 'hamming'}, default='euclidean'
+        The distance to compute. Hamming distance requires integer (or
+        single-character) data.
+    out : array, shape=(n_samples, n_centers), default=None
+        If provided, the C-contiguous array of type `dtype` to place the
+        distances in. If not provided, an array will be allocated for
+        you.
+    dtype : {np.float64, np.float32}, default=np.float64
+        The type in which distances are accumulated and returned.
+        Accumulating in np.float32 is faster, but less precise.
+
+    Returns
+    -------
+    out : array, shape=(n_samples, n_centers)
+        The distance between each point in `X` and each in `Y`.
+    """
+
+    X, Y, dtype, center_tile = _prepare_for_2d_to_2d_distance(
+        X, Y, metric, dtype)
+
+    shape = (X.shape[0], Y.shape[0])
+    if out is None:
+        out = np.zeros(shape, dtype=dtype)
+    else:
+        _check_out(out, shape, dtype, 'output')
+
+    _cdist(X, Y, out, BLOCKED_METRICS[metric], center_tile)
+    return out
+
+
+def cdist_argmin(X, Y, metric='euclidean', assignments=None,
+                 distances=None, dtype=np.float64, prune=False):
+    """Find the nearest point in `Y` to every point in `X`, and the
+    distance to it, in a single pass over `X` (i.e. a fused
+    ``argmin``/``min`` over `cdist`, without storing every distance).
+    Uses thread-parallelism with OpenMP.
+
+    Parameters
+    ----------
+    X : array, shape=(n_samples, n_features)
+        The group of points to find the nearest point in `Y` for.
+    Y : array, shape=(n_centers, n_features)
+        The points (e.g. cluster centers) to compute distances to.
+    metric : {'euclidean', 'manhattan', 'hamming'}, default='euclidean'
+        The distance to compute. Hamming distance requires integer (or
+        single-character) data.
+    assignments : array, shape=(n_samples), default=None
+        If provided, the np.int64 array in which to place the index of
+        the nearest point in `Y`. Ties go to the first such point.
+    distances : array, shape=(n_samples), default=None
+        If provided, the array of type `dtype` in which to place the
+        distance to the nearest point in `Y`.
+    dtype : {np.float64, np.float32}, default=np.float64
+        The type in which distances are accumulated and returned.
+    prune : bool, default=False
+        Skip distances that the triangle inequality shows can't be the
+        nearest (see `prune_tables`). This is worthwhile when `X` is
+        much larger than `Y`.
+
+    Returns
+    -------
+    assignments : array, shape=(n_samples)
+        The index of the nearest point in `Y` to each point in `X`.
+    distances : array, shape=(n_samples)
+        The distance from each point in `X` to its nearest point in `Y`.
+    """
+
+    X, Y, dtype, center_tile = _prepare_for_2d_to_2d_distance(
+        X, Y, metric, dtype)
+
+    if assignments is None:
+        assignments = np.zeros(X.shape[0], dtype=np.int64)
+    else:
+        _check_out(assignments, (X.shape[0],), np.int64, 'assignments')
+    if distances is None:
+        distances = np.zeros(X.shape[0], dtype=dtype)
+    else:
+        _check_out(distances, (X.shape[0],), dtype, 'distances')
+
+    if prune and Y.shape[0] > 1:
+        order, sorted_cc = prune_tables(
+            cdist(Y, Y, metric, dtype=dtype))
+        n_evaluated = _cdist_argmin_pruned(
+            X, Y, order, sorted_cc, assignments, distances,
+            BLOCKED_METRICS[metric])
+        _log_pruning(n_evaluated, X.shape[0], Y.shape[0])
+    else:
+        _cdist_argmin(X, Y, assignments, distances,
+                      BLOCKED_METRICS[metric], center_tile)
+    return assignments, distances
+
+
+def prune_tables(center_distances):
+    """Build the tables used to prune distance evaluations when finding
+    each point's nearest center.
+
+    For each center `g`, the other centers are sorted by their distance
+    to `g`. To find the nearest center to a point `x`, centers are then
+    scanned outward from a guess `g`: by the triangle inequality,
+    ``d(x, c) >= d(g, c) - d(x, g)``, so once ``d(g, c)`` reaches
+    ``d(x, g) + d(x, best)`` no further center can be nearer than the
+    best found so far, and the scan stops. (When `g` is the nearest
+    center, this is the condition ``d(g, c) >= 2 d(x, g)``.) The guess
+    for each point is the nearest center to the point before it, which
+    for frames of a trajectory is usually nearest.
+
+    Parameters
+    ----------
+    center_distances : array, shape=(n_centers, n_centers)
+        Distance between every pair of centers.
+
+    Returns
+    -------
+    order : array, shape=(n_centers, n_centers)
+        For each center, the indices of every center sorted by
+        distance to it, as np.int32.
+    sorted_distances : array, shape=(n_centers, n_centers)
+        For each center, the distance to each center in `order`, as
+        np.float32.
+
+    Notes
+    -----
+    The tables take 8 bytes per pair of centers, i.e. 800 MB for 10,000
+    centers.
+    """
+
+    n_centers = center_distances.shape[0]
+    order = np.empty((n_centers, n_centers), dtype=np.int32)
+    sorted_distances = np.empty((n_centers, n_centers), dtype=np.float32)
+
+    # sort in blocks to avoid an (n_centers, n_centers) int64 temporary
+    for start in range(0, n_centers, 1024):
+        block = center_distances[start:start+1024]
+        block_order = np.argsort(block, axis=1, kind='mergesort')
+        order[start:start+1024] = block_order
+        sorted_distances[start:start+1024] = block[
+            np.arange(len(block))[:, None], block_order]
+
+    return order, sorted_distances
+
+
+def _log_pruning(n_evaluated, n_samples, n_centers):
+    n_total = n_samples * n_centers
+    logger.debug(
+        "Evaluated %s of %s distances to find nearest centers "
+        "(%.1f%% pruned), plus %s center-center distances.",
+        n_evaluated, n_total,
+        100 * (1 - n_evaluated / max(n_total, 1)), n_centers * n_centers)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _cdist_argmin_pruned(NUMERIC_T[:, ::1] X, NUMERIC_T[:, ::1] Y,
+                         np.int32_t[:, ::1] order,
+                         np.float32_t[:, ::1] sorted_cc,
+                         np.int64_t[::1] assignments, ACCUM_T[::1] distances,
+                         int metric):
+    """Pruned equivalent of _cdist_argmin (see `prune_tables`); returns
+    the number of distances evaluated.
+    """
+
+    cdef long n_samples = X.shape[0]
+    cdef long n_centers = Y.shape[0]
+    cdef long n_features = X.shape[1]
+    cdef long n_row_tiles = (n_samples + _ROW_TILE - 1) // _ROW_TILE
+
+    cdef long t, i, j, k, g, best_k
+    cdef long n_evaluated = 0
+    cdef ACCUM_T d, dg, best
+
+    for t in prange(n_row_tiles, nogil=True, schedule='static'):
+        g = 0
+        for i in range(t * _ROW_TILE, min((t + 1) * _ROW_TILE, n_samples)):
+            dg = _distance(&X[i, 0], &Y[g, 0], n_features, metric,
+                           <ACCUM_T>0)
+            n_evaluated += 1
+            best = dg
+            best_k = g
+            for j in range(n_centers):
+                if sorted_cc[g, j] > (dg + best) * (1 + _PRUNE_SLACK):
+                    break
+                k = order[g, j]
+                if k == g:
+                    continue
+                d = _distance(&X[i, 0], &Y[k, 0], n_features, metric,
+                              <ACCUM_T>0)
+                n_evaluated += 1
+                if d < best or (d == best and k < best_k):
+                    best = d
+                    best_k = k
+            distances[i] = best
+            assignments[i] = best_k
+            g = best_k
+
+    return n_evaluated
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def _centroids_and_traces(np.float32_t[:, :, ::1] X, bint precentered,
+                          double[:, ::1] centroids, double[::1] traces):
+
+    cdef long n_frames = X.shape[0]
+    cdef long n_atoms = X.shape[1]
+    cdef long i, a
+    cdef double cx, cy, cz, g
+
+    for i in prange(n_frames, nogil=True, schedule='static'):
+        cx = 0
+        cy = 0
+        cz = 0
+        g = 0
+        for a in range(n_atoms):
+            cx = cx + X[i, a, 0]
+            cy = cy + X[i, a, 1]
+            cz = cz + X[i, a, 2]
+            g = g + (<double>X[i, a, 0] * X[i, a, 0] +
+                     <double>X[i, a, 1] * X[i, a, 1] +
+                     <double>X[i, a, 2] * X[i, a, 2])
+
+        if precentered:
+            cx = 0
+            cy = 0
+            cz = 0
+        else:
+            cx = cx / n_atoms
+            cy = cy / n_atoms
+            cz = cz / n_atoms
+
+        centroids[i, 0] = cx
+        centroids[i, 1] = cy
+        centroids[i, 2] = cz
+        # trace of the centered frame, sum |x - c|^2
+        traces[i] = g - n_atoms * (cx*cx + cy*cy + cz*cz)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline double _qcp_rmsd(np.float32_t* x, double* cx, double gx,
+                             np.float32_t* y, double* cy, double gy,
+                             long n_atoms) nogil:
+    """Minimum RMSD between frames x and y after optimal superposition,
+    by finding the largest eigenvalue of the quaternion key matrix with
+    the QCP method [1]. The centered inner product matrix is computed
+    from the raw coordinates and the frames' centroids, `cx` and `cy`,
+    so that the frames needn't be copied to center them; `gx` and `gy`
+    are the traces of the centered frames.
+
+    References
+    ----------
+    [1] Theobald, D. L. Rapid calculation of RMSDs using a quaternion-
+        based characteristic polynomial. Acta Cryst. A61, 478-480
+        (2005).
+    """
+
+    cdef long a
+    cdef double x0, x1, x2, y0, y1, y2
+    cdef double Sxx = 0, Sxy = 0, Sxz = 0
+    cdef double Syx = 0, Syy = 0, Syz = 0
+    cdef double Szx = 0, Szy = 0, Szz = 0
+
+    for a in range(n_atoms):
+        x0 = x[3*a]
+        x1 = x[3*a + 1]
+        x2 = x[3*a + 2]
+        y0 = y[3*a]
+        y1 = y[3*a + 1]
+        y2 = y[3*a + 2]
+        Sxx = Sxx + x0 * y0
+        Sxy = Sxy + x0 * y1
+        Sxz = Sxz + x0 * y2
+        Syx = Syx + x1 * y0
+        Syy = Syy + x1 * y1
+        Syz = Syz + x1 * y2
+        Szx = Szx + x2 * y0
+        Szy = Szy + x2 * y1
+        Szz = Szz + x2 * y2
+
+    # sum (x - cx)(y - cy)^T = sum x y^T - n cx cy^T
+    Sxx = Sxx - n_atoms * cx[0] * cy[0]
+    Sxy = Sxy - n_atoms * cx[0] * cy[1]
+    Sxz = Sxz - n_atoms * cx[0] * cy[2]
+    Syx = Syx - n_atoms * cx[1] * cy[0]
+    Syy = Syy - n_atoms * cx[1] * cy[1]
+    Syz = Syz - n_atoms * cx[1] * cy[2]
+    Szx = Szx - n_atoms * cx[2] * cy[0]
+    Szy = Szy - n_atoms * cx[2] * cy[1]
+    Szz = Szz - n_atoms * cx[2] * cy[2]
+
+    cdef double Sxx2 = Sxx * Sxx, Syy2 = Syy * Syy, Szz2 = Szz * Szz
+    cdef double Sxy2 = Sxy * Sxy, Syz2 = Syz * Syz, Sxz2 = Sxz * Sxz
+    cdef double Syx2 = Syx * Syx, Szy2 = Szy * Szy, Szx2 = Szx * Szx
+
+    cdef double SyzSzymSyySzz2 = 2.0 * (Syz * Szy - Syy * Szz)
+    cdef double Sxx2Syy2Szz2Syz2Szy2 = Syy2 + Szz2 - Sxx2 + Syz2 + Szy2
+    cdef double Sxy2Sxz2Syx2Szx2 = Sxy2 + Sxz2 - Syx2 - Szx2
+
+    cdef double SxzpSzx = Sxz + Szx, SyzpSzy = Syz + Szy
+    cdef double SxypSyx = Sxy + Syx, SyzmSzy = Syz - Szy
+    cdef double SxzmSzx = Sxz - Szx, SxymSyx = Sxy - Syx
+    cdef double SxxpSyy = Sxx + Syy, SxxmSyy = Sxx - Syy
+
+    # coefficients of the key matrix's characteristic polynomial,
+    # x^4 + c2 x^2 + c1 x + c0
+    cdef double c2 = -2.0 * (Sxx2 + Syy2 + Szz2 + Sxy2 + Syx2 + Sxz2 +
+                             Szx2 + Syz2 + Szy2)
+    cdef double c1 = 8.0 * (Sxx * Syz * Szy + Syy * Szx * Sxz +
+                            Szz * Sxy * Syx - Sxx * Syy * Szz -
+                            Syz * Szx * Sxy - Szy * Syx * Sxz)
+    cdef double c0 = (
+        Sxy2Sxz2Syx2Szx2 * Sxy2Sxz2Syx2Szx2 +
+        (Sxx2Syy2Szz2Syz2Szy2 + SyzSzymSyySzz2) *
+        (Sxx2Syy2Szz2Syz2Szy2 - SyzSzymSyySzz2) +
+        (-SxzpSzx * SyzmSzy + SxymSyx * (SxxmSyy - Szz)) *
+        (-SxzmSzx * SyzpSzy + SxymSyx * (SxxmSyy + Szz)) +
+        (-SxzpSzx * SyzpSzy - SxypSyx * (SxxpSyy - Szz)) *
+        (-SxzmSzx * SyzmSzy - SxypSyx * (SxxpSyy + Szz)) +
+        (SxypSyx * SyzpSzy + SxzpSzx * (SxxmSyy + Szz)) *
+        (-SxymSyx * SyzmSzy + SxzpSzx * (SxxpSyy + Szz)) +
+        (SxypSyx * SyzmSzy + SxzmSzx * (SxxmSyy - Szz)) *
+        (-SxymSyx * SyzpSzy + SxzmSzx * (SxxpSyy - Szz)))
+
+    # Newton's method from the upper bound on the largest eigenvalue
+    cdef double e0 = 0.5 * (gx + gy)
+    cdef double lam = e0, old_lam, lam2, b, c, slope
+    cdef int it
+
+    for it in range(50):
+        old_lam = lam
+        lam2 = lam * lam
+        b = (lam2 + c2) * lam
+        c = b + c1
+        slope = 2.0 * lam2 * lam + b + c
+        # zero for degenerate frames, e.g. single atoms
+        if slope == 0:
+            break
+        lam = lam - (c * lam + c0) / slope
+        if fabs(lam - old_lam) < fabs(1e-11 * lam):
+            break
+
+    return sqrt(fabs(2.0 * (e0 - lam) / n_atoms))
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _rmsd_argmin(np.float32_t[:, :, ::1] X, double[:, ::1] X_centroids,
+                 double[::1] X_traces,
+                 np.float32_t[:, :, ::1] Y, double[:, ::1] Y_centroids,
+                 double[::1] Y_traces,
+                 np.int64_t[::1] assignments, double[::1] distances,
+                 long center_tile):
+
+    cdef long n_frames = X.shape[0]
+    cdef long n_centers = Y.shape[0]
+    cdef long n_atoms = X.shape[1]
+    cdef long n_row_tiles = (n_frames + _ROW_TILE - 1) // _ROW_TILE
+    cdef long n_center_tiles = (n_centers + center_tile - 1) // center_tile
+
+    cdef long t, c, i, k, best_k
+    cdef double d, best
+
+    for t in prange(n_row_tiles, nogil=True, schedule='static'):
+        for i in range(t * _ROW_TILE, min((t + 1) * _ROW_TILE, n_frames)):
+            distances[i] = INFINITY
+            assignments[i] = -1
+
+        for c in range(n_center_tiles):
+            for i in range(t * _ROW_TILE, min((t + 1) * _ROW_TILE, n_frames)):
+                best = distances[i]
+                best_k = assignments[i]
+                for k in range(c * center_tile,
+                               min((c + 1) * center_tile, n_centers)):
+                    d = _qcp_rmsd(
+                        &X[i, 0, 0], &X_centroids[i, 0], X_traces[i],
+                        &Y[k, 0, 0], &Y_centroids[k, 0], Y_traces[k],
+                        n_atoms)
+                    if d < best:
+                        best = d
+                        best_k = k
+                distances[i] = best
+                assignments[i] = best_k
+
+    return assignments, distances
+
+
+def _rmsd_operand(xyz, precentered):
+
+    if xyz.ndim != 3 or xyz.shape[2] != 3:
+        raise exception.DataInvalid(
+            "Coordinates must have shape (n_frames, n_atoms, 3), got %s." %
+            (xyz.shape,))
+
+    xyz = np.ascontiguousarray(xyz, dtype=np.float32)
+    centroids = np.empty((xyz.shape[0], 3), dtype=np.float64)
+    traces = np.empty(xyz.shape[0], dtype=np.float64)
+    _centroids_and_traces(xyz, precentered, centroids, traces)
+
+    return xyz, centroids, traces
+
+
+def rmsd_argmin(X, Y, precentered=False, assignments=None,
+                distances=None, prune=False):
+    """Find the nearest frame in `Y` to every frame in `X` by minimum
+    RMSD after optimal superposition, and the RMSD to it, in a single
+    pass over `X`. Uses thread-parallelism with OpenMP.
+
+    Each frame's centroid and trace are computed once, and each pair of
+    frames is superposed with the QCP method, keeping only the running
+    nearest frame in `Y`. Frames need not be centered beforehand (and
+    are not modified).
+
+    Parameters
+    ----------
+    X : array, shape=(n_frames, n_atoms, 3)
+        Coordinates of the frames to find the nearest frame in `Y` for,
+        e.g. `md.Trajectory.xyz`. Coordinates are used in single
+        precision, like mdtraj.
+    Y : array, shape=(n_centers, n_atoms, 3)
+        Coordinates of the frames (e.g. cluster centers) to compute
+        RMSDs to.
+    precentered : bool, default=False
+        If True, assume that the frames in `X` and `Y` are already
+        centered at the origin, as with `md.rmsd`.
+    assignments : array, shape=(n_frames), default=None
+        If provided, the np.int64 array in which to place the index of
+        the nearest frame in `Y`. Ties go to the first such frame.
+    distances : array, shape=(n_frames), default=None
+        If provided, the np.float64 array in which to place the RMSD to
+        the nearest frame in `Y`.
+    prune : bool, default=False
+        Skip RMSDs that the triangle inequality shows can't be the
+        nearest (see `prune_tables`). This is worthwhile when `X` is
+        much larger than `Y`.
+
+    Returns
+    -------
+    assignments : array, shape=(n_frames)
+        The index of the nearest frame in `Y` to each frame in `X`.
+    distances : array, shape=(n_frames)
+        The RMSD from each frame in `X` to its nearest frame in `Y`.
+    """
+
+    X, X_centroids, X_traces = _rmsd_operand(np.asarray(X), precentered)
+    Y, Y_centroids, Y_traces = _rmsd_operand(np.asarray(Y), precentered)
+
+    if X.shape[1] != Y.shape[1]:
+        raise exception.DataInvalid(
+            ("Number of atoms in centers (%s) must match number of atoms "
+             "in frames (%s)") % (Y.shape[1], X.shape[1]))
+
+    if assignments is None:
+        assignments = np.zeros(X.shape[0], dtype=np.int64)
+    else:
+        _check_out(assignments, (X.shape[0],), np.int64, 'assignments')
+    if distances is None:
+        distances = np.zeros(X.shape[0], dtype=np.float64)
+    else:
+        _check_out(distances, (X.shape[0],), np.float64, 'distances')
+
+    center_tile = max(
+        _CENTER_TILE_BYTES // max(Y.shape[1] * 3 * Y.dtype.itemsize, 1), 1)
+
+    if prune and Y.shape[0] > 1:
+        center_rmsds = np.empty((Y.shape[0], Y.shape[0]), dtype=np.float32)
+        _rmsd_cdist(Y, Y_centroids, Y_traces, Y, Y_centroids, Y_traces,
+                    center_rmsds, center_tile)
+        order, sorted_cc = prune_tables(center_rmsds)
+        del center_rmsds
+
+        n_evaluated = _rmsd_argmin_pruned(
+            X, X_centroids, X_traces, Y, Y_centroids, Y_traces,
+            order, sorted_cc, assignments, distances)
+        _log_pruning(n_evaluated, X.shape[0], Y.shape[0])
+    else:
+        _rmsd_argmin(X, X_centroids, X_traces, Y, Y_centroids, Y_traces,
+                     assignments, distances, center_tile)
+    return assignments, distances
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _rmsd_cdist(np.float32_t[:, :, ::1] X, double[:, ::1] X_centroids,
+                double[::1] X_traces,
+                np.float32_t[:, :, ::1] Y, double[:, ::1] Y_centroids,
+                double[::1] Y_traces,
+                np.float32_t[:, ::1] out, long center_tile):
+
+    cdef long n_frames = X.shape[0]
+    cdef long n_centers = Y.shape[0]
+    cdef long n_atoms = X.shape[1]
+    cdef long n_row_tiles = (n_frames + _ROW_TILE - 1) // _ROW_TILE
+    cdef long n_center_tiles = (n_centers + center_tile - 1) // center_tile
+
+    cdef long t, c, i, k
+
+    for t in prange(n_row_tiles, nogil=True, schedule='static'):
+        for c in range(n_center_tiles):
+            for i in range(t * _ROW_TILE, min((t + 1) * _ROW_TILE, n_frames)):
+                for k in range(c * center_tile,
+                               min((c + 1) * center_tile, n_centers)):
+                    out[i, k] = _qcp_rmsd(
+                        &X[i, 0, 0], &X_centroids[i, 0], X_traces[i],
+                        &Y[k, 0, 0], &Y_centroids[k, 0], Y_traces[k],
+                        n_atoms)
+
+    return out
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _rmsd_argmin_pruned(np.float32_t[:, :, ::1] X,
+                        double[:, ::1] X_centroids, double[::1] X_traces,
+                        np.float32_t[:, :, ::1] Y,
+                        double[:, ::1] Y_centroids, double[::1] Y_traces,
+                        np.int32_t[:, ::1] order,
+                        np.float32_t[:, ::1] sorted_cc,
+                        np.int64_t[::1] assignments, double[::1] distances):
+    """Pruned equivalent of _rmsd_argmin (see `prune_tables`); returns
+    the number of RMSDs evaluated.
+    """
+
+    cdef long n_frames = X.shape[0]
+    cdef long n_centers = Y.shape[0]
+    cdef long n_atoms = X.shape[1]
+    cdef long n_row_tiles = (n_frames + _ROW_TILE - 1) // _ROW_TILE
+
+    cdef long t, i, j, k, g, best_k
+    cdef long n_evaluated = 0
+    cdef double d, dg, best
+
+    for t in prange(n_row_tiles, nogil=True, schedule='static'):
+        g = 0
+        for i in range(t * _ROW_TILE, min((t + 1) * _ROW_TILE, n_frames)):
+            dg = _qcp_rmsd(
+                &X[i, 0, 0], &X_centroids[i, 0], X_traces[i],
+                &Y[g, 0, 0], &Y_centroids[g, 0], Y_traces[g], n_atoms)
+            n_evaluated += 1
+            best = dg
+            best_k = g
+            for j in range(n_centers):
+                if sorted_cc[g, j] > (dg + best) * (1 + _PRUNE_SLACK):
+                    break
+                k = order[g, j]
+                if k == g:
+                    continue
+                d = _qcp_rmsd(
+                    &X[i, 0, 0], &X_centroids[i, 0], X_traces[i],
+                    &Y[k, 0, 0], &Y_centroids[k, 0], Y_traces[k], n_atoms)
+                n_evaluated += 1
+                if d < best or (d == best and k < best_k):
+                    best = d
+                    best_k = k
+            distances[i] = best
+            assignments[i] = best_k
+            g = best_k
+
+    return n_evaluated
@@ -6,6 +6,7 @@ from sklearn.cluster import AffinityPropagation
 
 from .mutual_info import weighted_mi
 from enspara.citation import cite
+from enspara.util.load import TrajectoryStream
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -20,9 +21,12 @@ def exposons(trj, damping, weights=None, probe_radius=0.28, threshold=0.02):
 
     Parameters
     ----------
-    trj: md.Trajectory
+    trj: md.Trajectory or TrajectoryStream
         The trajectory to compute exposons for. May represent a trajectory
-        or, in combination with `weights`, the centers for an MSM.
+        or, in combination with `weights`, the centers for an MSM. If a
+        TrajectoryStream, SASAs are computed block by block while the
+        stream reads ahead, so the trajectory is never in memory all
+        at once.
     damping: float
         Damping parameter to use for affinity propagation. Goes from 0.5
         to <1.0. Empirically, values between 0.85 and 0.95 tend to work best.
@@ -68,12 +72,16 @@ def exposons(trj, damping, weights=None, probe_radius=0.28, threshold=0.02):
     else:
         weights = np.array(weights) / sum(weights)
 
-    sasas = md.shrake_rupley(trj, probe_radius=probe_radius, mode='atom')
-    sasas = condense_sidechain_sasas(sasas, trj.top)
-    sasa_mi = weighted_mi(sasas > threshold, weights)
+    if isinstance(trj, TrajectoryStream):
+        blocks = trj
+    else:
+        blocks = [trj]
 
-    c = AffinityPropagation(damping=damping)
-    c.fit(sasa_mi)
+    sasas = np.concatenate([
+        condense_sidechain_sasas(
+            md.shrake_rupley(block, probe_radius=probe_radius, mode='atom'),
+            block.top)
+        for block in blocks])
 
     return exposons_from_sasas(sasas, damping, weights, threshold)
 
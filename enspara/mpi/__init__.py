@@ -21,6 +21,7 @@ except ImportError:  # ModuleNotFound error in python >=3.6
 
     def rank(): return 0
     def size(): return 1
+    def node_size(): return 1
 
     from . import ops
     from . import io
@@ -35,5 +36,14 @@ else:
     rank = mpi4py.COMM_WORLD.Get_rank
     size = mpi4py.COMM_WORLD.Get_size
 
+    def node_size():
+        """Number of ranks on this rank's node, which share its memory.
+        Must be called by all ranks."""
+        node_comm = comm.Split_type(mpi4py.COMM_TYPE_SHARED)
+        try:
+            return node_comm.Get_size()
+        finally:
+            node_comm.Free()
+
     from . import ops
     from . import io
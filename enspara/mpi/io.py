@@ -1,31 +1,99 @@
+import os
 import logging
+import numbers
+
+from contextlib import closing
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 import tables
 
-from ..util.load import load_as_concatenated
+from ..util.load import load_as_concatenated, sound_trajectories
 from .. import exception, ra
+from ..ra.ra import _contiguous_layout, _lengths_sidecar
 
 from .. import mpi
-from .ops import assemble_striped_array
+from .ops import assemble_striped_array, balanced_owners, striped_owners
 
 logger = logging.getLogger(__name__)
 
 
-def load_h5_as_striped(filename, stride=1):
+def _bcast_from_root(func, *args):
+    """Call `func` on rank 0 only, and share its result with every rank.
+
+    If `func` raises, the exception is raised on every rank, rather than
+    leaving the others waiting on the broadcast.
+    """
+
+    result = None
+    if mpi.rank() == 0:
+        try:
+            result = func(*args)
+        except Exception as e:
+            result = e
+
+    result = mpi.comm.bcast(result, root=0)
+    if isinstance(result, Exception):
+        raise result
+
+    return result
+
+
+def _read_npy_header(filename):
+    """Read the shape and dtype of a .npy file, and the position of its
+    data in the file, without mapping the file."""
+
+    with open(filename, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = \
+                np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = \
+                np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+
+    return shape, dtype, fortran_order, offset
+
+
+def _h5_layout(filename):
+    with tables.open_file(filename) as handle:
+        layout = _contiguous_layout(handle)
+        if layout is not None and layout[1] is not None:
+            # rows are stored contiguously and indexed by offsets,
+            # so each rank can read just its rows by row number.
+            all_lengths = np.diff(layout[1])
+            all_keys = list(range(len(all_lengths)))
+            all_shapes = [(l,) for l in all_lengths]
+        else:
+            all_keys = [k.name for k in handle.list_nodes('/')]
+            all_shapes = [handle.get_node(where='/', name=k).shape
+                          for k in all_keys]
+
+    return all_keys, all_shapes
+
+
+def load_h5_as_striped(filename, stride=1, processes=1, balance=False):
     """Load HDF5 files into distributed arrays across nodes in an MPI swarm.
 
     Table i is loaded by node i % n, where n is the number of nodes in
-    the swarm.
+    the swarm, unless `balance` is given. For files with rows stored contiguously (see
+    `enspara.ra.save`), only the row offsets are read by rank 0, and
+    each rank then reads only its own rows.
 
     Parameters
     ----------
-    filenames : list
-        A list of relative paths to the trajectory files to be loaded.
-        The md.load function is used, and all file types md.load
-        supports are supported by this function.
+    filename : str
+        Path to the HDF5 file to load, as written by `enspara.ra.save`.
     stride : int, default=1
         Load only every stride-th frame.
+    processes : int or None, default=1
+        Number of reader processes used by each rank, as in
+        `enspara.ra.load`.
+    balance : bool, default=False
+        Assign tables to nodes so that each holds about the same number
+        of frames, as given by `enspara.mpi.ops.balanced_owners` for
+        the global lengths.
 
     Returns
     -------
@@ -38,43 +106,36 @@ def load_h5_as_striped(filename, stride=1):
     enspara.mpi.io.load_trajectory_as_striped, enspara.ra.load
     """
 
-    if mpi.rank() == 0:
-        with tables.open_file(filename) as handle:
-            all_keys = [k.name for k in handle.list_nodes('/')]
-            all_shapes = [handle.get_node(where='/', name=k).shape
-                          for k in all_keys]
-
-    if mpi.size() >= 1:
-        all_keys = mpi.comm.bcast(all_keys if mpi.rank() == 0 else None,
-                                  root=0)
-        all_shapes = mpi.comm.bcast(all_shapes if mpi.rank() == 0 else None,
-                                    root=0)
+    # only rank 0 reads the file's layout; other ranks open the file
+    # just to read their own rows.
+    all_keys, all_shapes = _bcast_from_root(_h5_layout, filename)
     global_lengths = [s[0] for s in all_shapes]
 
-    if len(all_keys) == 2 and 'array' in all_keys and 'lengths' in all_keys:
-        raise NotImplementedError(
-            'Parallel loading of RaggedArrays that have been stored as '
-            'arrays and lengths cannot be loaded in parallel.')
+    if balance:
+        owners = balanced_owners(global_lengths)
+    else:
+        owners = striped_owners(len(global_lengths))
+    local_keys = [all_keys[i] for i in np.flatnonzero(owners == mpi.rank())]
 
-    local_data = ra.load(filename,
-                         keys=all_keys[mpi.rank()::mpi.size()],
-                         stride=stride)
+    local_data = ra.load(filename, keys=local_keys,
+                         stride=stride, processes=processes)
 
     if hasattr(local_data, '_data'):
         local_data = local_data._data
     else:
         # we shoud only get here if only one key is given to load
-        assert len(global_lengths[mpi.rank()::mpi.size()]) == 1
+        assert len(local_keys) == 1
         local_data = local_data
 
     return global_lengths, local_data
 
 
-def load_npy_as_striped(filenames, stride=1):
+def load_npy_as_striped(filenames, stride=1, balance=False, threads=1):
     """Load ndarrays into distributed arrays across nodes in an MPI swarm.
 
     File i is loaded by node i % n, where n is the number of nodes in
-    the swarm.
+    the swarm, unless `balance` is given. Only rank 0 reads the files'
+    headers, and each rank then reads only its own files.
 
     Parameters
     ----------
@@ -84,6 +145,13 @@ def load_npy_as_striped(filenames, stride=1):
         supports are supported by this function.
     stride : int, default=1
         Load only every stride-th frame.
+    balance : bool, default=False
+        Assign files to nodes so that each holds about the same number
+        of frames, as given by `enspara.mpi.ops.balanced_owners` for
+        the global lengths.
+    threads : int or None, default=1
+        Number of threads each rank reads its files with. If None, use
+        one per CPU.
 
     Returns
     -------
@@ -96,8 +164,8 @@ def load_npy_as_striped(filenames, stride=1):
     enspara.mpi.io.load_trajectory_as_striped
     """
 
-    specs = [(h.shape, h.dtype) for h in
-             (np.load(f, mmap_mode='r') for f in filenames)]
+    specs = _bcast_from_root(
+        lambda: [_read_npy_header(f)[:2] for f in filenames])
 
     shape0, dtype = specs[0]
     for i, (s, d) in enumerate(specs):
@@ -112,25 +180,33 @@ def load_npy_as_striped(filenames, stride=1):
                 "({} != {})".format(
                     filenames[0], filenames[i], dtype, d))
 
-    global_lengths = [s[0] for s, d in specs]
+    global_lengths = [-(-s[0] // stride) for s, d in specs]
     logger.debug("Determined global lengths to be %s", global_lengths)
-    local_lengths = [s[0] for s, d in specs[mpi.rank()::mpi.size()]]
+    if balance:
+        owners = balanced_owners(global_lengths)
+    else:
+        owners = striped_owners(len(global_lengths))
+    local_files = np.flatnonzero(owners == mpi.rank())
+    local_lengths = [global_lengths[i] for i in local_files]
 
     local_data = np.empty((sum(local_lengths),) + shape0[1:],
                           dtype=dtype)
     logger.debug("Allocated array of shape %s and type %s",
                  local_data.shape, local_data.dtype)
 
-    # TODO could be thread parallelized?
-    local_filenames = filenames[mpi.rank()::mpi.size()]
-    start = 0
-    for i, f in enumerate(local_filenames):
-        data = np.load(f, mmap_mode='r')
-        end = start + len(data[::stride])
-        logger.debug("Writing file %s to [%s:%s]", i, start, end)
-        local_data[start:end] = data[::stride]
-        start = end
-    assert end == len(local_data)
+    ends = np.cumsum(local_lengths, dtype=int)
+    reads = [(filenames[i], end - length, end) for i, length, end
+             in zip(local_files, local_lengths, ends)]
+
+    def read(spec):
+        filename, start, end = spec
+        logger.debug("Writing file %s to [%s:%s]", filename, start, end)
+        local_data[start:end] = np.load(filename, mmap_mode='r')[::stride]
+
+    # copying out of a memory map releases the GIL, so threads suffice
+    with closing(ThreadPool(processes=threads)) as pool:
+        pool.map(read, reads)
+    pool.join()
 
     logger.debug("Loaded %s npys into an array of shape %s.",
                  len(filenames), local_data.shape)
@@ -138,11 +214,172 @@ def load_npy_as_striped(filenames, stride=1):
     return global_lengths, local_data
 
 
-def load_trajectory_as_striped(filenames, *args, **kwargs):
+def load_ragged_npy_as_striped(filename, stride=1, balance=False,
+                               collective=None):
+    """Load the rows of a RaggedArray saved as .npy (see
+    `enspara.ra.save`) into distributed arrays across nodes in an MPI
+    swarm.
+
+    Row i is loaded by node i % n, where n is the number of nodes in the
+    swarm, unless `balance` is given. Only rank 0 reads the file's header
+    and row lengths.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the .npy file to load. Row lengths are read from its
+        '.lengths.npy' sidecar; without one, the file is a single row.
+        There must be at least as many rows as nodes.
+    stride : int, default=1
+        Load only every stride-th frame of each row.
+    balance : bool, default=False
+        Assign rows to nodes so that each holds about the same number
+        of frames, as given by `enspara.mpi.ops.balanced_owners` for
+        the global lengths.
+    collective : bool, optional
+        Read the file with a single collective MPI-IO read, in which
+        each rank's view of the file selects just its (strided) frames.
+        Otherwise, each rank copies its rows out of a memory map of the
+        file. Defaults to True when mpi4py is installed.
+
+    Returns
+    -------
+    (global_lengths, xyz) : tuple
+       A 2-tuple of row lengths (list of ints, frames) and the data
+       (ndarray, shape=(n_frames, ...)).
+
+    See also
+    --------
+    enspara.mpi.io.load_h5_as_striped, enspara.mpi.io.load_npy_as_striped
+    """
+
+    if collective is None:
+        collective = mpi.mpi4py_installed
+
+    def read_spec():
+        header = _read_npy_header(filename)
+        lengths_name = _lengths_sidecar(filename)
+        if not os.path.exists(lengths_name):
+            # a plain ndarray, i.e. a single row
+            return header, np.array(header[0][:1])
+        return header, np.load(lengths_name)
+
+    (shape, dtype, fortran_order, offset), lengths = \
+        _bcast_from_root(read_spec)
+    if fortran_order:
+        raise exception.ImproperlyConfigured(
+            "Can't stripe the rows of %s, which is stored in Fortran "
+            "order." % filename)
+    if len(lengths) < mpi.size():
+        raise exception.ImproperlyConfigured(
+            "To stripe rows across MPI workers, at least 1 row per node "
+            "must be given. MPI size is %s, number of rows in %s is %s."
+            % (mpi.size(), filename, len(lengths)))
+
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    global_lengths = [-(-l // stride) for l in lengths]
+    if balance:
+        owners = balanced_owners(global_lengths)
+    else:
+        owners = striped_owners(len(global_lengths))
+    local_rows = np.flatnonzero(owners == mpi.rank())
+
+    local_data = np.empty(
+        (sum(global_lengths[i] for i in local_rows),) + tuple(shape[1:]),
+        dtype=dtype)
+
+    if collective:
+        _read_rows_collective(filename, local_data, offset,
+                              [(offsets[i], global_lengths[i])
+                               for i in local_rows], stride)
+    else:
+        data = np.load(filename, mmap_mode='r')
+        start = 0
+        for i in local_rows:
+            end = start + global_lengths[i]
+            local_data[start:end] = data[offsets[i]:offsets[i+1]:stride]
+            start = end
+
+    logger.debug("Loaded %s rows of %s into an array of shape %s.",
+                 len(local_rows), filename, local_data.shape)
+
+    return global_lengths, local_data
+
+
+def _read_rows_collective(filename, out, data_offset, rows, stride):
+    """Read strided rows of a .npy file into `out` with one collective
+    MPI-IO read.
+
+    Each (first frame, n_frames) in `rows` becomes a strided vector of
+    frames in this rank's file view, so that the MPI-IO layer can
+    aggregate the reads of all ranks.
+    """
+
+    MPI = mpi.mpi4py
+    row_bytes = out.dtype.itemsize * int(np.prod(out.shape[1:], dtype=int))
+
+    frame_type = MPI.BYTE.Create_contiguous(row_bytes)
+    row_types = [frame_type.Create_hvector(n, 1, stride * row_bytes)
+                 for _, n in rows]
+    file_type = MPI.Datatype.Create_struct(
+        [1] * len(rows),
+        [data_offset + int(first) * row_bytes for first, _ in rows],
+        row_types)
+    file_type.Commit()
+    frame_type.Commit()
+
+    fh = MPI.File.Open(mpi.comm, filename, MPI.MODE_RDONLY)
+    try:
+        fh.Set_view(0, MPI.BYTE, file_type)
+        fh.Read_all([out.reshape(-1).view(np.uint8), len(out), frame_type])
+    finally:
+        fh.Close()
+        for t in row_types + [file_type, frame_type]:
+            t.Free()
+
+
+def sound_trajectories_as_striped(filenames, stride=1, processes=None):
+    """Sound trajectories across the nodes of an MPI swarm.
+
+    Trajectory i is sounded by node i % n, where n is the number of
+    nodes in the swarm, and the lengths are then shared with every node.
+
+    Parameters
+    ----------
+    filenames : list
+        Paths to the trajectories to sound.
+    stride : int or list of ints, default=1
+        Give the lengths the trajectories would have if loaded with
+        this stride (or, if a list, with one stride per trajectory).
+    processes : int, optional
+        The number of processes with which each node sounds its
+        trajectories.
+
+    Returns
+    -------
+    global_lengths : np.ndarray
+        The length (in frames) of each trajectory.
+
+    See also
+    --------
+    enspara.util.load.sound_trajectories
+    """
+
+    if not isinstance(stride, numbers.Integral):
+        stride = stride[mpi.rank()::mpi.size()]
+
+    local_lengths = sound_trajectories(
+        filenames[mpi.rank()::mpi.size()], stride=stride,
+        processes=processes)
+
+    return assemble_striped_array(np.array(local_lengths, dtype=int))
+
+
+def load_trajectory_as_striped(filenames, *args, balance=False, **kwargs):
     """Load trajectories into distributed arrays across nodes in an MPI swarm.
 
     File i is loaded by node i % n, where n is the number of nodes in
-    the swarm.
+    the swarm, unless `balance` is given.
 
     Parameters
     ----------
@@ -150,6 +387,12 @@ def load_trajectory_as_striped(filenames, *args, **kwargs):
         A list of relative paths to the trajectory files to be loaded.
         The md.load function is used, and all file types md.load
         supports are supported by this function.
+    balance : bool, default=False
+        Assign files to nodes so that each holds about the same number
+        of frames, as given by `enspara.mpi.ops.balanced_owners` for
+        the global lengths. Unless `lengths` are given, trajectories
+        are first sounded across the swarm (see
+        `sound_trajectories_as_striped`).
     lengths : list, optional, default=None
         List of lengths of the underlying trajectories. If None, the
         lengths will be inferred. However, this can be slow, especially
@@ -178,16 +421,35 @@ def load_trajectory_as_striped(filenames, *args, **kwargs):
             "node must be given. MPI size is %s, number of files is %s."
             % (mpi.size(), len(filenames)))
 
+    if not balance:
+        local_files = np.arange(mpi.rank(), len(filenames), mpi.size())
+    else:
+        global_lengths = kwargs.pop('lengths', None)
+        if global_lengths is None:
+            if kwargs.get('args'):
+                stride = [a.get('stride', 1) for a in kwargs['args']]
+            else:
+                stride = kwargs.get('stride', 1)
+            global_lengths = sound_trajectories_as_striped(
+                filenames, stride=stride,
+                processes=kwargs.get('processes'))
+
+        global_lengths = np.array(global_lengths, dtype=int)
+        local_files = np.flatnonzero(
+            balanced_owners(global_lengths) == mpi.rank())
+        kwargs['lengths'] = [global_lengths[i] for i in local_files]
+
     # if we're specifying parameters separately for each trj to load, we
     # need to stripe those across nodes also.
     if 'args' in kwargs and len(kwargs['args']) > 1:
         assert len(kwargs['args']) == len(filenames)
-        kwargs['args'] = kwargs['args'].copy()[mpi.rank()::mpi.size()]
+        kwargs['args'] = [kwargs['args'][i] for i in local_files]
 
     local_lengths, my_xyz = load_as_concatenated(
-        filenames=filenames[mpi.rank()::mpi.size()], *args, **kwargs)
+        filenames=[filenames[i] for i in local_files], *args, **kwargs)
 
-    local_lengths = np.array(local_lengths, dtype=int)
-    global_lengths = assemble_striped_array(local_lengths)
+    if not balance:
+        local_lengths = np.array(local_lengths, dtype=int)
+        global_lengths = assemble_striped_array(local_lengths)
 
     return global_lengths, my_xyz
@@ -1,3 +1,4 @@
+import heapq
 import logging
 import numpy as np
 
@@ -10,7 +11,78 @@ from .. import mpi
 logger = logging.getLogger(__name__)
 
 
-def convert_local_indices(local_ctr_inds, global_lengths):
+def striped_owners(n_rows, size=None):
+    """Assign row i of an array to rank i % n, where n is the number of
+    ranks. This is the default layout of data across an MPI swarm.
+
+    Parameters
+    ----------
+    n_rows : int
+        Number of rows (e.g. trajectories) to distribute.
+    size : int, optional
+        Number of ranks. Defaults to the current swarm size.
+
+    Returns
+    -------
+    owners : np.ndarray, shape=(n_rows,)
+        The rank that holds each row.
+    """
+
+    size = mpi.size() if size is None else size
+    return np.arange(n_rows) % size
+
+
+def balanced_owners(lengths, size=None):
+    """Assign rows (e.g. trajectories) to ranks so that each rank holds
+    roughly the same number of frames.
+
+    Rows are assigned longest first, each to the rank holding the fewest
+    frames so far (i.e. longest-processing-time-first scheduling), which
+    puts at most 4/3 as many frames on the fullest rank as the best
+    possible assignment. Ties are broken by the number of rows held and
+    then by rank, so every rank gets a row if there are enough, and rows
+    of equal length are assigned exactly as by `striped_owners`.
+
+    Each rank holds its rows in their original order, so, as for
+    striped arrays, the layout of the data can be recomputed anywhere
+    from the lengths alone.
+
+    Parameters
+    ----------
+    lengths : array-like, shape=(n_rows,)
+        Length of each row.
+    size : int, optional
+        Number of ranks. Defaults to the current swarm size.
+
+    Returns
+    -------
+    owners : np.ndarray, shape=(n_rows,)
+        The rank that holds each row.
+    """
+
+    size = mpi.size() if size is None else size
+    lengths = np.asarray(lengths)
+
+    owners = np.empty(len(lengths), dtype=int)
+    loads = [(0, 0, rank) for rank in range(size)]
+
+    for row in np.argsort(-lengths, kind='mergesort'):
+        load, n_rows, rank = heapq.heappop(loads)
+        owners[row] = rank
+        heapq.heappush(loads, (load + lengths[row], n_rows + 1, rank))
+
+    return owners
+
+
+def _rows_by_rank(owners, size=None):
+    """The rows held by each rank, in the order each rank holds them."""
+
+    size = mpi.size() if size is None else size
+    owners = np.asarray(owners)
+    return [np.flatnonzero(owners == rank) for rank in range(size)]
+
+
+def convert_local_indices(local_ctr_inds, global_lengths, owners=None):
     """Convert indices from (rank, local_frame) to (global frame).
 
     In enspara's clustering code, we represent frames in the data set by
@@ -25,31 +97,142 @@ def convert_local_indices(local_ctr_inds, global_lengths):
     global_lengths : np.ndarray
         Array of the length of each trajectory distributed across all
         the nodes.
+    owners : np.ndarray, optional
+        The rank holding each trajectory (e.g. from `balanced_owners`).
+        Defaults to the layout of `striped_owners`.
     """
 
-    global_indexing = np.arange(np.sum(global_lengths))
-    file_origin_ra = ra.RaggedArray(global_indexing, lengths=global_lengths)
+    global_lengths = np.asarray(global_lengths)
+    if owners is None:
+        owners = striped_owners(len(global_lengths))
+
+    global_offsets = np.concatenate([[0], np.cumsum(global_lengths)])
+    rank_rows = _rows_by_rank(owners)
 
     ctr_inds = []
     for rank, local_fid in local_ctr_inds:
-        global_fid = file_origin_ra[rank::mpi.size()].flatten()[local_fid]
-        ctr_inds.append(global_fid)
+        rows = rank_rows[rank]
+        local_offsets = np.cumsum(global_lengths[rows])
+        i = np.searchsorted(local_offsets, local_fid, side='right')
+        row_start = local_offsets[i] - global_lengths[rows[i]]
+        ctr_inds.append(
+            global_offsets[rows[i]] + local_fid - row_start)
 
     return ctr_inds
 
 
-def assemble_striped_array(local_arr):
+# MPI counts and displacements are C ints
+_MPI_INT_MAX = 2**31 - 1
+
+
+def _gather_bytes(local_arr, counts, root=None, max_count=_MPI_INT_MAX):
+    """Gather each rank's (contiguous) array, in rank order, as raw bytes.
+
+    Each row is sent as a single element of a contiguous MPI datatype,
+    so counts and displacements are numbers of rows rather than bytes.
+    If the rows to gather number more than `max_count` (the largest
+    count MPI can take), they're gathered in rounds, each taking at
+    most `max_count / size` rows from each rank.
+
+    Parameters
+    ----------
+    local_arr : np.ndarray
+        This rank's array.
+    counts : list of ints
+        Length (in the first dimension) of each rank's array.
+    root : int, default=None
+        If given, gather only to this rank (with Gatherv), and return
+        None elsewhere. Otherwise, gather to every rank (Allgatherv).
+    max_count : int, default=2**31 - 1
+        Largest count or displacement to give MPI in one round.
+
+    Returns
+    -------
+    gathered : np.ndarray
+        The concatenation of every rank's array, in the dtype of
+        `local_arr`, or None on ranks other than `root`.
+    """
+
+    local_arr = np.ascontiguousarray(local_arr)
+    counts = np.array(counts, dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    receiving = root is None or mpi.rank() == root
+    if receiving:
+        gathered = np.empty((offsets[-1],) + local_arr.shape[1:],
+                            dtype=local_arr.dtype)
+    else:
+        gathered = None
+
+    row_bytes = local_arr.dtype.itemsize * \
+        int(np.prod(local_arr.shape[1:], dtype=int))
+    if row_bytes == 0 or offsets[-1] == 0:
+        return gathered
+
+    if offsets[-1] <= max_count:
+        chunk = counts.max()
+    else:
+        chunk = max(max_count // mpi.size(), 1)
+
+    local_bytes = local_arr.reshape(-1).view(np.uint8)
+    row_type = mpi.mpi4py.BYTE.Create_contiguous(row_bytes).Commit()
+    try:
+        for start in range(0, counts.max(), chunk):
+            round_counts = np.clip(counts - start, 0, chunk)
+            round_offsets = np.concatenate([[0], np.cumsum(round_counts)])
+
+            # in a single round, ranks' rows go straight to their place
+            if receiving and chunk == counts.max():
+                recv = gathered.reshape(-1).view(np.uint8)
+            elif receiving:
+                recv = np.empty(round_offsets[-1] * row_bytes,
+                                dtype=np.uint8)
+            recvbuf = [recv, (round_counts, round_offsets[:-1]),
+                       row_type] if receiving else None
+
+            sent = round_counts[mpi.rank()]
+            sendbuf = [local_bytes[start*row_bytes:(start+sent)*row_bytes],
+                       sent, row_type]
+            if root is None:
+                mpi.comm.Allgatherv(sendbuf, recvbuf)
+            else:
+                mpi.comm.Gatherv(sendbuf, recvbuf, root=root)
+
+            if receiving and chunk != counts.max():
+                out = gathered.reshape(len(gathered), -1).view(np.uint8)
+                rows = recv.reshape(-1, row_bytes)
+                for rank in range(mpi.size()):
+                    out[offsets[rank]+start:
+                        offsets[rank]+start+round_counts[rank]] = \
+                        rows[round_offsets[rank]:round_offsets[rank+1]]
+    finally:
+        row_type.Free()
+
+    return gathered
+
+
+def assemble_striped_array(local_arr, root=None, owners=None):
     """Assemble an striped array.
 
     By 'striped array', we mean an array that has element i on node
     i % n. This is a common strategy for spreading data across MPI
     nodes, because it is easy to compute and, in practice, often spreads
-    data pretty evenly.
+    data pretty evenly. Other layouts (e.g. from `balanced_owners`) can
+    be given with `owners`.
+
+    Each rank's array is gathered once, as a buffer (i.e. without
+    pickling), and in its own dtype.
 
     Parameters
     ----------
     local_array: np.ndarray
         The array to spread across nodes.
+    root : int, default=None
+        If given, assemble the array only on this rank, and return None
+        elsewhere. Otherwise, every rank gets the full array.
+    owners : np.ndarray, optional
+        The rank holding each element of the full array. Defaults to
+        the layout of `striped_owners`.
 
     Returns
     -------
@@ -60,25 +243,34 @@ def assemble_striped_array(local_arr):
     if mpi.size() == 1:
         return local_arr
 
-    total_dim1 = mpi.comm.allreduce(len(local_arr), op=mpi.mpi4py.SUM)
-    total_shape = (total_dim1,) + local_arr.shape[1:]
-
     if not np.all(local_arr > 0):
         raise ImproperlyConfigured(
             ("On rank %s, a length <= 0 was found. Lengths must be "
              "strictly greater than zero.") % mpi.rank())
 
-    global_arr = np.zeros(total_shape, dtype=local_arr.dtype) - 1
+    counts = mpi.comm.allgather(len(local_arr))
+    if owners is None:
+        owners = striped_owners(sum(counts))
+    elif len(owners) != sum(counts):
+        raise DataInvalid(
+            "Owners were given for %s elements, but ranks held %s." %
+            (len(owners), sum(counts)))
 
-    for i in range(mpi.size()):
-        global_arr[i::mpi.size()] = mpi.comm.bcast(local_arr, root=i)
+    gathered = _gather_bytes(local_arr, counts, root=root)
+    if gathered is None:
+        return None
 
-    assert np.all(global_arr > 0), global_arr
+    global_arr = np.empty_like(gathered)
+    start = 0
+    for rows, count in zip(_rows_by_rank(owners), counts):
+        global_arr[rows] = gathered[start:start+count]
+        start += count
 
     return global_arr
 
 
-def assemble_striped_ragged_array(local_array, global_lengths):
+def assemble_striped_ragged_array(local_array, global_lengths, root=None,
+                                  owners=None):
     """Assemble an array that is striped according to the first dim of a
     ragged array.
 
@@ -87,7 +279,9 @@ def assemble_striped_ragged_array(local_array, global_lengths):
     different.
 
     This is used e.g. to assemble assignments in clustering from data
-    spread across each node.
+    spread across each node. Since the lengths of every rank's rows are
+    known everywhere, each rank's array is gathered once, as a buffer
+    and in its own dtype, with no further communication.
 
     Parameters
     ----------
@@ -96,6 +290,12 @@ def assemble_striped_ragged_array(local_array, global_lengths):
     global_lengths: np.ndarray
         Lengths for each row of the RA. The ultimate assembled RA will
         have this as it's lengths attribute.
+    root : int, default=None
+        If given, assemble the array only on this rank, and return None
+        elsewhere. Otherwise, every rank gets the full array.
+    owners : np.ndarray, optional
+        The rank holding each row (e.g. from `balanced_owners`).
+        Defaults to the layout of `striped_owners`.
 
     Returns
     -------
@@ -105,23 +305,38 @@ def assemble_striped_ragged_array(local_array, global_lengths):
 
     assert np.issubdtype(type(global_lengths[0]), np.integer)
 
-    global_array = np.zeros(shape=(np.sum(global_lengths),)) - 1
-    global_ra = ra.RaggedArray(global_array, lengths=global_lengths)
+    global_lengths = np.asarray(global_lengths)
+    if owners is None:
+        owners = striped_owners(len(global_lengths))
+    rank_rows = _rows_by_rank(owners)
 
-    for rank in range(mpi.size()):
-        rank_array = mpi.comm.bcast(local_array, root=rank)
-
-        local_lengths = global_lengths[rank::mpi.size()]
-        if len(local_lengths) > 1:
-            rank_ra = ra.RaggedArray(
-                rank_array, lengths=local_lengths)
-            global_ra[rank::mpi.size()] = rank_ra
-        else:
-            global_ra[rank] = rank_array
+    local_length = np.sum(global_lengths[rank_rows[mpi.rank()]])
+    if len(local_array) != local_length:
+        raise DataInvalid(
+            "On rank %s, the local array had %s elements, but its rows "
+            "have lengths summing to %s." %
+            (mpi.rank(), len(local_array), local_length))
 
-    assert np.all(global_ra._data) >= 0
+    if mpi.size() == 1:
+        return local_array
+
+    gathered = _gather_bytes(
+        local_array, [np.sum(global_lengths[rows]) for rows in rank_rows],
+        root=root)
+    if gathered is None:
+        return None
+
+    # gathered rows are in rank order; put each back in its place.
+    global_arr = np.empty_like(gathered)
+    global_offsets = np.concatenate([[0], np.cumsum(global_lengths)])
+    start = 0
+    for row in np.concatenate(rank_rows):
+        stop = start + global_lengths[row]
+        global_arr[global_offsets[row]:global_offsets[row+1]] = \
+            gathered[start:stop]
+        start = stop
 
-    return global_ra._data.astype(local_array.dtype)
+    return global_arr
 
 
 def striped_array_max(local_array):
@@ -139,6 +354,121 @@ def striped_array_max(local_array):
     return global_max
 
 
+# bytes in the float64 (value, rank, index) header of a _maxloc record
+_MAXLOC_HEADER_BYTES = 3 * 8
+
+
+def _maxloc(inmem, outmem, datatype):
+    """MPI reduction keeping the (value, rank, index, ...) record with
+    the greatest value, breaking ties by the lower rank as np.argmax
+    would. Records are rows of bytes as wide as `datatype`: a header of
+    three float64s, then the payload's raw bytes."""
+
+    width = datatype.Get_size()
+    a = np.frombuffer(inmem, dtype=np.uint8).reshape(-1, width)
+    b = np.frombuffer(outmem, dtype=np.uint8).reshape(-1, width)
+
+    a_head = a[:, :_MAXLOC_HEADER_BYTES].copy().view(np.float64)
+    b_head = b[:, :_MAXLOC_HEADER_BYTES].copy().view(np.float64)
+
+    take = (a_head[:, 0] > b_head[:, 0]) | (
+        (a_head[:, 0] == b_head[:, 0]) & (a_head[:, 1] < b_head[:, 1]))
+    b[take] = a[take]
+
+
+# the MPI op and record datatypes for _maxloc, which are created once
+_MAXLOC_OP = None
+_MAXLOC_TYPES = {}
+
+
+def _maxloc_op(width):
+    global _MAXLOC_OP
+
+    if _MAXLOC_OP is None:
+        _MAXLOC_OP = mpi.mpi4py.Op.Create(_maxloc, commute=True)
+    if width not in _MAXLOC_TYPES:
+        _MAXLOC_TYPES[width] = \
+            mpi.mpi4py.BYTE.Create_contiguous(width).Commit()
+
+    return _MAXLOC_OP, _MAXLOC_TYPES[width]
+
+
+def striped_array_argmax(local_array, data=None):
+    """Find the maximum of an array striped across MPI nodes, where it
+    is, and (optionally) the corresponding frame of `data`, with a
+    single collective operation.
+
+    Each rank contributes a record of its local maximum, its rank, the
+    maximum's local index and, if `data` is given, the raw bytes of that
+    frame of `data` (so it keeps its dtype exactly). These are reduced MAXLOC-style in one Allreduce, so every rank gets
+    the winning frame without a separate broadcast (c.f.
+    `striped_array_max` and `distribute_frame`).
+
+    Parameters
+    ----------
+    local_array : np.ndarray, shape=(n_frames,)
+        This rank's part of the array.
+    data : array-like or md.Trajectory, default=None
+        This rank's data, with a frame for each element of
+        `local_array`.
+
+    Returns
+    -------
+    value : float
+        The global maximum.
+    owner_rank : int
+        The rank holding the maximum. Ties go to the lowest rank.
+    local_index : int
+        Position of the maximum in the owner's `local_array`.
+    frame : array-like or md.Trajectory
+        A single slice of the owner's `data` at `local_index`, or None
+        if `data` was not given.
+    """
+
+    if len(local_array):
+        local_index = np.argmax(local_array)
+        value = local_array[local_index]
+    else:
+        local_index, value = -1, -np.inf
+
+    if data is None:
+        payload = np.zeros(0, dtype=np.uint8)
+    else:
+        frames = data.xyz if hasattr(data, 'xyz') else np.asarray(data)
+        if len(local_array):
+            payload = np.ascontiguousarray(frames[local_index])
+        else:
+            # every rank's record must be equally wide, even with no
+            # frames
+            payload = np.zeros(frames.shape[1:], dtype=frames.dtype)
+
+    header = np.array([value, mpi.rank(), local_index], dtype=np.float64)
+    record = np.concatenate(
+        [header.view(np.uint8), payload.reshape(-1).view(np.uint8)])
+
+    if mpi.size() > 1:
+        op, datatype = _maxloc_op(len(record))
+        result = np.empty_like(record)
+        mpi.comm.Allreduce([record, 1, datatype], [result, 1, datatype],
+                           op=op)
+    else:
+        result = record
+
+    header = result[:_MAXLOC_HEADER_BYTES].view(np.float64)
+    value, owner_rank, local_index = \
+        header[0], int(header[1]), int(header[2])
+
+    if data is None:
+        frame = None
+    else:
+        frame = result[_MAXLOC_HEADER_BYTES:].view(payload.dtype).reshape(
+            payload.shape)
+        if hasattr(data, 'xyz'):
+            frame = type(data)(xyz=frame[None], topology=data.top)
+
+    return value, owner_rank, local_index, frame
+
+
 def striped_array_mean(local_array):
     """Compute the mean of an array striped across MPI nodes.
 
@@ -22,6 +22,10 @@ from .. import exception
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# number of transitions accumulated before they are summed into the
+# count matrix by assigns_to_counts
+_COUNTS_BUFFER_SIZE = 2**24
+
 
 class TrimMapping:
     """The TrimMapping maps state ids before and after ergodic trimming.
@@ -153,21 +157,47 @@ def assigns_to_counts(
             'If this is really what you want, try using '
             'assignments.reshape(1, -1) to create a single-row 2d array.')
 
-    assigns = np.array([a[np.where(a != -1)] for a in assigns])
-
     if max_n_states is None:
-        max_n_states = np.concatenate(assigns).max() + 1
+        max_n_states = assigns.max() + 1
+
+    # rows are consumed one at a time and transitions are collapsed into
+    # the count matrix every so often, so that assigns need not be held
+    # in memory (e.g. when it is a LazyRaggedArray).
+    C = None
+    transitions = []
+    n_buffered = 0
+    for assign in assigns:
+        assign = np.asarray(assign)
+        transitions.append(_transitions_helper(
+            assign[assign != -1], lag_time=lag_time,
+            sliding_window=sliding_window))
+        n_buffered += transitions[-1].shape[1]
+
+        if n_buffered >= _COUNTS_BUFFER_SIZE:
+            C = _sum_counts(C, transitions, max_n_states)
+            transitions, n_buffered = [], 0
+
+    if transitions or C is None:
+        C = _sum_counts(C, transitions, max_n_states)
+
+    return C.tocoo()
+
+
+def _sum_counts(C, transitions, n_states):
+    """Add a list of transition arrays (as from _transitions_helper) to
+    the count matrix C, which may be None."""
+
+    if transitions:
+        mat_coords = np.hstack(transitions)
+    else:
+        mat_coords = np.zeros((2, 0), dtype=int)
 
-    transitions = [
-        _transitions_helper(
-            assign, lag_time=lag_time, sliding_window=sliding_window)
-        for assign in assigns]
     # generate sparse matrix
-    mat_coords = np.hstack(transitions)
     mat_data = np.ones(mat_coords.shape[1], dtype=int)
-    C = scipy.sparse.coo_matrix(
-        (mat_data, mat_coords), shape=(max_n_states, max_n_states))
-    return C
+    new_C = scipy.sparse.coo_matrix(
+        (mat_data, mat_coords), shape=(n_states, n_states))
+
+    return new_C if C is None else C + new_C
 
 
 def eigenspectrum(T, n_eigs=None, left=True, maxiter=100000, tol=1E-30):
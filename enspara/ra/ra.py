@@ -1,19 +1,31 @@
 import collections
 import copy
-import itertools
+import ctypes
 import logging
+import multiprocessing as mp
 import numbers
 import numpy as np
+import os
 import resource
 import tables
 import time
 import warnings
 
+from contextlib import closing
+from functools import partial
 from mdtraj import io
 from ..exception import DataInvalid, ImproperlyConfigured
 
 logger = logging.getLogger(__name__)
 
+# version of the contiguous HDF5 layout written by save(..., layout=
+# 'contiguous'), stored in the root attribute 'ra_format_version'.
+CONTIGUOUS_FORMAT_VERSION = 1
+
+# approximate size of each read issued by the parallel HDF5 loader. Reads
+# are rounded to whole chunks of the underlying dataset.
+_PARALLEL_READ_BYTES = 2**23
+
 
 def zeros_like(array, *args, **kwargs):
 
@@ -42,9 +54,76 @@ def where(mask):
         return np.where(mask)
 
 
-def save(filename, array, compression_level=1, tag='arr'):
+def concatenate(arrays):
+    """Join a sequence of RaggedArrays along the first (row) axis.
+
+    The output is allocated once and each input is copied directly into
+    place, rather than building intermediate lists of rows.
+
+    Parameters
+    ----------
+    arrays : sequence of RaggedArrays or array-likes
+        The arrays to join. Entries that are not RaggedArrays are taken
+        to be a sequence of rows (e.g. a 2d ndarray or a list of 1d
+        arrays).
+
+    Returns
+    -------
+    concatenated : RaggedArray
+        A RaggedArray holding the rows of each of `arrays`, in order.
+    """
+
+    # reduce each input to a list of (flat data, lengths) pieces
+    pieces = []
+    for array in arrays:
+        if isinstance(array, RaggedArray):
+            pieces.append((array._data, array.lengths))
+        elif isinstance(array, np.ndarray) and array.ndim >= 2:
+            pieces.append((array.reshape((-1,) + array.shape[2:]),
+                           np.full(len(array), array.shape[1], dtype=int)))
+        else:
+            pieces.extend((np.asarray(row), [len(row)]) for row in array)
+
+    if not pieces:
+        return RaggedArray([])
+
+    row_shape = pieces[0][0].shape[1:]
+    if not all(data.shape[1:] == row_shape for data, _ in pieces):
+        raise DataInvalid(
+            "RaggedArrays to concatenate must share nonragged dimensions. "
+            "Got shapes: %s" % [data.shape for data, _ in pieces])
+
+    lengths = np.concatenate([np.asarray(l, dtype=int) for _, l in pieces])
+    data = np.empty((lengths.sum(),) + row_shape,
+                    dtype=np.result_type(*[d.dtype for d, _ in pieces]))
+
+    start = 0
+    for piece, _ in pieces:
+        data[start:start+len(piece)] = piece
+        start += len(piece)
+
+    return RaggedArray.from_buffer(data, lengths)
+
+
+def save(filename, array, compression_level=1, tag='arr', layout='rows',
+         dtype=None):
     """Save a RaggedArray or numpy ndarray to disk as an HDF5 file.
-     Parameters
+
+    If `filename` ends in '.npy', the array is instead written as a
+    single contiguous .npy file, plus (for RaggedArrays) a sidecar
+    '.lengths.npy' file holding the row lengths. This format can be
+    memory-mapped by `load`.
+
+    HDF5 files can be written in one of two layouts. The 'rows' layout
+    stores each row as its own node, named by `tag`. The 'contiguous'
+    layout stores all rows in a single chunked, compressed '/data'
+    dataset alongside an '/offsets' index of length n_rows + 1, so that
+    row i is data[offsets[i]:offsets[i+1]]. The contiguous layout is
+    much faster to write and read for arrays with many rows, and
+    supports reading arbitrary subsets of rows (e.g. for MPI striping)
+    without touching the rest of the file. Both are read by `load`.
+
+    Parameters
     ----------
     filename : str
         Path of file to write out (per tables.open_file).
@@ -55,9 +134,26 @@ def save(filename, array, compression_level=1, tag='arr'):
         Per the pytables Filters complevel flag.
     tag : str, default='array'
         The name under which each row in the ragged array will be saved,
-        for example 'array_00'.
+        for example 'array_00'. Only used by the 'rows' layout.
+    layout : {'rows', 'contiguous'}, default='rows'
+        The HDF5 layout to write (see above). Ignored for .npy files.
+    dtype : np.dtype, default=None
+        If given, cast the data to this dtype as it is written (e.g. to
+        store assignments compactly; see
+        `enspara.cluster.util.assignment_dtype`).
     """
 
+    if _is_npy(filename):
+        return _save_npy(filename, array, dtype=dtype)
+
+    if layout == 'contiguous':
+        return _save_contiguous(filename, array, compression_level,
+                                dtype=dtype)
+    elif layout != 'rows':
+        raise ImproperlyConfigured(
+            "Unknown RaggedArray layout '%s'. Expected 'rows' or "
+            "'contiguous'." % layout)
+
     try:
         n_zeros = len(str(len(array.lengths))) + 1
     except AttributeError:
@@ -72,8 +168,10 @@ def save(filename, array, compression_level=1, tag='arr'):
     with tables.open_file(filename, 'w') as handle:
         for i in range(len(array)):
             subarr = array[i]
-
-            if hasattr(array, '_data'):
+            if dtype is not None:
+                subarr = np.asarray(subarr).astype(dtype, copy=False)
+                atom = tables.Atom.from_dtype(subarr.dtype)
+            elif hasattr(array, '_data'):
                 atom = tables.Atom.from_dtype(array._data.dtype)
             else:
                 atom = tables.Atom.from_dtype(subarr.dtype)
@@ -89,6 +187,437 @@ def save(filename, array, compression_level=1, tag='arr'):
     return filename
 
 
+def _save_contiguous(filename, array, compression_level=1, dtype=None):
+    """Write `array` in the contiguous single-dataset HDF5 layout.
+
+    Data is appended in blocks, so that `array` may be a LazyRaggedArray
+    (or other on-disk array) larger than memory.
+    """
+
+    if hasattr(array, '_data'):
+        data = array._data
+        offsets = np.zeros(len(array.lengths) + 1, dtype=np.int64)
+        np.cumsum(array.lengths, out=offsets[1:])
+    else:
+        data = array
+        offsets = None
+
+    compression = tables.Filters(
+        complevel=compression_level,
+        complib='zlib',
+        shuffle=True)
+
+    dtype = data.dtype if dtype is None else np.dtype(dtype)
+
+    with tables.open_file(filename, 'w') as handle:
+        node = handle.create_earray(
+            where='/', name='data', atom=tables.Atom.from_dtype(dtype),
+            shape=(0,) + tuple(data.shape[1:]), filters=compression,
+            expectedrows=max(len(data), 1))
+
+        block_size = max(LazyRaggedArray._block_size //
+                         max(data[:1].nbytes, 1), 1)
+        for start in range(0, len(data), block_size):
+            node.append(np.asarray(data[start:start+block_size]).astype(
+                dtype, copy=False))
+
+        if offsets is not None:
+            handle.create_array(where='/', name='offsets', obj=offsets)
+        handle.root._v_attrs.ra_format_version = CONTIGUOUS_FORMAT_VERSION
+
+    return filename
+
+
+def _contiguous_layout(handle):
+    """Find the data node and row offsets of an HDF5 file in which rows
+    are stored contiguously.
+
+    Both the current contiguous layout ('/data', '/offsets') and the
+    old-style layout ('/array', '/lengths') qualify.
+
+    Returns
+    -------
+    layout : (tables.Node, np.ndarray) or None
+        The data node and offsets (None if the file holds a plain
+        ndarray), or None if rows are stored one per node.
+    """
+
+    if 'ra_format_version' in handle.root._v_attrs:
+        version = handle.root._v_attrs.ra_format_version
+        if version > CONTIGUOUS_FORMAT_VERSION:
+            raise DataInvalid(
+                "File %s uses RaggedArray format version %s, but only "
+                "versions up to %s are supported." %
+                (handle.filename, version, CONTIGUOUS_FORMAT_VERSION))
+        offsets = handle.get_node('/offsets')[:] \
+            if '/offsets' in handle else None
+        return handle.get_node('/data'), offsets
+
+    if set(n.name for n in handle.list_nodes('/')) == {'array', 'lengths'}:
+        lengths = handle.get_node('/lengths')[:]
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return handle.get_node('/array'), offsets
+
+    return None
+
+
+def _load_contiguous(node, offsets, rows=None, stride=1):
+    """Read rows from a contiguously-stored RaggedArray.
+
+    Parameters
+    ----------
+    node : tables.Node
+        Node holding the flat data.
+    offsets : np.ndarray, shape=(n_rows + 1,)
+        Start of each row in `node`, followed by the total length. If
+        None, `node` holds a plain ndarray, which is returned.
+    rows : array-like of int, optional
+        Indices of the rows to read (default: all of them). If a single
+        row is requested, it is returned as a numpy array.
+    stride : int, default=1
+        Stride along the second dimension.
+    """
+
+    if offsets is None:
+        return node[::stride]
+
+    row_ids = _select_rows(offsets, rows)
+
+    starts = offsets[row_ids]
+    stops = offsets[row_ids + 1]
+    lengths = (stops - starts + stride - 1) // stride
+
+    if stride == 1 and np.all(starts[1:] == stops[:-1]):
+        # the rows form one span of the file; read it in a single go
+        concat = node[starts[0]:stops[-1]] if len(row_ids) else \
+            np.zeros((0,) + node.shape[1:], dtype=node.dtype)
+    else:
+        concat = np.zeros((lengths.sum(),) + node.shape[1:],
+                          dtype=node.dtype)
+        pos = 0
+        for start, stop, length in zip(starts, stops, lengths):
+            concat[pos:pos+length] = node[start:stop:stride]
+            pos += length
+
+    if rows is not None and rows is not Ellipsis and len(row_ids) == 1:
+        return concat
+
+    return RaggedArray(concat, lengths=lengths, error_checking=False,
+                       copy=False)
+
+
+def _select_rows(offsets, rows):
+    """Convert a row selection (None, Ellipsis, or a list of integer
+    row indices, possibly negative) for a file with the given offsets
+    into an array of nonnegative row indices."""
+
+    n_rows = len(offsets) - 1
+    if rows is None or rows is Ellipsis:
+        return np.arange(n_rows)
+
+    row_ids = np.asarray(rows)
+    if row_ids.size and not np.issubdtype(row_ids.dtype, np.integer):
+        raise DataInvalid(
+            "Rows of a contiguous RaggedArray file are selected by "
+            "integer index, got keys %s." % (rows,))
+    row_ids = row_ids.astype(int).reshape(-1)
+    if np.any((row_ids >= n_rows) | (row_ids < -n_rows)):
+        raise IndexError(
+            "Row index out of range for RaggedArray with %s rows: %s"
+            % (n_rows, rows))
+    row_ids[row_ids < 0] += n_rows
+
+    return row_ids
+
+
+def migrate(input_name, output_name, compression_level=1):
+    """Rewrite a RaggedArray HDF5 file in the contiguous layout.
+
+    Per-row ('rows' layout) and old-style array/lengths files are both
+    accepted. Data is streamed through, rather than loaded into memory
+    in full.
+
+    Parameters
+    ----------
+    input_name : str
+        Path of the file to convert.
+    output_name : str
+        Path of the file to write. Must differ from `input_name`.
+    compression_level : int, default=1
+        Level of compression to use, as in `save`.
+
+    Returns
+    -------
+    output_name : str
+        Path of the written file.
+    """
+
+    if os.path.abspath(input_name) == os.path.abspath(output_name):
+        raise ImproperlyConfigured(
+            "Can't migrate %s in place, specify a different output file."
+            % input_name)
+
+    array = load(input_name, mmap_mode='r')
+    try:
+        return save(output_name, array, compression_level=compression_level,
+                    layout='contiguous')
+    finally:
+        if hasattr(array, 'close'):
+            array.close()
+
+
+def _is_npy(filename):
+    return isinstance(filename, str) and \
+        os.path.splitext(filename)[1] == '.npy'
+
+
+def _lengths_sidecar(filename):
+    """Path of the file holding row lengths for a RaggedArray stored as
+    a flat .npy file, e.g. 'assigs.npy' -> 'assigs.lengths.npy'."""
+    root, ext = os.path.splitext(filename)
+    return root + '.lengths' + ext
+
+
+def _save_npy(filename, array, dtype=None):
+    """Save a RaggedArray as a flat .npy with a lengths sidecar file, or
+    an ndarray as a plain .npy."""
+
+    if hasattr(array, '_data'):
+        np.save(filename, np.asarray(array._data).astype(
+            dtype or array.dtype, copy=False))
+        np.save(_lengths_sidecar(filename), np.asarray(array.lengths))
+    else:
+        array = np.asarray(array)
+        np.save(filename, array.astype(dtype or array.dtype, copy=False))
+
+    return filename
+
+
+def _load_npy(input_name, stride=1, mmap_mode=None):
+    """Load a flat .npy (and its lengths sidecar, if any) written by
+    `save`."""
+
+    data = np.load(input_name, mmap_mode=mmap_mode)
+
+    lengths_name = _lengths_sidecar(input_name)
+    if not os.path.exists(lengths_name):
+        logger.debug("No lengths file found at %s, returning numpy array",
+                     lengths_name)
+        return data[::stride]
+    lengths = np.load(lengths_name)
+
+    if mmap_mode is not None:
+        if stride != 1:
+            raise ImproperlyConfigured(
+                "Striding is not supported when memory-mapping a "
+                "RaggedArray (got stride=%s)." % stride)
+        return LazyRaggedArray(data, lengths=lengths)
+
+    a = RaggedArray(data, lengths=lengths, error_checking=False, copy=False)
+    return a[:, ::stride] if stride != 1 else a
+
+
+def _check_row_shapes(shapes):
+    """Raise DataInvalid if arrays with the given shapes cannot be rows
+    of a single RaggedArray."""
+
+    if not all(len(shapes[0]) == len(shape) for shape in shapes):
+        raise DataInvalid(
+            "Loading a RaggedArray using HDF5 file keys requires "
+            "that all input arrays have the same dimension. Got "
+            "shapes: %s" % shapes)
+    for dim in range(1, len(shapes[0])):
+        if not all(shapes[0][dim] == shape[dim] for shape in shapes):
+            raise DataInvalid(
+                "Loading a RaggedArray using HDF5 file keys requires "
+                "that all input arrays share nonragged dimensions. "
+                " Dimension  %s didn't match. Got shapes: %s"
+                % (dim, shapes))
+
+
+def _load_h5_lazy(input_name, keys=..., stride=1):
+    """Open an HDF5 RaggedArray file as a LazyRaggedArray. The file
+    handle stays open until the returned array is closed."""
+
+    if stride != 1:
+        raise ImproperlyConfigured(
+            "Striding is not supported when memory-mapping a "
+            "RaggedArray (got stride=%s)." % stride)
+
+    handle = tables.open_file(input_name)
+    try:
+        layout = _contiguous_layout(handle)
+        if layout is not None and layout[1] is None:
+            arr = layout[0][:]
+            handle.close()
+            return arr
+        elif layout is not None:
+            node, offsets = layout
+            if keys is not None and keys is not Ellipsis:
+                handle.close()
+                return _load_contiguous(node, offsets, rows=keys)
+            nodes = [node]
+            lengths = np.diff(offsets)
+        elif keys is None or (keys is Ellipsis and '/lengths' in handle and
+                              '/array' in handle):
+            nodes = [handle.get_node('/array')]
+            lengths = handle.get_node('/lengths')[:]
+        else:
+            if keys is Ellipsis:
+                keys = [k.name for k in handle.list_nodes('/')]
+            nodes = [handle.get_node(where='/', name=k) for k in keys]
+
+            if len(nodes) == 1:
+                logger.debug("Found only one key ('%s') returning that as "
+                             "numpy array", keys[0])
+                arr = nodes[0][:]
+                handle.close()
+                return arr
+
+            _check_row_shapes([n.shape for n in nodes])
+            if not all(n.dtype == nodes[0].dtype for n in nodes):
+                raise DataInvalid(
+                    "Can't load keys in %s because the keys didn't have all "
+                    "the same dtype. Keys were: %s" % (input_name, keys))
+            lengths = [n.shape[0] for n in nodes]
+
+        return LazyRaggedArray(
+            _ConcatenatedNodes(nodes), lengths=lengths, handle=handle)
+    except:
+        handle.close()
+        raise
+
+
+def _load_h5_parallel(input_name, keys=..., stride=1, processes=None):
+    """Load an HDF5 RaggedArray file using a pool of reader processes.
+
+    The requested rows are split into reads aligned to the chunks of the
+    underlying datasets, which worker processes decompress directly into
+    their place in a shared output buffer. Striding is applied per read,
+    so chunks holding no selected frames are never read.
+    """
+
+    with tables.open_file(input_name) as handle:
+        layout = _contiguous_layout(handle)
+        if layout is not None and layout[1] is not None:
+            node, offsets = layout
+            row_ids = _select_rows(offsets, keys)
+            nodes = [node] * len(row_ids)
+            spans = list(zip(offsets[row_ids], offsets[row_ids + 1]))
+            single = keys is not None and keys is not Ellipsis and \
+                len(row_ids) == 1
+        elif layout is not None or keys is None:
+            node = layout[0] if layout is not None else \
+                handle.get_node('/arr_0')
+            nodes, spans, single = [node], [(0, len(node))], True
+        else:
+            if keys is Ellipsis:
+                keys = [k.name for k in handle.list_nodes('/')]
+            nodes = [handle.get_node(where='/', name=k) for k in keys]
+            _check_row_shapes([n.shape for n in nodes])
+            if not all(n.dtype == nodes[0].dtype for n in nodes):
+                raise DataInvalid(
+                    "Can't load keys in %s because the keys didn't have all "
+                    "the same dtype. Keys were: %s" % (input_name, keys))
+            spans = [(0, n.shape[0]) for n in nodes]
+            single = len(nodes) == 1
+
+        lengths = np.array([(stop - start + stride - 1) // stride
+                            for start, stop in spans], dtype=int)
+        shape = (int(lengths.sum()),) + tuple(nodes[0].shape[1:])
+        dtype = nodes[0].dtype
+
+        reads = []
+        dest = 0
+        for node, (start, stop), length in zip(nodes, spans, lengths):
+            reads.extend(_chunk_aligned_reads(node, start, stop, stride, dest))
+            dest += length
+
+    concat = _read_to_shared(input_name, reads, shape, dtype, processes)
+
+    if single:
+        return concat
+    return RaggedArray(concat, lengths=lengths, error_checking=False,
+                       copy=False)
+
+
+def _chunk_aligned_reads(node, start, stop, stride, dest):
+    """Split the read node[start:stop:stride] into reads of whole chunks
+    of `node`, skipping chunks that hold no selected frames.
+
+    Returns
+    -------
+    reads : list of tuples
+        (node path, start, stop, stride, position in output) for each
+        read.
+    """
+
+    chunk_rows = node.chunkshape[0] if node.chunkshape else \
+        max(stop - start, 1)
+    row_bytes = node.dtype.itemsize * int(np.prod(node.shape[1:]))
+    step = chunk_rows * max(
+        _PARALLEL_READ_BYTES // max(chunk_rows * row_bytes, 1), 1)
+
+    reads = []
+    for lo in range((start // step) * step, stop, step):
+        hi = min(lo + step, stop)
+        # first frame at or after lo that is selected by the stride
+        first = start + max(-(-(lo - start) // stride), 0) * stride
+        if first < hi:
+            reads.append((node._v_pathname, first, hi, stride,
+                          dest + (first - start) // stride))
+
+    return reads
+
+
+def _read_to_shared(input_name, reads, shape, dtype, processes):
+    """Perform `reads` (from _chunk_aligned_reads) from `input_name` in
+    a process pool, returning the filled array."""
+
+    size = int(np.prod(shape))
+    shared_buffer = mp.RawArray(ctypes.c_byte, max(size * dtype.itemsize, 1))
+
+    tick = time.perf_counter()
+    if reads:
+        with closing(mp.Pool(processes=processes, initializer=_init_reader,
+                             initargs=(shared_buffer, input_name))) as p:
+            p.map(partial(_read_to_position, arr_shape=shape, dtype=dtype),
+                  reads)
+        p.join()
+    tock = time.perf_counter()
+
+    mb = size * dtype.itemsize / 1024**2
+    logger.debug(
+        'Read %.1f MB from %s in %.2f s (%.1f MB/s) using %s reads on '
+        '%s processes.', mb, input_name, tock - tick,
+        mb / max(tock - tick, 1e-9), len(reads),
+        processes if processes else mp.cpu_count())
+
+    return np.frombuffer(shared_buffer, dtype=dtype, count=size).reshape(shape)
+
+
+def _init_reader(shared_buffer_, input_name):
+    # as in enspara.util.load, the shared buffer must be inherited
+    global shared_buffer, reader_handle
+    shared_buffer = shared_buffer_
+    reader_handle = tables.open_file(input_name)
+
+
+def _read_to_position(spec, arr_shape, dtype):
+    """Read node[start:stop:stride] from the worker's file handle into
+    the shared buffer at the given position."""
+
+    path, start, stop, stride, position = spec
+    data = reader_handle.get_node(path)[start:stop:stride]
+
+    arr = np.frombuffer(shared_buffer, dtype=dtype,
+                        count=int(np.prod(arr_shape))).reshape(arr_shape)
+    arr[position:position+len(data)] = data
+
+    return data.nbytes
+
+
 def _save_old_style(output_name, ragged_array):
     """Depricated en bloc RaggedArray saving routine.
 
@@ -114,10 +643,13 @@ def _save_old_style(output_name, ragged_array):
         io.saveh(output_name, ragged_array)
 
 
-def load(input_name, keys=..., stride=1):
+def load(input_name, keys=..., stride=1, mmap_mode=None, processes=1):
     """Load a RaggedArray from the disk. If only 'arr_0' is present in
     the target file, a numpy array is loaded instead.
 
+    Files ending in '.npy' are read as written by `save`, i.e. as a
+    flat array plus a '.lengths.npy' sidecar.
+
     Parameters
     ----------
     input_name: filename or file handle
@@ -126,11 +658,23 @@ def load(input_name, keys=..., stride=1):
         If this option is specified, the ragged array is built from this
         list of keys, each of which are assumed to be a row of the final
         ragged array. An ellipsis can be provided to indicate all keys.
+        For files with rows stored contiguously (see `save`), keys are
+        integer row indices instead.
     stride: int, default=1
         This option specifies a stride in the second dimension of the
         loaded ragged array. This is equivalent to slicing out
         [:, ::stride], except that it does not load the entire dataset
         into memory.
+    mmap_mode : {None, 'r', 'r+', 'c'}, default=None
+        If not None, leave the data on disk and return a
+        LazyRaggedArray that reads only the rows or elements that are
+        indexed. For .npy files, this is passed on to `np.load`; HDF5
+        files are always opened read-only. Requires stride=1.
+    processes : int or None, default=1
+        Number of processes used to read and decompress HDF5 files. If
+        None, use one per CPU. With more than one process, reads are
+        split along the chunks of the file, and chunks holding no frames
+        selected by `stride` are skipped entirely.
 
     Returns
     -------
@@ -138,7 +682,21 @@ def load(input_name, keys=..., stride=1):
         A ragged array from disk.
     """
 
+    if _is_npy(input_name):
+        return _load_npy(input_name, stride=stride, mmap_mode=mmap_mode)
+    if mmap_mode is not None:
+        return _load_h5_lazy(input_name, keys=keys, stride=stride)
+    if processes != 1:
+        return _load_h5_parallel(input_name, keys=keys, stride=stride,
+                                 processes=processes)
+
     with tables.open_file(input_name) as handle:
+        layout = _contiguous_layout(handle)
+        if layout is not None:
+            logger.debug('Loading contiguous RaggedArray from %s',
+                         input_name)
+            return _load_contiguous(*layout, rows=keys, stride=stride)
+
         if keys is None:
             if '/lengths' in handle:
                 a = RaggedArray(
@@ -165,18 +723,7 @@ def load(input_name, keys=..., stride=1):
             shapes = [handle.get_node(where='/', name=k).shape
                       for k in keys]
 
-            if not all(len(shapes[0]) == len(shape) for shape in shapes):
-                raise DataInvalid(
-                    "Loading a RaggedArray using HDF5 file keys requires "
-                    "that all input arrays have the same dimension. Got "
-                    "shapes: %s" % shapes)
-            for dim in range(1, len(shapes[0])):
-                if not all(shapes[0][dim] == shape[dim] for shape in shapes):
-                    raise DataInvalid(
-                        "Loading a RaggedArray using HDF5 file keys requires "
-                        "that all input arrays share nonragged dimensions. "
-                        " Dimension  %s didn't match. Got shapes: %s"
-                        % (dim, shapes))
+            _check_row_shapes(shapes)
 
             lengths = [(shape[0] + stride - 1) // stride for shape in shapes]
             concat_shape = (sum(lengths),) + (shapes[0][1:])
@@ -211,8 +758,9 @@ def load(input_name, keys=..., stride=1):
 
             tock = time.perf_counter()
             logger.debug(
-                'Filled RaggedArray in %.3f min with %.3f GB memory overhead.',
-                (tock - tick) / 60,
+                'Filled RaggedArray in %.3f min (%.1f MB/s) with %.3f GB '
+                'memory overhead.', (tock - tick) / 60,
+                concat.nbytes / 1024**2 / max(tock - tick, 1e-9),
                 resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024**2)
             tick = time.perf_counter()
 
@@ -228,72 +776,76 @@ def partition_indices(indices, traj_lengths):
     indices.
     '''
 
-    partitioned_indices = []
-    for index in indices:
-        trj_index = 0
-        for traj_len in traj_lengths:
-            if traj_len > index:
-                partitioned_indices.append((trj_index, index))
-                break
-            else:
-                index -= traj_len
-                trj_index += 1
+    indices = np.asarray(indices, dtype=int).reshape(-1)
+    traj_lengths = np.asarray(traj_lengths, dtype=int)
+
+    # indices past the end of the concatenated array have no 2d
+    # equivalent, and are dropped.
+    indices = indices[indices < np.sum(traj_lengths)]
+
+    rows, cols = _convert_from_1d((indices,), lengths=traj_lengths)
+
+    return [(int(r), int(c)) for r, c in zip(rows, cols)]
 
-    return partitioned_indices
+
+def _starts_from_lengths(lengths):
+    """Compute the position of the first element of each row in the
+    concatenated array from the length of each row."""
+    starts = np.zeros(len(lengths), dtype=int)
+    starts[1:] = np.cumsum(lengths[:-1])
+    return starts
 
 
 def _convert_from_1d(iis_flat, lengths=None, starts=None):
-    """Given 1d indices, converts to 2d."""
+    """Given 1d indices, converts to 2d.
+
+    The row of each index is found by binary search over `starts`, so
+    conversion is O(n_indices * log(n_rows)) and never iterates in
+    Python.
+    """
     if lengths is None and starts is None:
         raise ImproperlyConfigured(
             'No lengths or starts supplied')
     if starts is None:
-        starts = np.append([0], np.cumsum(lengths)[:-1])
-    iis_flat = iis_flat[0]
-    first_dimension = [
-        np.where(starts <= ii)[0][-1] for ii in iis_flat]
-    second_dimension = [
-        iis_flat[num]-starts[first_dimension[num]]
-        for num in range(len(iis_flat))]
-    return (np.array(first_dimension), np.array(second_dimension))
+        starts = _starts_from_lengths(np.asarray(lengths))
+    iis_flat = np.asarray(iis_flat[0], dtype=int)
+
+    # side='right' resolves runs of identical starts (zero-length rows)
+    # to the last such row, which is the only one that can hold data.
+    first_dimension = np.searchsorted(starts, iis_flat, side='right') - 1
+    second_dimension = iis_flat - np.asarray(starts)[first_dimension]
+    return (first_dimension, second_dimension)
 
 
 def _handle_negative_indices(
         first_dimension, second_dimension, lengths=None, starts=None):
     """Given 2d indices as first_dimenion and second_dimension, converts
        any negative index to a positive one."""
-    if type(first_dimension) is not np.ndarray:
-        first_dimension = np.array(first_dimension)
-    if type(second_dimension) is not np.ndarray:
-        second_dimension = np.array(second_dimension)
+    first_dimension = np.array(first_dimension, dtype=int)
+    second_dimension = np.array(second_dimension, dtype=int)
+
     # remove negative indices from first dimension
-    first_dimension_neg_iis = np.where(first_dimension < 0)[0]
-    second_dimension_neg_iis = np.where(second_dimension < 0)[0]
-    if len(first_dimension_neg_iis) > 0:
-        if first_dimension.size > 1:
-            first_dimension[first_dimension_neg_iis] += len(starts)
-        else:
-            first_dimension += len(starts)
-        if len(np.where(first_dimension < 0)[0]) > 0:
-            # TODO: have clear error message here
-            raise IndexError()
+    first_dimension_neg = first_dimension < 0
+    if np.any(first_dimension_neg):
+        first_dimension[first_dimension_neg] += len(starts)
+        if np.any(first_dimension < 0):
+            raise IndexError(
+                'Row index out of range for RaggedArray with %s rows.' %
+                len(starts))
+
     # remove negative indices from second dimension
-    if len(second_dimension_neg_iis) > 0:
+    second_dimension_neg = second_dimension < 0
+    if np.any(second_dimension_neg):
         if lengths is None:
             raise ImproperlyConfigured(
                 'Must supply lengths if indices are negative.')
-        if second_dimension.size > 1:
-            if first_dimension.size > 1:
-                second_dimension[second_dimension_neg_iis] += lengths[
-                    first_dimension[second_dimension_neg_iis]]
-            else:
-                second_dimension[second_dimension_neg_iis] += lengths[
-                    first_dimension]
-        else:
-            second_dimension += lengths[first_dimension]
-        if len(np.where(second_dimension < 0)[0]) > 0:
-            # TODO: have clear error message here
-            raise IndexError()
+        row_lengths = np.broadcast_to(
+            np.asarray(lengths)[first_dimension], second_dimension.shape)
+        second_dimension[second_dimension_neg] += \
+            row_lengths[second_dimension_neg]
+        if np.any(second_dimension < 0):
+            raise IndexError(
+                'Column index out of range for RaggedArray row.')
     return first_dimension, second_dimension
 
 
@@ -304,21 +856,21 @@ def _convert_from_2d(iis_ragged, lengths=None, starts=None, error_check=True):
         raise ImproperlyConfigured(
             'No lengths or starts supplied')
     if starts is None:
-        starts = np.append([0], np.cumsum(lengths)[:-1])
+        starts = _starts_from_lengths(np.asarray(lengths))
     first_dimension, second_dimension = iis_ragged
     first_dimension = np.array(first_dimension)
     second_dimension = np.array(second_dimension)
     # Account for iis = ([0,1,2],4)
     if first_dimension.size > 1 and second_dimension.size == 1:
-        second_dimension = np.array(
-            [second_dimension for n in first_dimension])
+        second_dimension = np.full(
+            first_dimension.shape, second_dimension.reshape(-1)[0])
     first_dimension, second_dimension = _handle_negative_indices(
         first_dimension, second_dimension, lengths=lengths, starts=starts)
     # Check for index error
     if lengths is not None and error_check:
-        if np.any(lengths[first_dimension] <= second_dimension):
+        if np.any(np.asarray(lengths)[first_dimension] <= second_dimension):
             raise IndexError
-    iis_flat = starts[first_dimension]+second_dimension
+    iis_flat = np.asarray(starts)[first_dimension]+second_dimension
     return (iis_flat,)
 
 
@@ -368,6 +920,64 @@ def partition_list(list_to_partition, partition_lengths):
     return partitioned_list
 
 
+def _partition_views(data, lengths):
+    """Build a 1d object array holding a view into `data` for each row.
+
+    Unlike np.array(partition_list(data, lengths), dtype='O'), the result
+    is 1d and holds views even when all rows have the same length.
+    """
+    rows = partition_list(data, lengths)
+    views = np.empty(len(rows), dtype='O')
+    for i, row in enumerate(rows):
+        views[i] = row
+    return views
+
+
+def _check_row_axis(axis):
+    if axis != 1:
+        raise ImproperlyConfigured(
+            "RaggedArray reductions are supported over the whole array "
+            "(axis=None) or within rows (axis=1), not axis=%s." % axis)
+
+
+def _segment_reduce(ufunc, data, lengths, dtype=None, empty=None):
+    """Reduce each row of the concatenated `data` with `ufunc`, giving
+    the same result as ufunc.reduce(row, axis=0) for every row, but in
+    a single call to ufunc.reduceat.
+
+    Rows of length zero are given the value `empty`, or raise a
+    ValueError if `empty` is None (as numpy does for, e.g., the max of
+    an empty array).
+    """
+
+    data = np.asarray(data)
+    lengths = np.asarray(lengths, dtype=int)
+
+    nonempty = lengths > 0
+    if not np.all(nonempty) and empty is None:
+        raise ValueError(
+            "Can't reduce zero-size rows with %s, which has no "
+            "identity." % ufunc.__name__)
+
+    # reduceat reduces from each start to the next one, so skipping
+    # empty rows leaves exactly the span of each nonempty row.
+    if np.any(nonempty):
+        starts = _starts_from_lengths(lengths)[nonempty]
+        reduced = ufunc.reduceat(data, starts, axis=0, dtype=dtype)
+        if np.all(nonempty):
+            return reduced
+        dtype = reduced.dtype
+    elif dtype is None:
+        dtype = data.dtype
+
+    out = np.empty((len(lengths),) + data.shape[1:], dtype=dtype)
+    out[~nonempty] = empty
+    if np.any(nonempty):
+        out[nonempty] = reduced
+
+    return out
+
+
 def _is_iterable(iterable):
     """Indicates if the input is iterable but not due to being a string or
        bytes. Returns a boolean value."""
@@ -428,49 +1038,74 @@ def _format_array(array, operator):
         return "".join([header, ",\n".join(body), aftermath])
 
 
+def _resolve_slice(slice_func, lengths):
+    """Resolve a slice against an array of row lengths, returning
+    per-row (start, stop) arrays and the step. Semantics match
+    slice.indices applied to each row individually."""
+    lengths = np.asarray(lengths, dtype=int)
+    step = 1 if slice_func.step is None else slice_func.step
+    if step == 0:
+        raise ValueError('slice step cannot be zero')
+
+    if step > 0:
+        lower, upper = np.zeros_like(lengths), lengths
+    else:
+        lower, upper = np.zeros_like(lengths) - 1, lengths - 1
+
+    def _bound(value, default):
+        if value is None:
+            return default.copy()
+        elif value < 0:
+            return np.maximum(lengths + value, lower)
+        else:
+            return np.minimum(np.zeros_like(lengths) + value, upper)
+
+    start = _bound(slice_func.start, lower if step > 0 else upper)
+    stop = _bound(slice_func.stop, upper if step > 0 else lower)
+
+    return start, stop, step
+
+
 def _get_iis_from_slices(first_dimension_iis, second_dimension, lengths):
     """Given the indices of the first dimension, the second dimension
     (as a slice), and the lengths of the ragged dimension, returns the
     2D indices and the new lengths in the ragged dimension."""
-    start = second_dimension.start
-    stop = second_dimension.stop
-    step = second_dimension.step
-    if start is None:
-        start = 0
-    if step is None:
-        step = 1
-    # handle negative slicing
-    if stop is None:
-        stops = lengths
-    elif stop < 0:
-        stops = lengths + stop
+    first_dimension_iis = np.asarray(first_dimension_iis, dtype=int)
+    row_lengths = np.asarray(lengths)[first_dimension_iis]
+
+    # resolve the slice against each row's length, as slice.indices
+    # would, but for every row at once.
+    start, stop, step = _resolve_slice(second_dimension, row_lengths)
+
+    # number of elements each row's range(start, stop, step) produces
+    if step > 0:
+        iis_2d_lengths = np.maximum((stop - start + step - 1) // step, 0)
     else:
-        stops = np.zeros(lengths.shape, dtype=int) + stop
-    # if indices go past length, make it go upto length
-    iis_to_flat = np.where(stops > lengths)
-    stops[iis_to_flat] = lengths[iis_to_flat]
-    iis_2d = np.array(
-        [np.arange(start, stops[num], step) for num in first_dimension_iis])
-    iis_2d_lengths = np.array([len(i) for i in iis_2d])
-    iis_1d = np.array(
-        np.concatenate(
-            np.array(
-                [
-                    list(
-                        itertools.repeat(first_dimension_iis[i],
-                        iis_2d_lengths[i]))
-                    for i in range(len(iis_2d_lengths))])), dtype=int)
-    return (iis_1d, np.concatenate(iis_2d)), iis_2d_lengths
+        iis_2d_lengths = np.maximum((start - stop - step - 1) // -step, 0)
+
+    # build all rows' column indices at once: each element's offset
+    # within its own row, scaled by step and shifted by the row start.
+    n_total = np.sum(iis_2d_lengths)
+    row_offsets = np.repeat(
+        _starts_from_lengths(iis_2d_lengths), iis_2d_lengths)
+    within_row = np.arange(n_total, dtype=int) - row_offsets
+    iis_2d = np.repeat(start, iis_2d_lengths) + within_row * step
+    iis_1d = np.repeat(first_dimension_iis, iis_2d_lengths)
+
+    return (iis_1d, iis_2d), iis_2d_lengths
 
 
 def _get_iis_from_list(first_dimension, second_dimension):
     """Given the indices of the first dimension, the second dimension
     (as a list), and the lengths of the ragged dimension, returns the
     2D indices and the new lengths in the ragged dimension."""
-    iis = np.array(
-        list(itertools.product(first_dimension, second_dimension))).T
-    new_lengths = list(
-        itertools.repeat(len(second_dimension), len(first_dimension)))
+    first_dimension = np.asarray(first_dimension, dtype=int)
+    second_dimension = np.asarray(second_dimension, dtype=int).reshape(-1)
+    iis = np.array([
+        np.repeat(first_dimension, len(second_dimension)),
+        np.tile(second_dimension, len(first_dimension))])
+    new_lengths = np.full(
+        len(first_dimension), len(second_dimension), dtype=int)
     return iis, new_lengths
 
 
@@ -499,7 +1134,10 @@ class RaggedArray(object):
     def __init__(self, array, lengths=None, error_checking=True, copy=True):
         # Check that input is proper (array of arrays)
         if error_checking:
-            array = np.array(list(array))
+            # a list is enough for the checks below; np.array would copy
+            # (and, for equal-length rows, build an object matrix).
+            if not isinstance(array, np.ndarray):
+                array = list(array)
             if len(array) > 20000:
                 # lenghts is None => we are not inferring lengths from
                 # e.g. nested lists
@@ -521,7 +1159,7 @@ class RaggedArray(object):
                 self._data = np.concatenate(array)
             else:
                 self._data = np.array(array, copy=copy)
-        elif len(array) > 0:
+        else:
             logger.debug("Interpreting array as concatenated array.")
             self._data = np.array(array, copy=copy)
 
@@ -531,8 +1169,7 @@ class RaggedArray(object):
             # array of arrays
             if _is_iterable(array[0]):
                 self.lengths = np.array([len(i) for i in array], dtype=int)
-                self._array = np.array(
-                    partition_list(self._data, self.lengths), dtype='O')
+                self._array = _partition_views(self._data, self.lengths)
             # array of single values
             else:
                 self.lengths = np.array([len(array)], dtype=int)
@@ -544,8 +1181,7 @@ class RaggedArray(object):
         # rebuild array from 1d and lengths
         else:
             try:
-                self._array = np.array(
-                    partition_list(self._data, lengths), dtype='O')
+                self._array = _partition_views(self._data, lengths)
             except DataInvalid:
                 raise DataInvalid(
                     "Sum of lengths (%s) didn't match data shape (%s)." %
@@ -576,9 +1212,58 @@ class RaggedArray(object):
 
     @property
     def starts(self):
-        return np.append([0], np.cumsum(self.lengths)[:-1])
+        return _starts_from_lengths(self.lengths)
+
+    @classmethod
+    def from_buffer(cls, data, lengths):
+        """Construct a RaggedArray around an existing flat array,
+        without copying it.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            The rows, concatenated along the first axis. The new
+            RaggedArray is a view into this array, so changes to one
+            are seen by the other.
+        lengths : array-like, [n]
+            The length of each row.
+
+        Returns
+        -------
+        ra : RaggedArray
+        """
+
+        data = np.asarray(data)
+        if data.ndim == 0:
+            raise DataInvalid("Can't build a RaggedArray from a scalar.")
+
+        return cls(data, lengths=np.asarray(lengths, dtype=int),
+                   error_checking=False, copy=False)
+
+    def iter_rows(self):
+        """Iterate over the rows of this array, yielding each as a view
+        into the underlying data.
+        """
+        data = self._data
+        stops = np.cumsum(self.lengths)
+        for start, stop in zip((stops - self.lengths).tolist(),
+                               stops.tolist()):
+            yield data[start:stop]
+
+    def rows_view(self):
+        """Get the rows of this array as views into the underlying data.
+
+        Returns
+        -------
+        rows : np.ndarray, shape=(n_rows,), dtype=object
+            Array holding a view of each row.
+        """
+        return _partition_views(self._data, self.lengths)
 
     # Built in functions
+    def __iter__(self):
+        return self.iter_rows()
+
     def __len__(self):
         return len(self._array)
 
@@ -640,12 +1325,12 @@ class RaggedArray(object):
 
         # if the indices are of self, assumes a boolean matrix. Converts
         # bool to indices and recalls __getitem__
-        elif type(iis) is type(self):
+        elif isinstance(iis, RaggedArray):
             iis = where(iis)
             return self.__getitem__(iis)
 
     def __setitem__(self, iis, value):
-        if type(value) is type(self):
+        if isinstance(value, RaggedArray):
             value = value._array
         # ints, slices, lists, and numpy objects are handled by numpy
         if isinstance(iis, (numbers.Integral, slice, list, np.ndarray)):
@@ -699,8 +1384,7 @@ class RaggedArray(object):
                 else:
                     value_1d = value
                 self._data[iis_1d] = value_1d
-                self._array = np.array(
-                    partition_list(self._data, self.lengths), dtype='O')
+                self._array = _partition_views(self._data, self.lengths)
                 return
             # Takes 2D indices generated from slicing in the first or second
             # dimension and sets data values to input values
@@ -714,11 +1398,10 @@ class RaggedArray(object):
             else:
                 value_1d = value
             self._data[iis_1d] = value_1d
-            self._array = np.array(
-                partition_list(self._data, self.lengths), dtype='O')
+            self._array = _partition_views(self._data, self.lengths)
         # if the indices are of self, assumes a boolean matrix. Converts
         # bool to indices and recalls __getitem__
-        elif type(iis) is type(self):
+        elif isinstance(iis, RaggedArray):
             iis = where(iis)
             self.__setitem__(iis, value)
 
@@ -773,7 +1456,7 @@ class RaggedArray(object):
     def __and__(self, other):
         return self.map_operator('__and__', other)
     def map_operator(self, operator, other):
-        if type(other) is type(self):
+        if isinstance(other, RaggedArray):
             other = other._data
         new_data = getattr(self._data, operator)(other)
 
@@ -790,11 +1473,163 @@ class RaggedArray(object):
     def any(self):
         return np.any(self._data)
 
-    def max(self):
-        return self._data.max()
-
-    def min(self):
-        return self._data.min()
+    def max(self, axis=None):
+        if axis is None:
+            return self._data.max()
+        _check_row_axis(axis)
+        return self._reduce_rows(np.maximum)
+
+    def min(self, axis=None):
+        if axis is None:
+            return self._data.min()
+        _check_row_axis(axis)
+        return self._reduce_rows(np.minimum)
+
+    def sum(self, axis=None):
+        """Sum the elements of the whole array (axis=None) or of each
+        row (axis=1). Rows of length zero sum to zero.
+
+        Integer and boolean data are accumulated in the same dtype that
+        np.sum would use.
+        """
+        if axis is None:
+            return self.sum(axis=1).sum()
+        _check_row_axis(axis)
+        dtype = np.zeros(0, dtype=self.dtype).sum().dtype
+        return self._reduce_rows(np.add, dtype=dtype, empty=0)
+
+    def mean(self, axis=None):
+        """Average the elements of the whole array (axis=None) or of
+        each row (axis=1). The mean of a row of length zero is nan.
+        """
+        if axis is None:
+            n_elements = self.lengths.sum() * int(np.prod(self._data.shape[1:]))
+            return self.sum() / n_elements
+        _check_row_axis(axis)
+        dtype = np.zeros(1, dtype=self.dtype).mean().dtype
+        sums = self._reduce_rows(np.add, dtype=dtype, empty=np.nan)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return sums / self.lengths.reshape((-1,) + (1,)*(sums.ndim-1))
+
+    def bincount(self, minlength=0):
+        """Count occurrences of each value within each row, as
+        np.bincount does for a single array.
+
+        Negative values (such as the -1 given to unassigned frames) are
+        not counted.
+
+        Parameters
+        ----------
+        minlength : int, default=0
+            A minimum number of bins for the output array.
+
+        Returns
+        -------
+        counts : np.ndarray, shape=(n_rows, n_bins)
+            The number of times each value occurs in each row, where
+            n_bins is the larger of max(self) + 1 and minlength.
+        """
+
+        if self._data.ndim != 1 or not np.issubdtype(self.dtype, np.integer):
+            raise DataInvalid(
+                "bincount requires a RaggedArray of integers with one "
+                "dimension per row, not %s data of shape %s." %
+                (self.dtype, self.shape))
+
+        n_bins = max(int(self.max()) + 1 if self.size else 0, minlength)
+        counts = np.zeros((len(self.lengths), n_bins), dtype=int)
+
+        for rows, lengths, data in self._iter_row_blocks():
+            row_ids = np.repeat(np.arange(len(lengths)), lengths)
+            keep = data >= 0
+            flat_bins = row_ids[keep] * n_bins + data[keep]
+            counts[rows] = np.bincount(
+                flat_bins, minlength=len(lengths) * n_bins).reshape(
+                    len(lengths), n_bins)
+
+        return counts
+
+    def segment_apply(self, func, per_row=None):
+        """Apply a vectorized function to every row at once, without
+        iterating over rows in Python.
+
+        Parameters
+        ----------
+        func : np.ufunc or callable
+            If a binary ufunc (e.g. np.logical_or), each row is reduced
+            with it and the result has one value per row (rows of
+            length zero take the ufunc's identity). Otherwise,
+            func is called as `func(data, row_ids)` on the concatenated
+            rows and the row of each element, and must return either
+            one value per element or one value per row.
+        per_row : bool, default=None
+            Whether func returns one value per row (True) or one value
+            per element (False). If None, this is inferred from the
+            number of values func returns; when the number of elements
+            equals the number of rows (e.g. every row has length one),
+            the values are taken to be per element.
+
+        Returns
+        -------
+        result : RaggedArray or np.ndarray
+            A RaggedArray with the lengths of this one if func returned
+            one value per element, otherwise an array with one value per
+            row.
+
+        Examples
+        --------
+        >>> a = RaggedArray([[1, 2, 3], [4, 5]])
+        >>> a.segment_apply(np.multiply)
+        array([ 6, 20])
+        >>> a.segment_apply(lambda x, rows: x - a.mean(axis=1)[rows])
+        RaggedArray([[-1. 0. 1.],
+                     [-0.5 0.5]])
+        """
+
+        if isinstance(func, np.ufunc):
+            return self._reduce_rows(func, empty=func.identity)
+
+        data = np.asarray(self._data[:])
+        row_ids = np.repeat(np.arange(len(self.lengths)), self.lengths)
+        result = np.asarray(func(data, row_ids))
+
+        if per_row is None:
+            per_row = len(result) != len(data)
+
+        if not per_row and len(result) == len(data):
+            return RaggedArray(result, lengths=self.lengths,
+                               error_checking=False, copy=False)
+        elif per_row and len(result) == len(self.lengths):
+            return result
+        else:
+            raise DataInvalid(
+                "segment_apply expected %s returned values (one per "
+                "element) or %s (one per row), but got %s." %
+                (len(data), len(self.lengths), len(result)))
+
+    def _iter_row_blocks(self):
+        """Yield (rows, lengths, data) for consecutive blocks of rows,
+        where rows is a slice, lengths are the lengths of those rows and
+        data holds them concatenated.
+        """
+        yield slice(0, len(self.lengths)), self.lengths, self._data
+
+    def _reduce_rows(self, ufunc, dtype=None, empty=None):
+        """Reduce every row with `ufunc` (see _segment_reduce)."""
+
+        blocks = [(rows, _segment_reduce(ufunc, data, lengths,
+                                         dtype=dtype, empty=empty))
+                  for rows, lengths, data in self._iter_row_blocks()]
+        if len(blocks) == 1:
+            return blocks[0][1]
+
+        out = np.empty((len(self.lengths),) + self._data.shape[1:],
+                       dtype=blocks[0][1].dtype if blocks else
+                       np.dtype(dtype or self.dtype))
+        for rows, block in blocks:
+            out[rows] = block
+
+        return out
 
     @property
     def size(self):
@@ -802,7 +1637,7 @@ class RaggedArray(object):
 
     def append(self, values):
         # if the incoming values is a RaggedArray, pull just the array
-        if type(values) is type(self):
+        if isinstance(values, RaggedArray):
             values = values._array
         # if the current RaggedArray is blank, generate a new one
         # with the values input
@@ -822,8 +1657,464 @@ class RaggedArray(object):
                     'Expected an array of values or a ragged array')
             # update variables
             self.lengths = np.append(self.lengths, new_lengths)
-            self._array = np.array(
-                partition_list(self._data, self.lengths), dtype='O')
+            self._array = _partition_views(self._data, self.lengths)
 
     def flatten(self):
         return self._data.flatten()
+
+
+class _ConcatenatedNodes(object):
+    """Read-only, ndarray-like view of the concatenation of one or more
+    on-disk arrays (e.g. pytables nodes).
+
+    Nothing is read until the view is indexed, and then only the
+    region of each node covering the requested elements is read.
+    Indexing is supported along the first axis only.
+
+    Parameters
+    ----------
+    nodes : list
+        Array-likes supporting `shape`, `dtype` and slicing along the
+        first axis (for example, pytables Array nodes).
+    """
+
+    def __init__(self, nodes):
+        self._nodes = list(nodes)
+
+        node_lengths = np.array([n.shape[0] for n in self._nodes], dtype=int)
+        self._starts = _starts_from_lengths(node_lengths)
+
+        self.shape = (int(node_lengths.sum()),) + tuple(self._nodes[0].shape[1:])
+        self.dtype = np.dtype(self._nodes[0].dtype)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None):
+        arr = self[:]
+        return arr if dtype is None else arr.astype(dtype)
+
+    def __getitem__(self, iis):
+        if isinstance(iis, tuple):
+            if len(iis) > 1:
+                rows = self[iis[0]]
+                if isinstance(iis[0], numbers.Integral):
+                    return rows[iis[1:]]
+                return rows[(slice(None),) + iis[1:]]
+            iis = iis[0]
+
+        if isinstance(iis, numbers.Integral):
+            if iis < 0:
+                iis += len(self)
+            if not 0 <= iis < len(self):
+                raise IndexError(
+                    'index %s is out of bounds for axis 0 with size %s' %
+                    (iis, len(self)))
+            node_id = np.searchsorted(self._starts, iis, side='right') - 1
+            return self._nodes[node_id][iis - self._starts[node_id]]
+        elif isinstance(iis, slice):
+            start, stop, step = iis.indices(len(self))
+            if step == 1:
+                return self._read_range(start, stop)
+            iis = np.arange(start, stop, step)
+
+        iis = np.asarray(iis)
+        if iis.dtype == bool:
+            iis = np.flatnonzero(iis)
+        return self._read_points(iis)
+
+    def _read_range(self, start, stop):
+        """Read the contiguous range [start, stop) into memory."""
+
+        out = np.empty((max(stop - start, 0),) + self.shape[1:],
+                       dtype=self.dtype)
+        if stop <= start:
+            return out
+
+        first = np.searchsorted(self._starts, start, side='right') - 1
+        last = np.searchsorted(self._starts, stop - 1, side='right') - 1
+
+        for node_id in range(first, last + 1):
+            node_start = self._starts[node_id]
+            node_len = self._nodes[node_id].shape[0]
+
+            lo = max(start, node_start)
+            hi = min(stop, node_start + node_len)
+            if hi > lo:
+                out[lo - start:hi - start] = \
+                    self._nodes[node_id][lo - node_start:hi - node_start]
+
+        return out
+
+    def _read_points(self, iis):
+        """Read an arbitrary set of flat indices into memory, reading
+        only the span of each node that contains requested indices."""
+
+        iis = iis.astype(int, copy=True)
+        iis[iis < 0] += len(self)
+        if np.any((iis < 0) | (iis >= len(self))):
+            raise IndexError(
+                'index out of bounds for axis 0 with size %s' % len(self))
+
+        out = np.empty(iis.shape + self.shape[1:], dtype=self.dtype)
+        if iis.size == 0:
+            return out
+
+        flat_iis = iis.reshape(-1)
+        flat_out = out.reshape((-1,) + self.shape[1:])
+
+        node_ids, offsets = _convert_from_1d((flat_iis,), starts=self._starts)
+
+        order = np.argsort(node_ids, kind='mergesort')
+        bounds = np.flatnonzero(np.diff(node_ids[order])) + 1
+        for group in np.split(order, bounds):
+            node = self._nodes[node_ids[group[0]]]
+            lo, hi = offsets[group].min(), offsets[group].max() + 1
+            flat_out[group] = node[lo:hi][offsets[group] - lo]
+
+        return out
+
+
+class _LazyRows(object):
+    """Row accessor for a LazyRaggedArray. Produces each row only when
+    it is requested, stepping in for the object array of row views that
+    an in-memory RaggedArray keeps in `_array`."""
+
+    __slots__ = ('_data', '_lengths', '_starts')
+
+    def __init__(self, data, lengths):
+        self._data = data
+        self._lengths = lengths
+        self._starts = _starts_from_lengths(lengths)
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def __getitem__(self, iis):
+        if isinstance(iis, numbers.Integral):
+            if iis < 0:
+                iis += len(self)
+            if not 0 <= iis < len(self):
+                raise IndexError(
+                    'index %s is out of bounds for RaggedArray with %s rows' %
+                    (iis, len(self)))
+            start = self._starts[iis]
+            return self._data[start:start+self._lengths[iis]]
+
+        if isinstance(iis, slice):
+            row_ids = range(*iis.indices(len(self)))
+        else:
+            row_ids = np.arange(len(self))[iis]
+
+        rows = np.empty(len(row_ids), dtype='O')
+        for i, row_id in enumerate(row_ids):
+            rows[i] = self[int(row_id)]
+        return rows
+
+
+class LazyRaggedArray(RaggedArray):
+    """A read-only RaggedArray whose data stays on disk.
+
+    The flat data are either a numpy memory map (for `.npy` files) or
+    a lazy view over HDF5 nodes (for `.h5` files), so indexing reads
+    only the rows or elements that are requested. Indexing and
+    element-wise operations return ordinary, in-memory RaggedArrays or
+    ndarrays. Reductions and operators are computed in blocks so that
+    memory use is bounded by the size of the result.
+
+    Instances are typically created with `ra.load(..., mmap_mode='r')`.
+    If the underlying file handle needs to be released deterministically,
+    use the array as a context manager or call `close`.
+
+    Parameters
+    ----------
+    data : np.memmap or array-like
+        The concatenated data, indexable along the first axis.
+    lengths : array, [n]
+        The length of each row.
+    handle : file handle, default=None
+        Open handle backing `data`, closed by `close`.
+    """
+
+    __slots__ = ('_handle',)
+
+    # number of elements processed at a time in blockwise operations
+    _block_size = 2**22
+
+    def __init__(self, data, lengths, handle=None):
+        lengths = np.array(lengths, dtype=int)
+        if lengths.sum() != len(data):
+            raise DataInvalid(
+                "Sum of lengths (%s) didn't match data shape (%s)." %
+                (lengths.sum(), data.shape))
+
+        self._data = data
+        self.lengths = lengths
+        self._array = _LazyRows(data, lengths)
+        self._handle = handle
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __setitem__(self, iis, value):
+        raise ValueError(
+            "LazyRaggedArrays are read-only. Load the array into memory "
+            "with ra.load(mmap_mode=None) to modify it.")
+
+    def append(self, values):
+        raise ValueError(
+            "LazyRaggedArrays are read-only and cannot be appended to.")
+
+    def rows_view(self):
+        raise TypeError(
+            "Rows of a LazyRaggedArray aren't in memory to be viewed. Use "
+            "iter_rows to read them one at a time.")
+
+    def _iter_blocks(self):
+        for start in range(0, len(self._data), self._block_size):
+            stop = min(start + self._block_size, len(self._data))
+            yield start, stop, np.asarray(self._data[start:stop])
+
+    def map_operator(self, operator, other):
+        if isinstance(other, RaggedArray):
+            other = other._data
+        elementwise = (hasattr(other, '__len__') and
+                       not isinstance(other, (str, bytes)) and
+                       len(other) == len(self._data))
+
+        new_data = None
+        for start, stop, block in self._iter_blocks():
+            block_other = other[start:stop] if elementwise else other
+            new_block = getattr(block, operator)(block_other)
+            if new_block is NotImplemented:
+                return NotImplemented
+            if new_data is None:
+                new_data = np.empty(
+                    (len(self._data),) + new_block.shape[1:],
+                    dtype=new_block.dtype)
+            new_data[start:stop] = new_block
+
+        if new_data is None:
+            new_data = getattr(np.asarray(self._data), operator)(other)
+        return RaggedArray(array=new_data, lengths=self.lengths,
+                           error_checking=False, copy=False)
+
+    def __invert__(self):
+        new_data = np.empty(self._data.shape, dtype=self.dtype)
+        for start, stop, block in self._iter_blocks():
+            new_data[start:stop] = ~block
+        return RaggedArray(new_data, lengths=self.lengths,
+                           error_checking=False, copy=False)
+
+    def all(self):
+        return all(np.all(b) for _, _, b in self._iter_blocks())
+
+    def any(self):
+        return any(np.any(b) for _, _, b in self._iter_blocks())
+
+    def _iter_row_blocks(self):
+        # whole rows are read at a time, as many as fit in _block_size
+        # elements (or one, if it is longer than that).
+        stops = np.cumsum(self.lengths)
+        first = 0
+        while first < len(self.lengths):
+            start = stops[first] - self.lengths[first]
+            last = max(first + 1, np.searchsorted(
+                stops, start + self._block_size, side='right'))
+            yield (slice(first, last), self.lengths[first:last],
+                   np.asarray(self._data[start:stops[last-1]]))
+            first = last
+
+    def max(self, axis=None):
+        if axis is None:
+            return max(b.max() for _, _, b in self._iter_blocks())
+        return super(LazyRaggedArray, self).max(axis=axis)
+
+    def min(self, axis=None):
+        if axis is None:
+            return min(b.min() for _, _, b in self._iter_blocks())
+        return super(LazyRaggedArray, self).min(axis=axis)
+
+    def flatten(self):
+        return np.array(self._data[:]).flatten()
+
+
+class RaggedArrayWriter(object):
+    """Write a RaggedArray to an HDF5 file one row at a time.
+
+    Rows are appended to the contiguous layout (see `save`) and flushed
+    to disk as they are written, so memory use is bounded by the size
+    of a single row. Completed rows are recorded in the file's offsets
+    index, which means a file written by an interrupted job can be
+    reopened with `resume=True` and continued from the last complete
+    row. Once the writer is closed, the file is read with `load`.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the HDF5 file to write.
+    compression_level : int, default=1
+        Level of compression to use, as in `save`.
+    resume : bool, default=False
+        If True and `filename` exists, append to the rows it already
+        holds (discarding any partially-written row) rather than
+        overwriting it.
+    dtype : np.dtype, default=None
+        If given, rows are cast to this dtype as they are written.
+        Otherwise, the dtype of the first row is used.
+
+    Examples
+    --------
+    >>> with RaggedArrayWriter('assignments.h5') as writer:
+    ...     for trj in trajectories:
+    ...         writer.append(assign(trj))
+    >>> assignments = ra.load('assignments.h5')
+    """
+
+    def __init__(self, filename, compression_level=1, resume=False,
+                 dtype=None):
+        self.filename = filename
+        self.dtype = None if dtype is None else np.dtype(dtype)
+        self._filters = tables.Filters(
+            complevel=compression_level,
+            complib='zlib',
+            shuffle=True)
+
+        if resume and os.path.exists(filename):
+            self._handle = tables.open_file(filename, 'a')
+            try:
+                self._reopen()
+            except:
+                self._handle.close()
+                raise
+        else:
+            self._handle = tables.open_file(filename, 'w')
+            self._data = None
+            self._offsets = self._handle.create_earray(
+                where='/', name='offsets', atom=tables.Int64Atom(),
+                shape=(0,))
+            self._offsets.append([0])
+            self._handle.root._v_attrs.ra_format_version = \
+                CONTIGUOUS_FORMAT_VERSION
+            self._handle.flush()
+
+    def _reopen(self):
+        root = self._handle.root
+        if 'ra_format_version' not in root._v_attrs or \
+                not isinstance(getattr(root, 'offsets', None), tables.EArray):
+            raise DataInvalid(
+                "Can't resume writing %s, it wasn't written by a "
+                "RaggedArrayWriter." % self.filename)
+
+        self._offsets = root.offsets
+        self._data = getattr(root, 'data', None)
+
+        # drop any data written after the last completed row
+        if self._data is not None and \
+                self._data.nrows > self._offsets[-1]:
+            logger.info("Discarding %s frames of incomplete row %s in %s.",
+                        self._data.nrows - self._offsets[-1], self.n_rows,
+                        self.filename)
+            self._data.truncate(self._offsets[-1])
+
+        logger.debug("Resuming %s after %s complete rows.",
+                     self.filename, self.n_rows)
+
+    @property
+    def n_rows(self):
+        """Number of rows completely written to the file."""
+        return self._offsets.nrows - 1
+
+    @property
+    def lengths(self):
+        """Lengths of the rows written so far."""
+        return np.diff(self._offsets[:])
+
+    def append(self, row):
+        """Write `row` to the end of the file.
+
+        Parameters
+        ----------
+        row : array-like
+            The row to append. Its shape in all but the first dimension
+            must match previously-written rows.
+        """
+
+        row = np.asarray(row)
+        if self.dtype is not None:
+            row = row.astype(self.dtype, copy=False)
+        if row.ndim == 0:
+            raise DataInvalid(
+                "Rows of a RaggedArray must be at least 1-dimensional.")
+
+        if self._data is None:
+            self._data = self._handle.create_earray(
+                where='/', name='data', atom=tables.Atom.from_dtype(row.dtype),
+                shape=(0,) + row.shape[1:], filters=self._filters)
+        elif row.shape[1:] != self._data.shape[1:]:
+            raise DataInvalid(
+                "Row of shape %s can't be appended to %s, which holds rows "
+                "of shape %s." % (row.shape, self.filename,
+                                  ('*',) + self._data.shape[1:]))
+
+        if len(row):
+            self._data.append(row)
+        # recording the offset marks the row complete, so this must
+        # happen after the data is written.
+        self._offsets.append([self._offsets[-1] + len(row)])
+        self._handle.flush()
+
+    def extend(self, rows):
+        """Write each of `rows` to the end of the file."""
+        for row in rows:
+            self.append(row)
+
+    def truncate(self, n_rows):
+        """Discard all but the first `n_rows` rows."""
+
+        if n_rows > self.n_rows:
+            raise DataInvalid(
+                "Can't truncate %s to %s rows, it only has %s." %
+                (self.filename, n_rows, self.n_rows))
+
+        self._offsets.truncate(n_rows + 1)
+        if self._data is not None:
+            self._data.truncate(self._offsets[-1])
+        self._handle.flush()
+
+    def close(self):
+        if self._handle.isopen:
+            if self._data is None:
+                # no rows were ever given, so there may be no dtype to
+                # go on
+                self._data = self._handle.create_earray(
+                    where='/', name='data',
+                    atom=tables.Atom.from_dtype(self.dtype or np.dtype(float)),
+                    shape=(0,), filters=self._filters)
+            self._handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
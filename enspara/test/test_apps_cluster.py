@@ -4,11 +4,12 @@ import hashlib
 import shutil
 
 from datetime import datetime
+from unittest import mock
 
 from nose.tools import assert_equal, assert_raises
 
 import numpy as np
-from numpy.testing import assert_array_equal
+from numpy.testing import assert_array_equal, assert_allclose
 
 from sklearn.datasets import make_blobs
 
@@ -16,10 +17,13 @@ from .. import exception
 from ..util import array as ra
 
 from ..apps import cluster
+from ..cluster import balltree
 
-TEST_DIR = os.path.dirname(__file__)
-TRJFILE = os.path.join(os.path.dirname(__file__), 'data', 'frame0.xtc')
-TOPFILE = os.path.join(os.path.dirname(__file__), 'data', 'native.pdb')
+from .util import get_fn, data_copy
+
+TEST_DIR = data_copy()
+TRJFILE = get_fn('frame0.xtc')
+TOPFILE = get_fn('native.pdb')
 
 
 def runhelper(args, expected_size, algorithm='khybrid', expected_k=None,
@@ -54,7 +58,7 @@ def runhelper(args, expected_size, algorithm='khybrid', expected_k=None,
             assigns = ra.load(fnames['assignments'])
             if type(assigns) is ra.RaggedArray:
                 assert_equal(len(assigns), expected_size[0])
-                assert_equal(assigns._data.dtype, np.int)
+                assert np.issubdtype(assigns._data.dtype, np.integer)
                 assert_array_equal(assigns.lengths, expected_size[1])
                 if expected_k is not None:
                     assert_array_equal(
@@ -62,7 +66,7 @@ def runhelper(args, expected_size, algorithm='khybrid', expected_k=None,
                         np.arange(expected_k))
             else:
                 assert_equal(assigns.shape, expected_size)
-                assert_equal(assigns.dtype, np.int)
+                assert np.issubdtype(assigns.dtype, np.integer)
                 if expected_k is not None:
                     assert_array_equal(
                         np.unique(assigns),
@@ -134,6 +138,31 @@ def test_rmsd_cluster_fixed_k_kcenters():
         expected_k=expected_k)
 
 
+def test_rmsd_cluster_compact_dtypes():
+
+    expected_size = (2, 501)
+    args = [
+        '--trajectories', TRJFILE, TRJFILE,
+        '--topology', TOPFILE,
+        '--cluster-number', '10',
+        '--atoms', '(name N or name C or name CA or name H or name O)',
+        '--algorithm', 'kcenters']
+
+    dists, assigns = runhelper(
+        args, expected_size=expected_size, algorithm='kcenters')
+    assert_equal(assigns.dtype, np.int8)
+    assert_equal(dists.dtype, np.float32)
+
+    exact_dists, exact_assigns = runhelper(
+        args + ['--exact-dtypes'], expected_size=expected_size,
+        algorithm='kcenters')
+    assert_equal(exact_assigns.dtype, np.int64)
+    assert_equal(exact_dists.dtype, np.float64)
+
+    assert_array_equal(assigns, exact_assigns)
+    assert_array_equal(dists, exact_dists.astype(np.float32))
+
+
 def test_rmsd_cluster_broken_atoms():
 
     expected_size = (2, 501)
@@ -175,6 +204,66 @@ def test_rmsd_cluster_subsample():
         expected_size=expected_size)
 
 
+def test_rmsd_cluster_cache_atoms():
+
+    expected_size = (2, 501)
+
+    td = tempfile.mkdtemp(dir=os.getcwd())
+    try:
+        trjfiles = [os.path.join(td, 'trj%s.xtc' % i) for i in range(2)]
+        for trjfile in trjfiles:
+            shutil.copy(TRJFILE, trjfile)
+
+        args = [
+            '--trajectories'] + trjfiles + [
+            '--topology', TOPFILE,
+            '--cluster-number', '5',
+            '--subsample', '4',
+            '--cache-atoms',
+            '--atoms', '(name N or name C or name CA or name H or name O)',
+            '--algorithm', 'kcenters']
+
+        dists, assigns = runhelper(args, expected_size=expected_size)
+        assert_equal(len(os.listdir(os.path.join(td, '.enspara_atoms'))), 2)
+
+        # the second run reads the extracted atoms
+        cached_dists, cached_assigns = runhelper(
+            args, expected_size=expected_size)
+        assert_array_equal(cached_assigns, assigns)
+        assert_array_equal(cached_dists, dists)
+    finally:
+        shutil.rmtree(td)
+
+
+def test_rmsd_cluster_checkpoint_resume():
+
+    expected_size = (2, 501)
+
+    td = tempfile.mkdtemp(dir=os.getcwd())
+    try:
+        checkpoint = os.path.join(td, 'checkpoint.npz')
+        args = [
+            '--trajectories', TRJFILE, TRJFILE,
+            '--topology', TOPFILE,
+            '--atoms', '(name N or name C or name CA or name H or name O)',
+            '--algorithm', 'khybrid',
+            '--checkpoint', checkpoint,
+            '--checkpoint-every', '2']
+
+        dists, assigns = runhelper(
+            args + ['--cluster-number', '4'], expected_size=expected_size)
+        assert os.path.isfile(checkpoint)
+
+        # a finished run's checkpoint is resumed without clustering again
+        resumed_dists, resumed_assigns = runhelper(
+            args + ['--cluster-number', '4', '--resume'],
+            expected_size=expected_size)
+        assert_array_equal(resumed_assigns, assigns)
+        assert_array_equal(resumed_dists, dists)
+    finally:
+        shutil.rmtree(td)
+
+
 def test_rmsd_cluster_multiprocess():
 
     expected_size = (2, 501)
@@ -531,7 +620,8 @@ def test_feature_cluster_number_khybrid_npy_input_zero_iterations():
             '--cluster-number', '3',
             '--algorithm', 'khybrid',
             '--cluster-iterations', '0',
-            '--cluster-distance', 'euclidean'],
+            '--cluster-distance', 'euclidean',
+            '--exact-dtypes'],
             expected_size=expected_size,
             centers_format='npy')
 
@@ -545,3 +635,39 @@ def test_feature_cluster_number_khybrid_npy_input_zero_iterations():
     assert_array_equal(y, assignments)
 
     assert_array_equal(kc.distances_, distances.flatten())
+
+
+def test_rmsd_cluster_center_index():
+
+    expected_size = (2, 501)
+
+    td = tempfile.mkdtemp(dir=os.getcwd())
+    try:
+        index = os.path.join(td, 'center-index.npz')
+        args = [
+            '--trajectories', TRJFILE, TRJFILE,
+            '--topology', TOPFILE,
+            '--cluster-number', '20',
+            '--subsample', '4',
+            '--atoms', '(name N or name C or name CA or name H or name O)',
+            '--algorithm', 'kcenters']
+
+        dists, assigns = runhelper(args, expected_size=expected_size)
+
+        # reassignment with the index finds the same nearest centers
+        with mock.patch.object(balltree, 'MIN_CENTERS', 1), \
+                mock.patch.object(balltree, 'MIN_PRUNED', 0), \
+                mock.patch.object(balltree.BallTree, 'query',
+                                  autospec=True,
+                                  side_effect=balltree.BallTree.query) \
+                as query:
+            index_dists, index_assigns = runhelper(
+                args + ['--center-index', index],
+                expected_size=expected_size)
+        assert query.called
+        assert os.path.isfile(index)
+
+        assert_array_equal(index_assigns, assigns)
+        assert_allclose(index_dists, dists, atol=1e-3)
+    finally:
+        shutil.rmtree(td)
@@ -19,9 +19,9 @@ from ..apps import cluster
 from ..cluster import util, kcenters
 from ..util import array as ra
 
-from .util import fix_np_rng
+from .util import fix_np_rng, get_fn, data_copy
 
-TEST_DIR = os.path.dirname(__file__)
+TEST_DIR = data_copy()
 
 
 def runhelper(args, expected_size, expect_reassignment=True,
@@ -59,11 +59,11 @@ def runhelper(args, expected_size, expect_reassignment=True,
             assigns = ra.load(fnames['assignments'])
             if type(assigns) is ra.RaggedArray:
                 assert_equal(len(assigns), expected_size[0])
-                assert_equal(assigns._data.dtype, np.int)
+                assert np.issubdtype(assigns._data.dtype, np.integer)
                 assert_array_equal(assigns.lengths, expected_size[1])
             else:
                 assert_equal(assigns.shape, expected_size)
-                assert_equal(assigns.dtype, np.int)
+                assert np.issubdtype(assigns.dtype, np.integer)
 
             distfile = fnames['distances']
             assert os.path.isfile(distfile), \
@@ -102,8 +102,8 @@ def runhelper(args, expected_size, expect_reassignment=True,
 @attr('mpi')
 def test_rmsd_kcenters_mpi():
 
-    TRJFILE = os.path.join(os.path.dirname(__file__), 'data', 'frame0.xtc')
-    TOPFILE = os.path.join(os.path.dirname(__file__), 'data', 'native.pdb')
+    TRJFILE = get_fn('frame0.xtc')
+    TOPFILE = get_fn('native.pdb')
     SELECTION = '(name N or name C or name CA or name H or name O)'
 
     expected_size = (5, 501)
@@ -144,12 +144,13 @@ def test_rmsd_kcenters_mpi():
 @attr('mpi')
 def test_rmsd_kcenters_mpi_subsample():
 
-    TRJFILE = os.path.join(os.path.dirname(__file__), 'data', 'frame0.xtc')
-    TOPFILE = os.path.join(os.path.dirname(__file__), 'data', 'native.pdb')
+    TRJFILE = get_fn('frame0.xtc')
+    TOPFILE = get_fn('native.pdb')
     SELECTION = '(name N or name C or name CA or name H or name O)'
     SUBSAMPLE_FACTOR = 3
 
-    expected_size = (5, np.ceil(501 / SUBSAMPLE_FACTOR))
+    # every frame is reassigned, not just the subsample
+    expected_size = (5, 501)
 
     with tempfile.TemporaryDirectory() as tdname:
 
@@ -167,8 +168,7 @@ def test_rmsd_kcenters_mpi_subsample():
                 '--subsample', str(SUBSAMPLE_FACTOR),
                 '--atoms', SELECTION,
                 '--algorithm', 'kcenters'],
-                expected_size=expected_size,
-                expect_reassignment=False)
+                expected_size=expected_size)
 
     trj = md.load(TRJFILE, top=TOPFILE)
     trj_sele = trj.atom_slice(trj.top.select(SELECTION))
@@ -183,6 +183,12 @@ def test_rmsd_kcenters_mpi_subsample():
     expected_s = md.join([trj[i[1]] for i in inds])
     assert_array_equal(expected_s.xyz, md.join(s).xyz)
 
+    expect_a, expect_d = util.assign_to_nearest_center(
+        trj_sele, result.centers, md.rmsd)
+    for i in range(expected_size[0]):
+        assert_array_equal(a[i], expect_a)
+        assert_allclose(d[i], expect_d, atol=1e-4)
+
 
 @fix_np_rng()
 @attr('mpi')
@@ -190,8 +196,8 @@ def test_rmsd_khybrid_mpi_basic():
 
     expected_size = (2, 501)
 
-    TRJFILE = os.path.join(os.path.dirname(__file__), 'data', 'frame0.xtc')
-    TOPFILE = os.path.join(os.path.dirname(__file__), 'data', 'native.pdb')
+    TRJFILE = get_fn('frame0.xtc')
+    TOPFILE = get_fn('native.pdb')
     SELECTION = '(name N or name C or name CA or name H or name O)'
 
     with tempfile.TemporaryDirectory() as tdname:
@@ -241,12 +247,12 @@ def test_rmsd_khybrid_mpi_basic():
 @attr('mpi')
 def test_rmsd_khybrid_mpi_subsample():
 
-    TRJFILE = os.path.join(os.path.dirname(__file__), 'data', 'frame0.xtc')
-    TOPFILE = os.path.join(os.path.dirname(__file__), 'data', 'native.pdb')
+    TRJFILE = get_fn('frame0.xtc')
+    TOPFILE = get_fn('native.pdb')
     SELECTION = '(name N or name C or name CA or name H or name O)'
     SUBSAMPLE_FACTOR = 3
 
-    expected_size = (5, (np.ceil(501 / 3),) * 5)
+    expected_size = (5, 501)
 
     with tempfile.TemporaryDirectory() as tdname:
 
@@ -264,8 +270,7 @@ def test_rmsd_khybrid_mpi_subsample():
                 '--subsample', str(SUBSAMPLE_FACTOR),
                 '--atoms', SELECTION,
                 '--algorithm', 'khybrid'],
-                expected_size=expected_size,
-                expect_reassignment=False)
+                expected_size=expected_size)
 
     trj = md.load(TRJFILE, top=TOPFILE)
     expected_s = md.join([trj[i[1]] for i in inds])
@@ -6,20 +6,24 @@ import pickle
 import shutil
 
 from datetime import datetime
+from unittest import mock
 
 import numpy as np
 import mdtraj as md
 
-from nose.tools import assert_less, assert_equal, assert_is
+from nose.plugins.attrib import attr
+from nose.tools import assert_less, assert_equal, assert_is, assert_raises
 from numpy.testing import assert_array_equal, assert_allclose
 
+from .. import mpi
 from ..util import array as ra
+from ..exception import ImproperlyConfigured
 from ..apps import reassign
 
-from .util import get_fn
+from .util import get_fn, data_copy
 
 
-TEST_DIR = os.path.dirname(__file__)
+TEST_DIR = data_copy()
 
 
 def runhelper(args):
@@ -152,3 +156,159 @@ def test_reassignment_function_heterogenous():
     assert_array_equal(assigns[0], assigns[1])
     assert_array_equal(assigns[0][::50], range(len(centers)))
     assert_allclose(dists[0], dists[1], atol=1e-3)
+
+
+def test_reassignment_function_streaming_resume():
+
+    topologies = [get_fn('native.pdb')]
+    trajectories = [[get_fn('frame0.xtc')]*3]
+    atoms = ['(name N or name C or name CA or name H or name O)']
+    top = md.load(topologies[0]).top
+    centers = [c.atom_slice(top.select(atoms[0])) for c
+               in md.load(trajectories[0][0], top=topologies[0])[::50]]
+
+    expected_assigs, expected_dists = reassign.reassign(
+        topologies, trajectories, atoms, centers)
+
+    with tempfile.TemporaryDirectory() as td:
+        assig_fname = os.path.join(td, 'assignments.h5')
+        dist_fname = os.path.join(td, 'distances.h5')
+
+        out = reassign.reassign(
+            topologies, trajectories, atoms, centers,
+            assignments_file=assig_fname, distances_file=dist_fname)
+        assert_is(out, None)
+
+        assert_array_equal(ra.load(assig_fname)._data,
+                           expected_assigs.flatten())
+        assert_allclose(ra.load(dist_fname)._data,
+                        expected_dists.flatten(), atol=1e-3)
+
+        # simulate a job that died after finishing one trajectory
+        # (and writing part of the next one's assignments).
+        with ra.RaggedArrayWriter(assig_fname, resume=True) as w:
+            w.truncate(2)
+        with ra.RaggedArrayWriter(dist_fname, resume=True) as w:
+            w.truncate(1)
+
+        reassign.reassign(
+            topologies, trajectories, atoms, centers,
+            assignments_file=assig_fname, distances_file=dist_fname,
+            resume=True)
+
+        assig = ra.load(assig_fname)
+        assert_array_equal(assig.lengths, [501, 501, 501])
+        assert_array_equal(assig._data, expected_assigs.flatten())
+        assert_allclose(ra.load(dist_fname)._data,
+                        expected_dists.flatten(), atol=1e-3)
+
+
+def test_plan_batches():
+
+    batches = reassign.plan_batches([10, 0, 3, 25], 12)
+
+    # 38 frames in four batches of at most 12 frames is 10 frames each,
+    # splitting trajectories as needed.
+    assert_equal(batches, [
+        [(0, 0, 10), (1, 0, 0)],
+        [(2, 0, 3), (3, 0, 7)],
+        [(3, 7, 17)],
+        [(3, 17, 25)]])
+
+    assert_equal(reassign.plan_batches([5, 5], 100), [[(0, 0, 5), (1, 0, 5)]])
+
+    # empty trajectories never make a batch of their own
+    assert_equal(reassign.plan_batches([5, 0], 5), [[(0, 0, 5), (1, 0, 0)]])
+    assert_equal(reassign.plan_batches([0, 5, 0, 0], 5),
+                 [[(0, 0, 0), (1, 0, 5), (2, 0, 0), (3, 0, 0)]])
+    assert_equal(reassign.plan_batches([0], 5), [[(0, 0, 0)]])
+
+    with assert_raises(ImproperlyConfigured):
+        reassign.plan_batches([5, 5], 0)
+
+
+def test_reassignment_function_split_batches():
+
+    topologies = [get_fn('native.pdb')]
+    trajectories = [[get_fn('frame0.xtc')]*3]
+    atoms = ['(name N or name C or name CA or name H or name O)']
+    top = md.load(topologies[0]).top
+    centers = [c.atom_slice(top.select(atoms[0])) for c
+               in md.load(trajectories[0][0], top=topologies[0])[::50]]
+
+    expected_assigs, expected_dists = reassign.reassign(
+        topologies, trajectories, atoms, centers)
+
+    # batches smaller than a trajectory split trajectories across batches
+    with mock.patch.object(reassign, 'determine_batch_size',
+                           return_value=(400, 0)):
+        assigs, dists = reassign.reassign(
+            topologies, trajectories, atoms, centers)
+
+        assert_array_equal(assigs, expected_assigs)
+        assert_allclose(dists, expected_dists, atol=1e-3)
+
+        with tempfile.TemporaryDirectory() as td:
+            assig_fname = os.path.join(td, 'assignments.h5')
+            dist_fname = os.path.join(td, 'distances.h5')
+
+            reassign.reassign(
+                topologies, trajectories, atoms, centers,
+                assignments_file=assig_fname, distances_file=dist_fname)
+
+            assig = ra.load(assig_fname)
+            assert_array_equal(assig.lengths, [501, 501, 501])
+            assert_array_equal(assig._data, expected_assigs.flatten())
+
+
+@attr('mpi')
+def test_reassignment_function_mpi():
+
+    xtc2 = os.path.join(TEST_DIR, 'cards_data', 'trj0.xtc')
+    top2 = os.path.join(TEST_DIR, 'cards_data', 'PROT_only.pdb')
+
+    topologies = [get_fn('native.pdb'), top2]
+    trajectories = [[get_fn('frame0.xtc')]*3, [xtc2]]
+    atoms = [
+        '(name N or name O) and (residue 2 or residue 3)',
+        '(name CA) and (residue 3 to 5)']
+    top = md.load(topologies[0]).top
+    centers = [c.atom_slice(top.select(atoms[0])) for c
+               in md.load(trajectories[0][0], top=topologies[0])[::50]]
+
+    expected_assigs, expected_dists = reassign.reassign(
+        topologies, trajectories, atoms, centers)
+
+    # only rank 0's centers are used, and only rank 0 gets the results
+    result = reassign.reassign(
+        topologies, trajectories, atoms,
+        centers if mpi.rank() == 0 else None, mpi_mode=True)
+
+    if mpi.rank() == 0:
+        assigs, dists = result
+        assert_array_equal(assigs.lengths, [501, 501, 501, 5001])
+        assert_array_equal(assigs._data, expected_assigs._data)
+        assert_allclose(dists._data, expected_dists._data, atol=1e-3)
+    else:
+        assert_is(result, None)
+
+    td = mpi.comm.bcast(
+        tempfile.mkdtemp(dir=os.getcwd()) if mpi.rank() == 0 else None,
+        root=0)
+    try:
+        assig_fname = os.path.join(td, 'assignments.h5')
+        dist_fname = os.path.join(td, 'distances.h5')
+
+        reassign.reassign(
+            topologies, trajectories, atoms, centers, mpi_mode=True,
+            assignments_file=assig_fname, distances_file=dist_fname)
+
+        assert_equal(sorted(os.listdir(td)),
+                     ['assignments.h5', 'distances.h5'])
+        assert_array_equal(ra.load(assig_fname)._data, expected_assigs._data)
+        assert_allclose(ra.load(dist_fname)._data, expected_dists._data,
+                        atol=1e-3)
+    finally:
+        mpi.comm.barrier()
+        if mpi.rank() == 0:
+            shutil.rmtree(td)
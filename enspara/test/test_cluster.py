@@ -1,7 +1,10 @@
 import unittest
 import os
+import shutil
 import tempfile
 
+from unittest import mock
+
 import numpy as np
 import mdtraj as md
 
@@ -197,6 +200,96 @@ class TestTrajClustering(unittest.TestCase):
         self.assertAlmostEqual(np.std(result.distances),
                                0.018355072790569946)
 
+    def test_kcenters_partial_fit(self):
+        CLUSTER_RADIUS = 0.1
+
+        half = len(self.trj) // 2
+        first, second = self.trj[:half], self.trj[half:]
+
+        clust = kcenters.KCenters('rmsd', cluster_radius=CLUSTER_RADIUS)
+        clust.partial_fit(first)
+
+        expected = kcenters.KCenters(
+            'rmsd', cluster_radius=CLUSTER_RADIUS).fit(self.trj[:half])
+        assert_array_equal(clust.labels_, expected.labels_)
+        assert_array_equal(clust.center_indices_, expected.center_indices_)
+
+        n_first_centers = len(clust.centers_)
+        clust.partial_fit(second)
+
+        assert_equal(clust.n_frames_seen_, len(self.trj))
+        assert_equal(len(clust.labels_), len(second))
+        assert_true(np.all(clust.distances_ <= CLUSTER_RADIUS))
+        assert_less(n_first_centers, len(clust.centers_))
+
+        # new centers are indexed among all frames seen so far
+        for i, center in zip(clust.center_indices_[n_first_centers:],
+                             clust.centers_[n_first_centers:]):
+            assert_allclose(md.rmsd(center, self.trj[i]), 0, atol=1e-3)
+
+        assert_equal(clust.cluster_counts_.sum(), len(self.trj))
+        assert_true(np.all(clust.cluster_radii_ <= CLUSTER_RADIUS))
+
+    def test_kcenters_checkpoint_resume(self):
+
+        n_calls = []
+
+        def rmsd(*args):
+            n_calls.append(1)
+            return md.rmsd(*args)
+
+        # md.rmsd centers its target in place, so each run gets a copy.
+        # Distances still differ in the last place between runs, since
+        # data are centered before or after the new center is copied.
+        expected = kcenters.kcenters(self.trj[:], 'rmsd', n_clusters=10)
+
+        with tempfile.TemporaryDirectory() as td:
+            checkpoint = os.path.join(td, 'kcenters.npz')
+
+            # a run that's cut short, checkpointing every other center
+            kcenters.kcenters(self.trj[:], rmsd, n_clusters=5,
+                              checkpoint=checkpoint, checkpoint_every=2)
+            with np.load(checkpoint) as f:
+                assert_equal(len(f['center_indices']), 5)
+
+            del n_calls[:]
+            result = kcenters.kcenters(
+                self.trj[:], rmsd, n_clusters=10, checkpoint=checkpoint,
+                resume=True)
+
+        # only distances to new centers are computed
+        assert_equal(len(n_calls), 5)
+
+        assert_array_equal(result.center_indices, expected.center_indices)
+        assert_array_equal(result.assignments, expected.assignments)
+        assert_allclose(result.distances, expected.distances, rtol=1e-5)
+        assert_allclose(
+            md.join(result.centers).xyz, md.join(expected.centers).xyz,
+            atol=1e-5)
+
+    def test_hybrid_checkpoint_resume(self):
+
+        expected = hybrid(self.trj[:], 'rmsd', n_clusters=5, n_iters=4,
+                          random_state=np.random.RandomState(0))
+
+        with tempfile.TemporaryDirectory() as td:
+            checkpoint = os.path.join(td, 'khybrid.npz')
+
+            hybrid(self.trj[:], 'rmsd', n_clusters=5, n_iters=2,
+                   random_state=np.random.RandomState(0),
+                   checkpoint=checkpoint)
+            with np.load(checkpoint) as f:
+                assert_equal(f['kmedoids_updates'], 2)
+
+            # the random state is restored from the checkpoint
+            result = hybrid(self.trj[:], 'rmsd', n_clusters=5, n_iters=4,
+                            random_state=np.random.RandomState(1),
+                            checkpoint=checkpoint, resume=True)
+
+        assert_array_equal(result.center_indices, expected.center_indices)
+        assert_array_equal(result.assignments, expected.assignments)
+        assert_allclose(result.distances, expected.distances, rtol=1e-5)
+
 
 @attr('mpi')
 def test_kcenters_mpi_traj():
@@ -206,10 +299,15 @@ def test_kcenters_mpi_traj():
 
     data = trj[mpi.rank()::mpi.size()]
 
-    r = kcenters.kcenters_mpi(data, md.rmsd, n_clusters=10)
+    comm_times = []
+    r = kcenters.kcenters_mpi(data, md.rmsd, n_clusters=10,
+                              comm_times=comm_times)
     local_distances, local_assignments, local_ctr_inds = \
         r.distances, r.assignments, r.center_indices
 
+    # one search for each center, and one more that ends clustering
+    assert_equal(len(comm_times), 11)
+
     mpi_assigs = np.empty((len(trj),), dtype=local_assignments.dtype)
     mpi_dists = np.empty((len(trj),), dtype=local_distances.dtype)
     mpi_ctr_inds = [(i*mpi.size())+r for r, i in local_ctr_inds]
@@ -235,6 +333,57 @@ def test_kcenters_mpi_traj():
         assert_array_equal(mpi_ctr_inds, r.center_indices)
 
 
+@attr('mpi')
+def test_kcenters_mpi_checkpoint_resume():
+    from .. import mpi
+
+    trj = md.load(get_fn('frame0.h5'))
+
+    # md.rmsd centers its target in place, so each run gets a copy.
+    # Distances still differ in the last place between runs, since data
+    # are centered before or after the new center is copied.
+    expected = kcenters.kcenters_mpi(
+        trj[mpi.rank()::mpi.size()], md.rmsd, n_clusters=10)
+
+    td = mpi.comm.bcast(tempfile.mkdtemp() if mpi.rank() == 0 else None,
+                        root=0)
+    checkpoint = os.path.join(td, 'kcenters.npz')
+    try:
+        kcenters.kcenters_mpi(trj[mpi.rank()::mpi.size()], md.rmsd,
+                              n_clusters=4,
+                              checkpoint=checkpoint, checkpoint_seconds=0)
+        assert_true(os.path.exists(
+            kcenters.checkpoint_filename(checkpoint, mpi_mode=True)))
+
+        result = kcenters.kcenters_mpi(
+            trj[mpi.rank()::mpi.size()], md.rmsd, n_clusters=10,
+            checkpoint=checkpoint, resume=True)
+    finally:
+        mpi.comm.barrier()
+        if mpi.rank() == 0:
+            shutil.rmtree(td)
+
+    assert_equal(result.center_indices, expected.center_indices)
+    assert_array_equal(result.assignments, expected.assignments)
+    assert_allclose(result.distances, expected.distances, rtol=1e-5)
+
+
+@attr('mpi')
+def test_kcenters_mpi_checkpoint_clock():
+    from .. import mpi
+
+    checkpointer = kcenters._Checkpointer(
+        'kcenters.npz', seconds=0, mpi_mode=True)
+
+    # rank 0's clock is only shared every MPI_CLOCK_EVERY centers
+    every = kcenters.MPI_CLOCK_EVERY
+    with mock.patch.object(mpi, 'comm', wraps=mpi.comm) as comm:
+        due = [checkpointer.due(n) for n in range(1, 2 * every + 1)]
+
+    assert_equal(comm.bcast.call_count, 2)
+    assert_equal(np.flatnonzero(due).tolist(), [every - 1, 2 * every - 1])
+
+
 @attr('mpi')
 def test_kcenters_mpi_numpy():
     from .. import mpi
@@ -505,8 +654,11 @@ def test_kmedoids_pam_update_mdtraj():
 
     assert_array_equal(ind, [298, 44, 341])
 
-    expect_assig, expect_dists = util.assign_to_nearest_center(
-        X, X[ind], DIST_FUNC)
+    # k-medoids computes distances with md.rmsd itself, so compare it to
+    # md.rmsd rather than to assign_to_nearest_center's native RMSD.
+    alldists = np.array([DIST_FUNC(X, X[i]) for i in ind])
+    expect_assig = np.argmin(alldists, axis=0)
+    expect_dists = np.min(alldists, axis=0)
 
     assert_array_equal(np.unique(assig), np.arange(3))
     assert_array_equal(assig, expect_assig)
@@ -595,6 +747,39 @@ class TestNumpyClustering(unittest.TestCase):
         # should actually be a frame
         assert_equal(len(np.where(clust.result_.distances == 0)), 1)
 
+    def test_kcenters_partial_fit(self):
+
+        clust = kcenters.KCenters(metric='euclidean', cluster_radius=6)
+        clust.fit(self.traj_lst[0])
+
+        old_radii = clust.cluster_radii_.copy()
+        assert_equal(len(clust.centers_), 1)
+        assert_equal(clust.cluster_counts_[0], 20)
+
+        for X in self.traj_lst[1:]:
+            clust.partial_fit(X)
+
+        assert_equal(len(clust.centers_), 3)
+        assert_true(20 <= clust.center_indices_[1] < 40)
+        assert_true(40 <= clust.center_indices_[2] < 60)
+        assert_array_equal(clust.labels_, [2] * 20)
+        assert_array_equal(clust.cluster_counts_, [20, 20, 20])
+        assert_equal(clust.n_frames_seen_, 60)
+
+        # the far-off blobs don't change the first cluster
+        assert_equal(clust.cluster_radii_[0], old_radii[0])
+        assert_true(np.all(clust.cluster_radii_ <= 6))
+
+        # data near existing centers adds no new ones
+        clust.partial_fit(self.traj_lst[0])
+        assert_equal(len(clust.centers_), 3)
+        assert_array_equal(clust.labels_, [0] * 20)
+        assert_array_equal(clust.cluster_counts_, [40, 20, 20])
+
+        with assert_raises(ImproperlyConfigured):
+            kcenters.KCenters(metric='euclidean', cluster_radius=6,
+                              mpi_mode=True).partial_fit(self.traj_lst[0])
+
     def test_numpy_hybrid(self):
         N_CLUSTERS = 3
 
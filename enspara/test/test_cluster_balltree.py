@@ -0,0 +1,162 @@
+import os
+import tempfile
+
+from functools import partial
+from unittest import mock
+
+import mdtraj as md
+import numpy as np
+
+from nose.tools import assert_raises, assert_equal, assert_is
+from numpy.testing import assert_array_equal, assert_allclose
+
+from enspara import exception
+from enspara.cluster import balltree, util, KCenters
+from enspara.cluster.balltree import BallTree
+from enspara.geometry import libdist
+
+from .util import get_fn
+
+
+def blobs(n_blobs=50, n_per_blob=40, seed=0):
+    rs = np.random.RandomState(seed)
+    locs = rs.uniform(-100, 100, size=(n_blobs, 3))
+    return np.concatenate(
+        [rs.normal(loc=loc, size=(n_per_blob, 3)) for loc in locs])
+
+
+def test_balltree_query_ndarray():
+
+    X = blobs()
+    centers = X[::4]
+
+    n_evaluated = [0]
+
+    def metric(X, y):
+        n_evaluated[0] += len(X)
+        return libdist.euclidean(np.ascontiguousarray(X), y)
+
+    tree = BallTree(centers, metric, leaf_size=4)
+    n_evaluated[0] = 0
+
+    assigs, dists = tree.query(X)
+    expect_assigs, expect_dists = util.assign_to_nearest_center(
+        X, centers, libdist.euclidean, prune=False)
+
+    assert_array_equal(assigs, expect_assigs)
+    assert_allclose(dists, expect_dists)
+
+    # well-separated centers shouldn't all be compared to every frame
+    assert n_evaluated[0] < 0.1 * len(X) * len(centers), n_evaluated[0]
+
+    # batches give the same result
+    batch_assigs, batch_dists = tree.query(X, batch_size=333)
+    assert_array_equal(batch_assigs, assigs)
+    assert_array_equal(batch_dists, dists)
+
+
+def test_balltree_query_mdtraj():
+
+    trj = md.load(get_fn('frame0.xtc'), top=get_fn('native.pdb'))
+    centers = [trj[i] for i in range(0, len(trj), 10)]
+
+    tree = BallTree(centers, md.rmsd)
+    assert_equal(tree.n_centers, len(centers))
+
+    assigs, dists = tree.query(trj)
+
+    # md.rmsd centers its target in place, so give it a copy
+    alldists = np.array([md.rmsd(trj[:], c) for c in centers])
+
+    # md.rmsd is only accurate to about 1e-4 in float32
+    assert_array_equal(assigs, np.argmin(alldists, axis=0))
+    assert_allclose(dists, np.min(alldists, axis=0), atol=1e-3)
+
+    # queries on precentered frames must keep each frame's own traces
+    precentered = trj[:]
+    precentered.center_coordinates()
+    for c in centers:
+        c.center_coordinates()
+
+    pc_assigs, pc_dists = BallTree(
+        centers, partial(md.rmsd, precentered=True)).query(precentered)
+    assert_array_equal(pc_assigs, assigs)
+    assert_allclose(pc_dists, dists, atol=1e-3)
+
+
+def test_balltree_duplicate_centers():
+
+    X = blobs(n_blobs=3)
+    centers = np.concatenate([X[:1]] * 20 + [X[-1:]])
+
+    assigs, dists = BallTree(centers, libdist.euclidean, leaf_size=2).query(X)
+    expect_assigs, expect_dists = util.assign_to_nearest_center(
+        X, centers, libdist.euclidean, prune=False)
+
+    assert_array_equal(assigs, expect_assigs)
+    assert_allclose(dists, expect_dists)
+
+
+def test_balltree_save_load():
+
+    X = blobs()
+    centers = X[::4]
+    tree = BallTree(centers, libdist.euclidean)
+
+    with tempfile.TemporaryDirectory() as td:
+        fname = os.path.join(td, 'index.npz')
+        tree.save(fname)
+
+        loaded = BallTree.load(fname, centers, libdist.euclidean)
+        with assert_raises(exception.DataInvalid):
+            BallTree.load(fname, centers[1:], libdist.euclidean)
+
+    assert_array_equal(loaded.query(X)[0], tree.query(X)[0])
+    assert_array_equal(loaded.query(X)[1], tree.query(X)[1])
+
+
+def test_balltree_prunes_well():
+
+    X = blobs()
+    tree = BallTree(X[::4], libdist.euclidean)
+
+    # too few centers for the tree to beat the native kernels
+    assert not tree.prunes_well(X)
+
+    with mock.patch.object(balltree, 'MIN_CENTERS', 1):
+        assert tree.prunes_well(X)
+        assert not tree.prunes_well(X[:0])
+
+        # unstructured, high-dimensional centers can't be pruned
+        rs = np.random.RandomState(0)
+        centers = rs.normal(size=(500, 90))
+        tree = BallTree(centers, libdist.euclidean)
+        assert not tree.prunes_well(
+            centers + rs.normal(scale=0.05, size=centers.shape))
+
+
+def test_predict_uses_index():
+
+    X = blobs()
+    clust = KCenters('euclidean', n_clusters=30).fit(X)
+
+    expected = clust.predict(X)
+
+    clust.build_index()
+    assert_is(clust.index_.metric, clust.metric)
+
+    calls = []
+    query = clust.index_.query
+    clust.index_.query = lambda X: calls.append(X) or query(X)
+
+    # with few centers, the native kernels are faster
+    clust.predict(X)
+    assert_equal(len(calls), 0)
+
+    with mock.patch.object(balltree, 'MIN_CENTERS', 1), \
+            mock.patch.object(balltree, 'MIN_PRUNED', 0):
+        indexed = clust.predict(X)
+    assert_equal(len(calls), 1)
+
+    assert_array_equal(indexed.assignments, expected.assignments)
+    assert_allclose(indexed.distances, expected.distances)
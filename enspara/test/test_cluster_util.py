@@ -1,12 +1,16 @@
+from functools import partial
+
 import numpy as np
 import mdtraj as md
 
-from nose.tools import assert_is, assert_is_not
+from nose.tools import assert_is, assert_is_not, assert_equal
 
 from numpy.testing import assert_array_equal, assert_allclose
 
 from enspara.cluster import util
+from enspara.geometry import libdist
 from enspara.util import array as ra
+from enspara.util.load import TrajectoryStream
 
 from ..cluster import save_states
 from .util import get_fn
@@ -124,6 +128,69 @@ def test_assign_to_nearest_center_many_centers():
     assert_array_equal(np.argmin(alldists, axis=0), assigns)
 
 
+def test_assign_to_nearest_center_blocked():
+
+    # libdist metrics take a blocked path comparing each frame to every
+    # center at once; it should agree with the center-by-center loop.
+    X = np.random.RandomState(0).normal(size=(500, 4))
+    centers = X[[0, 100, 100, 499]]
+
+    for metric in [libdist.euclidean, libdist.manhattan]:
+        assigns, distances = util.assign_to_nearest_center(
+            X, centers, metric)
+
+        alldists = np.array([metric(X, c) for c in centers])
+
+        assert_allclose(np.min(alldists, axis=0), distances)
+        assert_array_equal(np.argmin(alldists, axis=0), assigns)
+
+
+def test_assign_to_nearest_center_rmsd_precentered():
+
+    # RMSD assignment is done by libdist, which must respect md.rmsd's
+    # precentered flag and accept centers as a list of frames.
+    trj = md.load(get_fn('frame0.xtc'), top=get_fn('native.pdb'))
+    trj.center_coordinates()
+    center_frames = [0, int(len(trj)/3), int(len(trj)/2)]
+
+    alldists = np.array([md.rmsd(trj, trj, i, precentered=True)
+                         for i in center_frames])
+
+    assigns, distances = util.assign_to_nearest_center(
+        trj, [trj[i] for i in center_frames],
+        partial(md.rmsd, precentered=True))
+
+    assert_allclose(np.min(alldists, axis=0), distances, atol=1e-3)
+    assert_array_equal(np.argmin(alldists, axis=0), assigns)
+
+
+def test_assign_to_nearest_center_pruned():
+
+    # pruning works for any metric, not just those implemented natively
+    trj = md.load(get_fn('frame0.xtc'), top=get_fn('native.pdb'))
+    metric = partial(md.rmsd, atom_indices=np.arange(10))
+    centers = trj[::25]
+
+    expect_assigs, expect_dists = util.assign_to_nearest_center(
+        trj, centers, metric, prune=False)
+    assigs, dists = util.assign_to_nearest_center(
+        trj, centers, metric, prune=True)
+
+    assert_array_equal(assigs, expect_assigs)
+    assert_allclose(dists, expect_dists, atol=1e-5)
+
+    X = np.random.RandomState(0).normal(size=(500, 4))
+    expect_assigs, expect_dists = util.assign_to_nearest_center(
+        X, X[::50], lambda X, y: np.sqrt(np.sum((X - y)**2, axis=1)),
+        prune=False)
+    assigs, dists = util.assign_to_nearest_center(
+        X, X[::50], lambda X, y: np.sqrt(np.sum((X - y)**2, axis=1)),
+        prune=True)
+
+    assert_array_equal(assigs, expect_assigs)
+    assert_allclose(dists, expect_dists)
+
+
 def test_find_cluster_centers_ndarray():
 
     d = np.array([0.2, 0.1, 0.1, 0.2])
@@ -132,3 +199,71 @@ def test_find_cluster_centers_ndarray():
     ctrs = util.find_cluster_centers(assignments=a, distances=d)
 
     assert_array_equal(ctrs, [1, 2])
+
+
+def test_ClusterResult_partition_compact_dtypes():
+    list_lens = [10, 20, 100]
+
+    concat_rslt = util.ClusterResult(
+        assignments=np.repeat([0, 1, 2], list_lens),
+        distances=np.repeat([0.2, 0.3, 0.4], list_lens),
+        center_indices=[3, 23, 103],
+        centers=None)
+
+    rslt = concat_rslt.partition(list_lens, compact_dtypes=True)
+
+    assert_equal(rslt.assignments.dtype, np.int8)
+    assert_equal(rslt.distances.dtype, np.float32)
+    assert_array_equal(rslt.assignments[2], [2]*100)
+    assert_allclose(rslt.distances[1], [0.3]*20, rtol=1e-6)
+
+
+def test_assignment_dtype():
+    assert_equal(util.assignment_dtype(10), np.int8)
+    assert_equal(util.assignment_dtype(127), np.int8)
+    assert_equal(util.assignment_dtype(128), np.int16)
+    assert_equal(util.assignment_dtype(40000), np.int32)
+    assert_equal(util.assignment_dtype(2**40), np.int64)
+    assert_equal(util.assignment_dtype(10, compact=False), np.int64)
+
+    assert_equal(util.distance_dtype(), np.float32)
+    assert_equal(util.distance_dtype(compact=False), np.float64)
+
+
+def test_load_frames_order():
+    top = md.load(get_fn('native.pdb')).top
+    filenames = [get_fn('frame0.xtc'), get_fn('frame0.h5'),
+                 get_fn('frame0.xtc')]
+
+    # out of order within and across files, with a repeat
+    indices = [(2, 40), (0, 3), (1, 7), (0, 10), (2, 0), (0, 3)]
+    atom_ids = top.select('name CA')
+
+    for processes in [1, 2]:
+        frames = util.load_frames(filenames, indices, top=top, stride=2,
+                                  atom_indices=atom_ids,
+                                  processes=processes)
+
+        assert_equal(len(frames), len(indices))
+        for (i, j), frame in zip(indices, frames):
+            expected = md.load_frame(filenames[i], index=j*2, top=top,
+                                     atom_indices=atom_ids)
+            assert_equal(frame.n_atoms, len(atom_ids))
+            assert_array_equal(frame.xyz, expected.xyz)
+            assert_array_equal(frame.time, expected.time)
+
+
+def test_assign_to_nearest_center_stream():
+    top = md.load(get_fn('native.pdb')).top
+    filenames = [get_fn('frame0.xtc'), get_fn('frame0.h5')]
+    trj = md.join([md.load(f, top=top) for f in filenames])
+    centers = trj[::100]
+
+    expected_assigs, expected_dists = util.assign_to_nearest_center(
+        trj, centers, md.rmsd)
+
+    stream = TrajectoryStream(filenames, top, block_size=300)
+    assigs, dists = util.assign_to_nearest_center(stream, centers, md.rmsd)
+
+    assert_array_equal(assigs, expected_assigs)
+    assert_allclose(dists, expected_dists)
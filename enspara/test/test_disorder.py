@@ -36,6 +36,20 @@ def test_transition_times_ragged():
     assert_array_equal([1], transitions[1])
 
 
+def test_transition_times_ragged_no_transitions():
+
+    states = ra.RaggedArray(
+        [[0, 0, 1, 1],
+         [2, 2, 2],
+         [0, 1, 1, 1, 0],
+         [3, 3]])
+    transitions = disorder.transitions(states)
+
+    assert_array_equal(transitions.lengths, [1, 0, 2, 0])
+    assert_array_equal([1], transitions[0])
+    assert_array_equal([0, 3], transitions[2])
+
+
 def test_trj_ord_disord_times_one_transition():
 
     transition_times = np.array([0.0, 0.5, 0.5, 1.0, 1.0, 0.5])
@@ -1,13 +1,16 @@
 import numpy as np
+import mdtraj as md
 from scipy.spatial.distance import cdist
 from scipy.spatial.distance import hamming as scipy_hamming
 
-from nose.tools import assert_raises
-from numpy.testing import assert_array_equal
+from nose.tools import assert_raises, assert_equal
+from numpy.testing import assert_array_equal, assert_allclose
 
 from enspara import exception
 from enspara.geometry import libdist
 
+from .util import get_fn
+
 
 def test_hamming_distance():
 
@@ -107,3 +110,179 @@ def test_euclidean_distance_noalloc():
     assert_array_equal(
         d,
         cdist(X, y.reshape(1, -1)).flatten())
+
+
+def test_cdist():
+
+    X = np.random.RandomState(0).normal(size=(300, 7))
+    Y = X[[5, 17, 150, 299]]
+
+    for metric, scipy_metric in [('euclidean', 'euclidean'),
+                                 ('manhattan', 'cityblock')]:
+        d = libdist.cdist(X, Y, metric)
+        assert_allclose(d, cdist(X, Y, metric=scipy_metric))
+
+        # columns match the one-to-many distances
+        for i, y in enumerate(Y):
+            assert_allclose(d[:, i], getattr(libdist, metric)(X, y))
+
+    X = np.random.RandomState(0).randint(0, 3, size=(300, 7))
+    for dtype in ['int8', 'uint16', 'int64', '|S1']:
+        d = libdist.cdist(X.astype(dtype), X[:3].astype(dtype), 'hamming')
+        assert_array_equal(d, cdist(X, X[:3], metric='hamming'))
+
+    with assert_raises(exception.DataInvalid):
+        libdist.cdist(X.astype(float), X[:3].astype(float), 'hamming')
+
+    with assert_raises(exception.DataInvalid):
+        libdist.cdist(X, X[:3, 1:])
+
+    with assert_raises(exception.ImproperlyConfigured):
+        libdist.cdist(X, X[:3], 'rmsd')
+
+
+def test_cdist_noalloc():
+
+    X = np.random.RandomState(0).normal(size=(100, 3)).astype('float32')
+    Y = X[:10]
+
+    out = np.empty((100, 10), dtype='float32')
+    d = libdist.cdist(X, Y, out=out, dtype=np.float32)
+    assert d is out
+    assert_allclose(d, cdist(X, Y), rtol=1e-5)
+
+    with assert_raises(exception.DataInvalid):
+        libdist.cdist(X, Y, out=out)
+
+    with assert_raises(exception.DataInvalid):
+        libdist.cdist(X, Y, out=np.empty((100, 9)))
+
+    with assert_raises(exception.DataInvalid):
+        libdist.cdist(X, Y, out=np.empty((10, 100)).T)
+
+
+def test_cdist_argmin():
+
+    X = np.random.RandomState(0).normal(size=(1000, 5))
+    # duplicate centers check that ties go to the first one
+    Y = X[[3, 10, 3, 500, 999, 10]]
+
+    d_expected = cdist(X, Y)
+
+    assignments, distances = libdist.cdist_argmin(X, Y)
+    assert_array_equal(assignments, np.argmin(d_expected, axis=1))
+    assert_allclose(distances, np.min(d_expected, axis=1))
+    assert_array_equal(np.unique(assignments), [0, 1, 3, 4])
+
+    a_out = np.empty(len(X), dtype='int64')
+    d_out = np.empty(len(X), dtype='float32')
+    assignments, distances = libdist.cdist_argmin(
+        X.astype('float32'), Y.astype('float32'), assignments=a_out,
+        distances=d_out, dtype=np.float32)
+    assert assignments is a_out
+    assert distances is d_out
+    assert_array_equal(assignments, np.argmin(d_expected, axis=1))
+    assert_allclose(distances, np.min(d_expected, axis=1), rtol=1e-5)
+
+    with assert_raises(exception.DataInvalid):
+        libdist.cdist_argmin(X, Y, assignments=np.empty(len(X), dtype='int32'))
+
+
+def test_rmsd_argmin():
+
+    trj = md.load(get_fn('frame0.xtc'), top=get_fn('native.pdb'))
+    xyz = trj.xyz.copy()
+    center_frames = [0, 100, 300, 400]
+
+    # md.rmsd centers its target in place, so give it a copy
+    alldists = np.array(
+        [md.rmsd(trj[:], trj[:], i) for i in center_frames])
+
+    assignments, distances = libdist.rmsd_argmin(
+        trj.xyz, trj.xyz[center_frames])
+
+    assert_array_equal(assignments, np.argmin(alldists, axis=0))
+    assert_allclose(distances, np.min(alldists, axis=0), atol=1e-3)
+    # frames were not centered in place
+    assert_array_equal(trj.xyz, xyz)
+
+    # translated frames are superposed, unless they're precentered
+    shifted = trj.xyz + np.array([1, -2, 3], dtype='float32')
+    a, d = libdist.rmsd_argmin(shifted, trj.xyz[center_frames])
+    assert_array_equal(a, assignments)
+    assert_allclose(d, distances, atol=1e-5)
+
+    trj.center_coordinates()
+    a, d = libdist.rmsd_argmin(
+        trj.xyz, trj.xyz[center_frames], precentered=True,
+        assignments=np.empty(len(trj), dtype='int64'),
+        distances=np.empty(len(trj)))
+    assert_array_equal(a, assignments)
+    assert_allclose(d, distances, atol=1e-5)
+
+    a, d = libdist.rmsd_argmin(shifted, trj.xyz[center_frames],
+                               precentered=True)
+    assert np.all(d > 3)
+
+    # single atoms always superpose exactly
+    a, d = libdist.rmsd_argmin(trj.xyz[:, :1], trj.xyz[center_frames, :1])
+    assert_array_equal(a, 0)
+    assert_array_equal(d, 0)
+
+    with assert_raises(exception.DataInvalid):
+        libdist.rmsd_argmin(trj.xyz, trj.xyz[center_frames, 1:])
+
+    with assert_raises(exception.DataInvalid):
+        libdist.rmsd_argmin(trj.xyz, trj.xyz[center_frames],
+                            distances=np.empty(len(trj), dtype='float32'))
+
+
+def test_prune_tables():
+
+    cc = np.array([[0, 3, 1],
+                   [3, 0, 2],
+                   [1, 2, 0]], dtype=float)
+
+    order, sorted_cc = libdist.prune_tables(cc)
+
+    assert_array_equal(order, [[0, 2, 1], [1, 2, 0], [2, 0, 1]])
+    assert_array_equal(sorted_cc, [[0, 1, 3], [0, 2, 3], [0, 1, 2]])
+    assert_equal(order.dtype, np.int32)
+    assert_equal(sorted_cc.dtype, np.float32)
+
+
+def test_cdist_argmin_pruned():
+
+    # well-separated blobs, so most centers are far from most points
+    rs = np.random.RandomState(0)
+    X = np.concatenate([rs.normal(loc=10*i, size=(200, 3))
+                        for i in range(20)])
+    Y = np.ascontiguousarray(X[::20])
+
+    for metric in ['euclidean', 'manhattan']:
+        expect_assigs, expect_dists = libdist.cdist_argmin(X, Y, metric)
+        assigs, dists = libdist.cdist_argmin(X, Y, metric, prune=True)
+
+        assert_array_equal(assigs, expect_assigs)
+        assert_array_equal(dists, expect_dists)
+
+    order, sorted_cc = libdist.prune_tables(libdist.cdist(Y, Y))
+    n_evaluated = libdist._cdist_argmin_pruned(
+        X, Y, order, sorted_cc, np.empty(len(X), dtype='int64'),
+        np.empty(len(X)), libdist.BLOCKED_METRICS['euclidean'])
+
+    assert n_evaluated < 0.2 * len(X) * len(Y), n_evaluated
+
+
+def test_rmsd_argmin_pruned():
+
+    trj = md.load(get_fn('frame0.xtc'), top=get_fn('native.pdb'))
+    center_frames = np.arange(0, len(trj), 10)
+
+    expect_assigs, expect_dists = libdist.rmsd_argmin(
+        trj.xyz, trj.xyz[center_frames])
+    assigs, dists = libdist.rmsd_argmin(
+        trj.xyz, trj.xyz[center_frames], prune=True)
+
+    assert_array_equal(assigs, expect_assigs)
+    assert_array_equal(dists, expect_dists)
@@ -1,3 +1,5 @@
+import os
+import shutil
 import tempfile
 import random
 
@@ -5,9 +7,10 @@ import numpy as np
 from numpy.testing import assert_array_equal
 
 from nose.plugins.attrib import attr
+from nose.tools import assert_raises
 
 
-from .. import mpi, ra
+from .. import exception, mpi, ra
 
 
 @attr('mpi')
@@ -40,3 +43,117 @@ def test_parallel_h5_read_strided():
 
     assert_array_equal(local_arr,
                        full_arr[mpi.rank()::mpi.size(), ::3]._data)
+
+
+@attr('mpi')
+def test_parallel_h5_read_contiguous():
+
+    # same seed on every rank, so that global lengths agree
+    rng = np.random.RandomState(0)
+    full_arr = ra.RaggedArray([
+        rng.random_sample(size=(ra_len, 11))
+        for ra_len in rng.randint(3, 17, size=mpi.size() * 3)
+    ])
+
+    with tempfile.NamedTemporaryFile(suffix='.h5') as f:
+        ra.save(f.name, full_arr, layout='contiguous')
+        global_lengths, local_arr = mpi.io.load_h5_as_striped(f.name, stride=2)
+
+    assert_array_equal(global_lengths, full_arr.lengths)
+    assert_array_equal(local_arr,
+                       full_arr[mpi.rank()::mpi.size(), ::2]._data)
+
+
+@attr('mpi')
+def test_parallel_h5_read_balanced():
+
+    rng = np.random.RandomState(0)
+    full_arr = ra.RaggedArray([
+        rng.random_sample(size=(ra_len, 11))
+        for ra_len in rng.randint(3, 170, size=mpi.size() * 3)
+    ])
+    owners = mpi.ops.balanced_owners(full_arr.lengths)
+
+    with tempfile.NamedTemporaryFile(suffix='.h5') as f:
+        ra.save(f.name, full_arr, layout='contiguous')
+        global_lengths, local_arr = mpi.io.load_h5_as_striped(
+            f.name, balance=True)
+
+    assert_array_equal(global_lengths, full_arr.lengths)
+    assert_array_equal(
+        local_arr,
+        np.concatenate([full_arr[i] for i in
+                        np.flatnonzero(owners == mpi.rank())]))
+
+
+@attr('mpi')
+def test_parallel_npy_read():
+
+    rng = np.random.RandomState(0)
+    arrs = [rng.random_sample(size=(n, 5))
+            for n in rng.randint(3, 17, size=mpi.size() * 3)]
+
+    td = mpi.comm.bcast(tempfile.mkdtemp() if mpi.rank() == 0 else None,
+                        root=0)
+    filenames = [os.path.join(td, '%s.npy' % i) for i in range(len(arrs))]
+    if mpi.rank() == 0:
+        for fn, a in zip(filenames, arrs):
+            np.save(fn, a)
+    mpi.comm.barrier()
+
+    try:
+        global_lengths, local_arr = mpi.io.load_npy_as_striped(
+            filenames, stride=2, threads=2)
+    finally:
+        mpi.comm.barrier()
+        if mpi.rank() == 0:
+            shutil.rmtree(td)
+
+    assert_array_equal(global_lengths, [len(a[::2]) for a in arrs])
+    assert_array_equal(
+        local_arr,
+        np.concatenate([a[::2] for a in arrs[mpi.rank()::mpi.size()]]))
+
+
+@attr('mpi')
+def test_parallel_ragged_npy_read():
+
+    rng = np.random.RandomState(0)
+    full_arr = ra.RaggedArray([
+        rng.random_sample(size=(ra_len, 3, 2)).astype(np.float32)
+        for ra_len in rng.randint(3, 40, size=mpi.size() * 3)
+    ])
+    owners = mpi.ops.balanced_owners(full_arr[:, ::3].lengths)
+
+    td = mpi.comm.bcast(tempfile.mkdtemp() if mpi.rank() == 0 else None,
+                        root=0)
+    fname = os.path.join(td, 'features.npy')
+    if mpi.rank() == 0:
+        ra.save(fname, full_arr)
+    mpi.comm.barrier()
+
+    try:
+        for collective in [True, False]:
+            global_lengths, local_arr = mpi.io.load_ragged_npy_as_striped(
+                fname, stride=3, balance=True, collective=collective)
+
+            assert_array_equal(global_lengths, full_arr[:, ::3].lengths)
+            assert_array_equal(
+                local_arr,
+                np.concatenate([full_arr[i][::3] for i in
+                                np.flatnonzero(owners == mpi.rank())]))
+
+        # without a lengths sidecar, the file is a single row, which
+        # can't be spread across more than one node.
+        plain_fname = os.path.join(td, 'plain.npy')
+        if mpi.rank() == 0:
+            np.save(plain_fname, full_arr._data)
+        mpi.comm.barrier()
+
+        if mpi.size() > 1:
+            with assert_raises(exception.ImproperlyConfigured):
+                mpi.io.load_ragged_npy_as_striped(plain_fname)
+    finally:
+        mpi.comm.barrier()
+        if mpi.rank() == 0:
+            shutil.rmtree(td)
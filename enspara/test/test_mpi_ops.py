@@ -10,6 +10,7 @@ from nose.plugins.attrib import attr
 from .util import get_fn
 from .. import exception
 from .. import mpi
+from ..util import array as ra
 
 
 @attr('mpi')
@@ -62,6 +63,75 @@ def test_mpi_distribute_frame_mdtraj():
     assert_is(type(d), type(data))
 
 
+@attr('mpi')
+def test_mpi_striped_array_argmax():
+
+    data = md.load(get_fn('frame0.h5'))
+    local = data[mpi.rank()::mpi.size()]
+
+    # the max is tied on every rank, so goes to the lowest rank
+    distances = np.zeros(len(local))
+    distances[3] = 5
+    if mpi.rank() == mpi.size() - 1:
+        distances[7] = 9
+
+    value, owner, index, frame = mpi.ops.striped_array_argmax(
+        distances, local)
+
+    assert_equal((value, owner, index), (9, mpi.size() - 1, 7))
+    assert_array_equal(frame.xyz, data[7 * mpi.size() + owner].xyz)
+    assert_is(type(frame), type(data))
+
+    distances[7] = 0
+    value, owner, index, frame = mpi.ops.striped_array_argmax(
+        distances, local.xyz.reshape(len(local), -1))
+
+    assert_equal((value, owner, index), (5, 0, 3))
+    assert_array_equal(frame, data.xyz[3 * mpi.size()].reshape(-1))
+    assert_equal(frame.dtype, np.float32)
+
+    assert_is(mpi.ops.striped_array_argmax(distances)[-1], None)
+
+
+@attr('mpi')
+def test_mpi_striped_array_argmax_empty_ranks():
+
+    data = md.load(get_fn('frame0.h5'))
+
+    # only the last rank holds any frames
+    last = mpi.rank() == mpi.size() - 1
+    local = data[:5] if last else data[:0]
+    distances = np.arange(len(local), dtype=float)
+
+    value, owner, index, frame = mpi.ops.striped_array_argmax(
+        distances, local)
+    assert_equal((value, owner, index), (4, mpi.size() - 1, 4))
+    assert_array_equal(frame.xyz, data[4].xyz)
+
+    local = np.arange(20, dtype=float).reshape(5, 4) if last else \
+        np.zeros((0, 4))
+    value, owner, index, frame = mpi.ops.striped_array_argmax(
+        distances, local)
+    assert_equal((value, owner, index), (4, mpi.size() - 1, 4))
+    assert_array_equal(frame, [16, 17, 18, 19])
+
+
+@attr('mpi')
+def test_mpi_striped_array_argmax_int64():
+
+    # int64 values past 2**53 can't round-trip through float64
+    data = np.arange(10, dtype=np.int64).reshape(5, 2) + 2**62 + 1
+    local = data[mpi.rank()::mpi.size()]
+    distances = np.arange(len(data), dtype=float)[mpi.rank()::mpi.size()]
+
+    value, owner, index, frame = mpi.ops.striped_array_argmax(
+        distances, local)
+
+    assert_equal((value, owner, index), (4, 4 % mpi.size(), 4 // mpi.size()))
+    assert_array_equal(frame, data[4])
+    assert_equal(frame.dtype, np.int64)
+
+
 @attr('mpi')
 def test_mpi_assemble_striped_array():
 
@@ -71,6 +141,104 @@ def test_mpi_assemble_striped_array():
 
     assert_array_equal(a, b)
 
+    # 2d arrays keep their dtype, and can be assembled on one rank
+    a = np.arange(1, 31, dtype=np.float32).reshape(10, 3)
+    b = mpi.ops.assemble_striped_array(a[mpi.rank()::mpi.size()], root=0)
+
+    if mpi.rank() == 0:
+        assert_array_equal(a, b)
+        assert_equal(b.dtype, np.float32)
+    else:
+        assert_is(b, None)
+
+
+@attr('mpi')
+def test_mpi_assemble_striped_ragged_array():
+
+    lengths = np.array([4, 0, 7, 1, 3])
+    a = ra.RaggedArray(
+        np.arange(np.sum(lengths), dtype=np.int8), lengths=lengths)
+
+    local = a[mpi.rank()::mpi.size()]
+    local = local._data if hasattr(local, '_data') else local
+
+    b = mpi.ops.assemble_striped_ragged_array(local, lengths)
+    assert_array_equal(a._data, b)
+    assert_equal(b.dtype, np.int8)
+
+    b = mpi.ops.assemble_striped_ragged_array(local, lengths, root=0)
+    if mpi.rank() == 0:
+        assert_array_equal(a._data, b)
+    else:
+        assert_is(b, None)
+
+
+@attr('mpi')
+def test_mpi_gather_bytes_in_rounds():
+
+    # counts past max_count are gathered in several rounds
+    counts = [7 + 2 * r for r in range(mpi.size())]
+    a = np.arange(3 * sum(counts), dtype=np.float32).reshape(-1, 3)
+    start = sum(counts[:mpi.rank()])
+    local = a[start:start+counts[mpi.rank()]]
+
+    for max_count in [4, 5, 1000]:
+        assert_array_equal(
+            mpi.ops._gather_bytes(local, counts, max_count=max_count), a)
+
+        b = mpi.ops._gather_bytes(local, counts, root=0, max_count=max_count)
+        if mpi.rank() == 0:
+            assert_array_equal(b, a)
+        else:
+            assert_is(b, None)
+
+
+def test_balanced_owners():
+
+    lengths = np.array([10, 80, 10, 40, 30, 10])
+    owners = mpi.ops.balanced_owners(lengths, size=2)
+
+    assert_array_equal(owners, [1, 0, 0, 1, 1, 1])
+    assert_array_equal(
+        [lengths[owners == r].sum() for r in range(2)], [90, 90])
+
+    # rows of equal length are striped
+    assert_array_equal(
+        mpi.ops.balanced_owners(np.full(7, 5), size=3),
+        mpi.ops.striped_owners(7, size=3))
+
+    # every rank gets a row, even if some are empty
+    owners = mpi.ops.balanced_owners([0, 0, 3, 0], size=3)
+    assert_equal(len(np.unique(owners)), 3)
+
+
+@attr('mpi')
+def test_mpi_assemble_balanced_arrays():
+
+    lengths = np.array([2, 9, 1, 4, 6, 3, 5])
+    owners = mpi.ops.balanced_owners(lengths)
+
+    a = ra.RaggedArray(
+        np.arange(np.sum(lengths), dtype=np.int16), lengths=lengths)
+    local = np.concatenate(
+        [a[i] for i in np.flatnonzero(owners == mpi.rank())])
+
+    b = mpi.ops.assemble_striped_ragged_array(local, lengths, owners=owners)
+    assert_array_equal(a._data, b)
+
+    b = mpi.ops.assemble_striped_array(
+        lengths[owners == mpi.rank()], owners=owners)
+    assert_array_equal(lengths, b)
+
+    # the last frame held by each rank
+    local_inds = [(r, np.sum(lengths[owners == r]) - 1)
+                  for r in range(mpi.size())]
+    global_inds = mpi.ops.convert_local_indices(
+        local_inds, lengths, owners=owners)
+    assert_array_equal(
+        global_inds,
+        [a[np.flatnonzero(owners == r)[-1]][-1] for r in range(mpi.size())])
+
 
 @attr('mpi')
 def test_mpi_randind():
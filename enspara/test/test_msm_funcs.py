@@ -8,6 +8,7 @@ import numpy as np
 import scipy.sparse
 
 from .. import exception
+from .. import ra
 
 from ..msm import builders
 from ..msm.transition_matrices import assigns_to_counts, eigenspectrum, \
@@ -135,6 +136,26 @@ def test_assigns_to_counts_negnums():
     assert_array_equal(counts.toarray(), expected)
 
 
+def test_assigns_to_counts_lazy_ra():
+    '''assigns_to_counts works on RaggedArrays left on disk
+    '''
+
+    assigs = ra.RaggedArray([[0, 2, 0, -1], [1, 2], [1, 0, 0, 1, 2, 2]])
+    expected = assigns_to_counts(assigs, lag_time=1)
+
+    with tempfile.NamedTemporaryFile(suffix='.h5') as f:
+        ra.save(f.name, assigs)
+        with ra.load(f.name, mmap_mode='r') as lazy_assigs:
+            counts = assigns_to_counts(lazy_assigs, lag_time=1)
+
+    assert_array_equal(counts.toarray(), expected.toarray())
+    assert_array_equal(
+        counts.toarray(),
+        [[1, 1, 1],
+         [1, 0, 2],
+         [1, 0, 1]])
+
+
 @raises(exception.DataInvalid)
 def test_assigns_to_counts_1d():
     """assigns_to_counts handles 1d arrays gracefully
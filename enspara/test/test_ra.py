@@ -1,8 +1,13 @@
+import os
+import json
+import mmap
 import unittest
 import logging
 import tempfile
+from unittest import mock
 
 import numpy as np
+import tables
 import mdtraj as md
 from mdtraj import io
 
@@ -10,7 +15,11 @@ from nose.tools import assert_raises, assert_equals, assert_is, assert_true
 from numpy.testing import assert_array_equal
 
 from ..util import array as ra
-from ..util.load import load_as_concatenated, concatenate_trjs
+from ..ra import ra as ra_module
+from ..ra.ra import _convert_from_1d, _convert_from_2d, _save_old_style
+from ..util import load as load_module
+from ..util.load import load_as_concatenated, concatenate_trjs, \
+    sound_trajectory, sound_trajectories, TrajectoryStream
 from ..exception import DataInvalid, ImproperlyConfigured
 
 from .util import get_fn
@@ -88,6 +97,321 @@ class Test_RaggedArray(unittest.TestCase):
             b = ra.load(f.name)
             assert_array_equal(a, b)
 
+    def test_RaggedArray_from_buffer(self):
+        data = np.arange(10)
+        a = ra.RaggedArray.from_buffer(data, [3, 0, 7])
+
+        assert_true(np.shares_memory(a._data, data))
+        assert_array_equal(a.lengths, [3, 0, 7])
+        assert_array_equal(a[2], np.arange(3, 10))
+
+        data[0] = 100
+        assert_equals(a[0, 0], 100)
+
+        with assert_raises(DataInvalid):
+            ra.RaggedArray.from_buffer(data, [3, 3])
+
+    def test_RaggedArray_row_views(self):
+        a = ra.RaggedArray([np.arange(4), np.arange(4) + 10])
+
+        # equal-length rows are still views, not an object matrix
+        assert_equals(a[0].dtype, a.dtype)
+        assert_equals(a.rows_view().shape, (2,))
+
+        for row, view, expected in zip(a.iter_rows(), a.rows_view(),
+                                       [np.arange(4), np.arange(4) + 10]):
+            assert_array_equal(row, expected)
+            assert_true(np.shares_memory(row, a._data))
+            assert_true(np.shares_memory(view, a._data))
+
+        b = ra.RaggedArray([np.arange(3), np.arange(0), np.arange(2)])
+        assert_equals([len(row) for row in b], [3, 0, 2])
+
+    def test_RaggedArray_concatenate(self):
+        a = ra.RaggedArray([np.arange(3), np.arange(2)])
+        b = ra.RaggedArray([np.arange(4.)])
+        c = np.arange(6).reshape(2, 3)
+
+        d = ra.concatenate([a, b, c, [np.arange(1)]])
+        assert_array_equal(d.lengths, [3, 2, 4, 3, 3, 1])
+        assert_equals(d.dtype, np.float64)
+        assert_ra_equal(d[:2], a)
+        assert_array_equal(d[3], c[0])
+
+        rows_2d = ra.RaggedArray([np.ones((2, 3)), np.ones((1, 3))])
+        assert_array_equal(
+            ra.concatenate([rows_2d, rows_2d]).lengths, [2, 1, 2, 1])
+        with assert_raises(DataInvalid):
+            ra.concatenate([rows_2d, a])
+
+    def test_RaggedArray_row_reductions(self):
+        rows = [np.array([3, 1, 2], dtype=np.int8), np.array([], dtype=np.int8),
+                np.array([5, -1], dtype=np.int8), np.array([0], dtype=np.int8)]
+        a = ra.RaggedArray(np.concatenate(rows), lengths=[3, 0, 2, 1])
+
+        assert_array_equal(a.sum(axis=1), [6, 0, 4, 0])
+        assert_equals(a.sum(axis=1).dtype, np.sum(rows[0]).dtype)
+        assert_equals(a.sum(), 10)
+        assert_array_equal(a.mean(axis=1), [2, np.nan, 2, 0])
+        assert_equals(a.mean(), 10 / 6)
+
+        nonempty = a[[0, 2, 3]]
+        assert_array_equal(nonempty.max(axis=1), [3, 5, 0])
+        assert_array_equal(nonempty.min(axis=1), [1, -1, 0])
+        with assert_raises(ValueError):
+            a.max(axis=1)
+        with assert_raises(ImproperlyConfigured):
+            a.sum(axis=0)
+
+        # negative values (unassigned frames) aren't counted
+        assert_array_equal(
+            a.bincount(minlength=7),
+            [np.bincount(r[r >= 0], minlength=7) for r in rows])
+
+        b = ra.RaggedArray(np.arange(12.).reshape(6, 2), lengths=[2, 4])
+        assert_array_equal(b.sum(axis=1), [[2, 4], [28, 32]])
+        assert_array_equal(b.mean(axis=1), [[1, 2], [7, 8]])
+
+    def test_RaggedArray_segment_apply(self):
+        a = ra.RaggedArray([np.arange(1, 4), np.arange(0), np.arange(4, 6)])
+
+        assert_array_equal(a.segment_apply(np.multiply), [6, 1, 20])
+        assert_array_equal(a.segment_apply(np.logical_or), [True, False, True])
+
+        centered = a.segment_apply(
+            lambda x, rows: x - a.mean(axis=1)[rows])
+        assert_ra_equal(centered, ra.RaggedArray(
+            [[-1., 0., 1.], [], [-0.5, 0.5]]))
+
+        assert_array_equal(
+            a.segment_apply(lambda x, rows: np.bincount(rows, x, 3)),
+            [6, 0, 9])
+
+        with assert_raises(DataInvalid):
+            a.segment_apply(lambda x, rows: x[:2])
+        with assert_raises(DataInvalid):
+            a.segment_apply(lambda x, rows: x, per_row=True)
+
+    def test_RaggedArray_segment_apply_length_one_rows(self):
+        # one value per row and one per element are indistinguishable
+        a = ra.RaggedArray([[3], [1], [2]])
+
+        def row_sums(x, rows):
+            return np.bincount(rows, x, 3)
+
+        assert_array_equal(a.segment_apply(row_sums, per_row=True),
+                           [3, 1, 2])
+        assert_is(type(a.segment_apply(row_sums, per_row=True)), np.ndarray)
+
+        # without per_row, the tie goes to one value per element
+        assert_ra_equal(a.segment_apply(row_sums),
+                        ra.RaggedArray([[3.], [1.], [2.]]))
+        assert_ra_equal(a.segment_apply(row_sums, per_row=False),
+                        ra.RaggedArray([[3.], [1.], [2.]]))
+
+    def test_RaggedArray_lazy_row_reductions(self):
+        a = ra.RaggedArray([np.arange(5), np.arange(12) + 10,
+                            np.arange(0), np.arange(3) + 30])
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'assigs.h5')
+            ra.save(fname, a, layout='contiguous')
+
+            # force rows to be read across several blocks
+            with mock.patch.object(ra_module.LazyRaggedArray,
+                                   '_block_size', 4), \
+                    ra.load(fname, mmap_mode='r') as b:
+                assert_array_equal(b.sum(axis=1), a.sum(axis=1))
+                assert_array_equal(b.mean(axis=1), a.mean(axis=1))
+                assert_array_equal(b.bincount(), a.bincount())
+                assert_equals(b.sum(), a.sum())
+                assert_array_equal(b[[0, 1, 3]].max(axis=1), [4, 21, 32])
+
+    def test_RaggedArray_npy_roundtrip(self):
+        a = ra.RaggedArray([np.arange(5), np.arange(12), np.arange(3)])
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'assigs.npy')
+            ra.save(fname, a)
+
+            assert_true(os.path.exists(os.path.join(tmpdir,
+                                                    'assigs.lengths.npy')))
+            assert_ra_equal(a, ra.load(fname))
+            assert_ra_equal(a[:, ::2], ra.load(fname, stride=2))
+
+    def test_RaggedArray_lazy_load(self):
+        a = ra.RaggedArray([np.arange(5), np.arange(12) + 10,
+                            np.arange(1), np.arange(3) + 30])
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            npy_fname = os.path.join(tmpdir, 'assigs.npy')
+            h5_fname = os.path.join(tmpdir, 'assigs.h5')
+            old_fname = os.path.join(tmpdir, 'assigs-old.h5')
+
+            ra.save(npy_fname, a)
+            ra.save(h5_fname, a)
+            _save_old_style(old_fname, a)
+
+            for fname in [npy_fname, h5_fname, old_fname]:
+                with ra.load(fname, mmap_mode='r') as b:
+                    assert_is(type(b), ra.LazyRaggedArray)
+                    assert_array_equal(b.lengths, a.lengths)
+                    assert_array_equal(b.starts, a.starts)
+                    assert_equals(len(b), len(a))
+
+                    for i in range(len(a)):
+                        assert_array_equal(b[i], a[i])
+                    assert_array_equal(b[-1], a[-1])
+                    assert_equals(b[1, 3], a[1, 3])
+                    assert_ra_equal(b[1:3], a[1:3])
+                    assert_ra_equal(b[:, 2:4], a[:, 2:4])
+                    assert_ra_equal(b[[0, 3]], a[[0, 3]])
+                    assert_array_equal(ra.where(b > 8), ra.where(a > 8))
+                    assert_array_equal(b[b > 8], a[a > 8])
+                    assert_equals(b.max(), a.max())
+
+                    with assert_raises(ValueError):
+                        b[0, 0] = 1
+                    with assert_raises(ValueError):
+                        b.append(a[0])
+                    with assert_raises(TypeError):
+                        b.rows_view()
+
+    def test_RaggedArray_contiguous_roundtrip(self):
+        a = ra.RaggedArray([np.arange(5), np.arange(12) + 10,
+                            np.arange(0), np.arange(3) + 30])
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'assigs.h5')
+            ra.save(fname, a, layout='contiguous')
+
+            assert_ra_equal(ra.load(fname), a)
+            assert_ra_equal(ra.load(fname, stride=2), a[:, ::2])
+            assert_ra_equal(ra.load(fname, keys=[3, 0]), a[[3, 0]])
+            assert_ra_equal(ra.load(fname, keys=[1, 3], stride=2),
+                            a[[1, 3], ::2])
+            assert_array_equal(ra.load(fname, keys=[-3]), a[1])
+
+            with ra.load(fname, mmap_mode='r') as b:
+                assert_is(type(b), ra.LazyRaggedArray)
+                assert_ra_equal(b[:], a)
+                assert_array_equal(b[1], a[1])
+
+            with assert_raises(IndexError):
+                ra.load(fname, keys=[4])
+
+            # ndarrays round-trip as ndarrays
+            ra.save(fname, np.arange(10).reshape(5, 2), layout='contiguous')
+            assert_array_equal(ra.load(fname, stride=2),
+                               np.arange(10).reshape(5, 2)[::2])
+
+    def test_RaggedArray_migrate(self):
+        a = ra.RaggedArray([np.arange(5), np.arange(12) + 10,
+                            np.arange(3) + 30])
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            out_fname = os.path.join(tmpdir, 'migrated.h5')
+            rows_fname = os.path.join(tmpdir, 'rows.h5')
+            old_fname = os.path.join(tmpdir, 'old.h5')
+
+            ra.save(rows_fname, a)
+            _save_old_style(old_fname, a)
+
+            for fname in [rows_fname, old_fname]:
+                ra.migrate(fname, out_fname)
+                with tables.open_file(out_fname) as handle:
+                    assert_equals(handle.root._v_attrs.ra_format_version,
+                                  ra.CONTIGUOUS_FORMAT_VERSION)
+                    assert_array_equal(handle.root.offsets[:],
+                                       [0, 5, 17, 20])
+                assert_ra_equal(ra.load(out_fname), a)
+                assert_ra_equal(ra.load(fname), a)
+
+            with assert_raises(ImproperlyConfigured):
+                ra.migrate(out_fname, out_fname)
+
+    def test_RaggedArray_parallel_load(self):
+        a = ra.RaggedArray([np.arange(50), np.arange(120) + 10,
+                            np.arange(7), np.arange(33) + 30])
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            rows_fname = os.path.join(tmpdir, 'rows.h5')
+            contig_fname = os.path.join(tmpdir, 'contig.h5')
+            old_fname = os.path.join(tmpdir, 'old.h5')
+
+            ra.save(rows_fname, a)
+            ra.save(contig_fname, a, layout='contiguous')
+            _save_old_style(old_fname, a)
+
+            # force many small reads per row
+            with mock.patch.object(ra_module, '_PARALLEL_READ_BYTES', 16):
+                for fname in [rows_fname, contig_fname, old_fname]:
+                    for stride in [1, 3, 40]:
+                        assert_ra_equal(
+                            ra.load(fname, stride=stride, processes=2),
+                            a[:, ::stride])
+
+                assert_ra_equal(
+                    ra.load(rows_fname, keys=['arr_01', 'arr_03'],
+                            stride=2, processes=2),
+                    a[[1, 3], ::2])
+                assert_ra_equal(
+                    ra.load(contig_fname, keys=[3, 1], stride=2,
+                            processes=2),
+                    a[[3, 1], ::2])
+                assert_array_equal(
+                    ra.load(contig_fname, keys=[1], processes=2), a[1])
+
+    def test_RaggedArrayWriter(self):
+        a = ra.RaggedArray([np.arange(10).reshape(5, 2),
+                            np.zeros((0, 2), dtype=int),
+                            np.arange(6).reshape(3, 2) + 30])
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'assigs.h5')
+
+            with ra.RaggedArrayWriter(fname) as writer:
+                writer.extend(a[:2])
+                assert_equals(writer.n_rows, 2)
+                with assert_raises(DataInvalid):
+                    writer.append(np.arange(3))
+            assert_ra_equal(ra.load(fname), a[:2])
+
+            # a row that was only partially written is dropped on resume
+            with tables.open_file(fname, 'a') as handle:
+                handle.root.data.append(np.ones((4, 2), dtype=int))
+            with ra.RaggedArrayWriter(fname, resume=True) as writer:
+                assert_array_equal(writer.lengths, [5, 0])
+                writer.append(a[2])
+            assert_ra_equal(ra.load(fname), a)
+
+            with ra.RaggedArrayWriter(fname, resume=True) as writer:
+                writer.truncate(1)
+            assert_array_equal(ra.load(fname, keys=[0]), a[0])
+
+            # without resume, existing files are overwritten
+            with ra.RaggedArrayWriter(fname) as writer:
+                assert_equals(writer.n_rows, 0)
+            assert_equals(len(ra.load(fname)), 0)
+
+    def test_RaggedArray_lazy_load_blocks(self):
+        a = ra.RaggedArray([np.arange(5), np.arange(12), np.arange(3)])
+
+        with tempfile.NamedTemporaryFile(suffix='.h5') as f:
+            ra.save(f.name, a)
+            with ra.load(f.name, mmap_mode='r') as b, \
+                    mock.patch.object(ra.LazyRaggedArray, '_block_size', 4):
+                assert_ra_equal(b + 1, a + 1)
+                assert_ra_equal(b == a, a == a)
+                assert_ra_equal(~(b < 3), ~(a < 3))
+                assert_equals(b.min(), 0)
+                assert_true((b >= 0).all())
+
+        with assert_raises(ImproperlyConfigured):
+            with tempfile.NamedTemporaryFile(suffix='.npy') as f:
+                ra.save(f.name, a)
+                ra.load(f.name, mmap_mode='r', stride=2)
+
     def test_RaggedArray_load_h5_arrays(self):
         src = np.array(range(55))
         a = ra.RaggedArray(array=src, lengths=[25, 30])
@@ -347,6 +671,43 @@ class Test_RaggedArray(unittest.TestCase):
             ra.where(a < 0),
             np.array([[], []],))
 
+    def test_ra_where_empty_rows(self):
+        '''ra.where should skip over rows of length zero'''
+        a = ra.RaggedArray(np.arange(7), lengths=[3, 0, 0, 4])
+
+        assert_array_equal(
+            ra.where(a >= 2),
+            (np.array([0, 3, 3, 3, 3]), np.array([2, 0, 1, 2, 3])))
+
+    def test_ra_index_conversion_roundtrip(self):
+        lengths = np.array([5, 0, 17, 1, 9, 0, 30])
+        starts = np.append([0], np.cumsum(lengths)[:-1])
+        iis_flat = np.arange(lengths.sum())
+
+        rows, cols = _convert_from_1d((iis_flat,), lengths=lengths)
+
+        assert_array_equal(rows, np.repeat(np.arange(len(lengths)), lengths))
+        assert_array_equal(
+            _convert_from_2d((rows, cols), lengths=lengths,
+                                starts=starts)[0],
+            iis_flat)
+
+        # negative indices are wrapped row-by-row
+        neg = _convert_from_2d(
+            (np.array([-1, 0, 2]), np.array([-1, -5, -17])), lengths=lengths,
+            starts=starts)[0]
+        assert_array_equal(neg, [61, 0, 5])
+
+    def test_RaggedArray_multirow_slice_semantics(self):
+        src = [np.arange(10), np.arange(3), np.arange(6)]
+        a = ra.RaggedArray(array=src)
+
+        for s in [slice(-4, None), slice(1, -1, 2), slice(None, None, -1),
+                  slice(-2, 0, -1), slice(5, 1), slice(None, 100, 3)]:
+            b = a[:, s]
+            assert_array_equal(b.lengths, [len(r[s]) for r in src])
+            assert_array_equal(b._data, np.concatenate([r[s] for r in src]))
+
     def test_ra_where_ndarray(self):
         '''ra.where should work on ndarrays, too'''
         a = np.array([range(5), range(4, -1, -1)])
@@ -447,6 +808,23 @@ class TestParallelLoad(unittest.TestCase):
         self.assertTrue(np.all(expected == xyz))
         self.assertEqual(expected.shape, xyz.shape)
 
+    def test_load_as_concatenated_shared_mmap(self):
+
+        t1 = md.load(self.trj_fname, top=self.top)
+
+        lengths, xyz = load_as_concatenated(
+            [self.trj_fname]*2, top=self.top, processes=2)
+        assert_array_equal(xyz, np.concatenate([t1.xyz, t1.xyz]))
+
+        # the coordinates are a view of the anonymous mapping they were
+        # loaded into, not a copy of it. (Depending on the version of
+        # numpy, the mapping may be wrapped in a memoryview.)
+        base = xyz
+        while isinstance(base, (np.ndarray, memoryview)):
+            base = base.base if isinstance(base, np.ndarray) else base.obj
+        assert_true(isinstance(base, mmap.mmap))
+        assert_equals(len(base), xyz.nbytes)
+
     def test_load_as_concatenated_generator(self):
 
         t1 = md.load(self.trj_fname, top=self.top)
@@ -638,6 +1016,229 @@ class TestParallelLoad(unittest.TestCase):
         self.assertTrue(np.all(expected == xyz))
 
 
+class TestSoundTrajectories(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.trj_fnames = [os.path.join(self.tmpdir.name, 'trj%s.xtc' % i)
+                           for i in range(3)]
+        for fname in self.trj_fnames:
+            with open(get_fn('frame0.xtc'), 'rb') as src, \
+                    open(fname, 'wb') as dst:
+                dst.write(src.read())
+
+        self.cache_fname = os.path.join(
+            self.tmpdir.name, load_module.LENGTH_CACHE_NAME)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_sound_trajectories_cached(self):
+        lengths = sound_trajectories(self.trj_fnames, processes=2)
+        assert_array_equal(lengths, [501, 501, 501])
+        assert_true(os.path.isfile(self.cache_fname))
+
+        # cached lengths are used, and strided, without opening files
+        with mock.patch.object(load_module, '_count_frames') as count:
+            assert_array_equal(
+                sound_trajectories(self.trj_fnames, stride=10), [51]*3)
+            assert_equals(sound_trajectory(self.trj_fnames[0], stride=2),
+                          251)
+            assert_equals(count.call_count, 0)
+
+        # a modified trajectory is sounded again
+        os.utime(self.trj_fnames[1], ns=(0, 0))
+        with mock.patch.object(load_module, '_count_frames',
+                               return_value=7) as count:
+            assert_array_equal(
+                sound_trajectories(self.trj_fnames), [501, 7, 501])
+            assert_equals(count.call_count, 1)
+
+    def test_sound_trajectories_cache_merge(self):
+        # writers that each sounded different files both keep their entries
+        sound_trajectory(self.trj_fnames[0])
+        sound_trajectory(self.trj_fnames[2])
+
+        with open(self.cache_fname) as f:
+            lengths = json.load(f)['lengths']
+        assert_equals(sorted(lengths), ['trj0.xtc', 'trj2.xtc'])
+
+        # a corrupt cache is ignored, then replaced
+        with open(self.cache_fname, 'w') as f:
+            f.write('{"version": 1, "leng')
+        assert_array_equal(sound_trajectories(self.trj_fnames), [501]*3)
+        with open(self.cache_fname) as f:
+            assert_equals(len(json.load(f)['lengths']), 3)
+
+    def test_frame_offsets_cached(self):
+        offsets = load_module.frame_offsets(self.trj_fnames[0])
+        with md.formats.XTCTrajectoryFile(self.trj_fnames[0]) as f:
+            assert_array_equal(offsets, f.offsets)
+
+        # computing offsets also caches the trajectory's length
+        with mock.patch.object(md, 'open') as md_open:
+            assert_array_equal(
+                load_module.frame_offsets(self.trj_fnames[0]), offsets)
+            assert_equals(sound_trajectory(self.trj_fnames[0]), 501)
+            assert_equals(md_open.call_count, 0)
+
+        assert_is(load_module.frame_offsets(get_fn('frame0.h5'),
+                                            cache=False), None)
+
+    def test_sound_trajectories_no_cache(self):
+        assert_array_equal(
+            sound_trajectories(self.trj_fnames, cache=False), [501]*3)
+        assert_true(not os.path.exists(self.cache_fname))
+
+
+class TestAtomCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.trj_fnames = [os.path.join(self.tmpdir.name, 'trj%s.xtc' % i)
+                           for i in range(3)]
+        for fname in self.trj_fnames:
+            with open(get_fn('frame0.xtc'), 'rb') as src, \
+                    open(fname, 'wb') as dst:
+                dst.write(src.read())
+
+        self.top = md.load(get_fn('native.pdb')).top
+        self.aids = self.top.select('name CA')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_extract_atoms(self):
+        paths = load_module.extract_atoms(
+            self.trj_fnames, top=self.top, atom_indices=self.aids,
+            processes=2, block_size=100)
+        assert_true(all(os.path.isfile(p) for p in paths))
+
+        expected = md.load(self.trj_fnames[0], top=self.top,
+                           atom_indices=self.aids).xyz
+        assert_array_equal(
+            load_module.cached_atoms(self.trj_fnames[0], self.aids),
+            expected)
+
+        # frames cached with stride 1 serve other strides
+        assert_array_equal(
+            load_module.cached_atoms(self.trj_fnames[0], self.aids, 3),
+            expected[::3])
+
+        # other selections and modified trajectories aren't cached
+        assert_is(load_module.cached_atoms(self.trj_fnames[0]), None)
+        os.utime(self.trj_fnames[1], ns=(0, 0))
+        assert_is(load_module.cached_atoms(self.trj_fnames[1], self.aids),
+                  None)
+
+    def test_load_as_concatenated_from_cache(self):
+        path = load_module.extract_atoms(
+            self.trj_fnames[:1], top=self.top, atom_indices=self.aids)[0]
+
+        # mark the cached coordinates, to show they're the ones loaded
+        cached = np.load(path, mmap_mode='r+')
+        cached[:] = -1
+        del cached
+
+        lengths, xyz = load_as_concatenated(
+            self.trj_fnames[:2], top=self.top, atom_indices=self.aids,
+            stride=2)
+
+        assert_array_equal(lengths, [251, 251])
+        assert_true(np.all(xyz[:251] == -1))
+        assert_array_equal(
+            xyz[251:],
+            md.load(self.trj_fnames[1], top=self.top, atom_indices=self.aids,
+                    stride=2).xyz)
+
+    def test_extract_atoms_args(self):
+        with assert_raises(ImproperlyConfigured):
+            load_module.extract_atoms(self.trj_fnames, atom_indices=self.aids)
+        with assert_raises(ImproperlyConfigured):
+            load_module.extract_atoms(self.trj_fnames, top=self.top,
+                                      frame=3)
+
+
+class TestTrajectoryStream(unittest.TestCase):
+
+    def setUp(self):
+        self.top = md.load(get_fn('native.pdb')).top
+        self.filenames = [get_fn('frame0.xtc'), get_fn('frame0.h5'),
+                          get_fn('frame0.xtc')]
+        self.atom_ids = self.top.select('name CA')
+
+        self.expected = md.join(
+            [md.load(f, top=self.top, stride=3, atom_indices=self.atom_ids)
+             for f in self.filenames])
+
+    def test_stream_blocks(self):
+        for n_workers in [0, 2]:
+            stream = TrajectoryStream(
+                self.filenames, self.top, block_size=100, stride=3,
+                atom_indices=self.atom_ids, n_workers=n_workers)
+
+            assert_equals(len(stream), len(self.expected))
+            assert_equals(stream.lengths, [167, 167, 167])
+
+            blocks = list(stream)
+            assert_equals([len(b) for b in blocks], [100]*5 + [1])
+            assert_equals(blocks[0].n_atoms, len(self.atom_ids))
+
+            streamed = md.join(blocks)
+            assert_array_equal(streamed.xyz, self.expected.xyz)
+            assert_array_equal(streamed.time, self.expected.time)
+            assert_array_equal(streamed.unitcell_lengths,
+                               self.expected.unitcell_lengths)
+
+    def test_stream_trajectories(self):
+        stream = TrajectoryStream(
+            self.filenames, get_fn('native.pdb'), stride=3,
+            atom_indices=self.atom_ids, prefetch=1)
+
+        trjs = list(stream.trajectories())
+        assert_equals([len(t) for t in trjs], stream.lengths)
+        assert_array_equal(md.join(trjs).xyz, self.expected.xyz)
+
+    def test_stream_early_exit(self):
+        stream = TrajectoryStream(self.filenames, self.top, block_size=10,
+                                  n_workers=2)
+
+        for i, block in enumerate(stream):
+            if i == 2:
+                break
+        assert_array_equal(block.xyz, md.load(
+            self.filenames[0], top=self.top).xyz[20:30])
+
+        with assert_raises(ImproperlyConfigured):
+            TrajectoryStream(self.filenames, self.top, prefetch=0)
+
+    def test_read_frames(self):
+        full = md.load(get_fn('frame0.xtc'), top=self.top)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            gro_fname = os.path.join(tmpdir, 'frame0.gro')
+            full[:100].save(gro_fname)
+            gro = md.load(gro_fname)
+
+            # strided reads are made in runs (here, of at most 10 frames),
+            # or frame by frame when the stride is longer than a run
+            with mock.patch.object(load_module, '_READ_CHUNK_FRAMES', 10):
+                for stride in [1, 3, 20]:
+                    trj = load_module.read_frames(
+                        get_fn('frame0.xtc'), 4, 7, self.top,
+                        stride=stride, atom_indices=self.atom_ids)
+                    assert_array_equal(
+                        trj.xyz, full.xyz[::stride, self.atom_ids][4:11])
+
+                    trj = load_module.read_frames(
+                        gro_fname, 2, 3, gro.top, stride=stride)
+                    assert_array_equal(
+                        trj.xyz, gro.xyz[::stride][2:5])
+
+                with assert_raises(DataInvalid):
+                    load_module.read_frames(gro_fname, 95, 10, gro.top)
+
+
 class TestConcatenateTrajs(unittest.TestCase):
 
     def setUp(self):
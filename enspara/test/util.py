@@ -1,11 +1,43 @@
+import atexit
 import os
+import shutil
+import tempfile
 from functools import wraps
 
 import numpy as np
 
+TEST_DIR = os.path.dirname(__file__)
+
+# test data directories that tests load trajectories from
+COPIED_DATA_DIRS = ['data', 'cards_data']
+
+_data_copy = None
+
+
+def data_copy():
+    """Directory holding a copy of the test data (the directories in
+    COPIED_DATA_DIRS), made on first use and removed at exit.
+
+    Loading trajectories caches their lengths and frame offsets in
+    files next to them (see enspara.util.load), so tests read them from
+    this copy, leaving the repository's test data unchanged.
+    """
+
+    global _data_copy
+
+    if _data_copy is None:
+        tmpdir = tempfile.mkdtemp(prefix='enspara-test-data-')
+        atexit.register(shutil.rmtree, tmpdir, ignore_errors=True)
+        for name in COPIED_DATA_DIRS:
+            shutil.copytree(os.path.join(TEST_DIR, name),
+                            os.path.join(tmpdir, name))
+        _data_copy = tmpdir
+
+    return _data_copy
+
 
 def get_fn(fn):
-    return os.path.join(os.path.dirname(__file__), 'data', fn)
+    return os.path.join(data_copy(), 'data', fn)
 
 
 def fix_np_rng(seed=0):
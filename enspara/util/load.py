@@ -1,11 +1,21 @@
 import os
+import collections
+import fcntl
+import hashlib
+import json
 import logging
 import math
+import mmap
+import numbers
+import sys
+import tempfile
+import zipfile
 
 import multiprocessing as mp
 from contextlib import closing
 from functools import partial, reduce
 import ctypes
+import itertools
 from operator import mul
 
 import numpy as np
@@ -16,8 +26,34 @@ from .. import exception
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# name of the sidecar file, kept in each directory of trajectories, in
+# which sound_trajectories caches the number of frames in each file.
+LENGTH_CACHE_NAME = '.enspara_lengths.json'
+LENGTH_CACHE_VERSION = 1
 
-def sound_trajectory(trj, stride=1, frame=None):
+# formats in which md.open can seek to a frame and read from there
+_SEEKABLE_FORMATS = {'.xtc', '.trr', '.dcd'}
+
+# madvise flag asking Linux to back a mapping with transparent huge pages
+_MADV_HUGEPAGE = 14
+
+# directory, kept next to trajectories, in which frame_offsets caches the
+# byte offset of each frame of formats (e.g. XTC) that can't seek
+# directly to a frame.
+OFFSET_CACHE_DIR = '.enspara_offsets'
+
+# number of frames decoded by each read when striding through, or
+# streaming, a trajectory; this bounds the memory held by frames that
+# are read only to be skipped.
+_READ_CHUNK_FRAMES = 1024
+
+# directory, kept next to trajectories, in which extract_atoms stores the
+# coordinates of a subset of atoms as .npy files, so that repeatedly
+# loading the same selection doesn't decode the whole trajectory again.
+ATOM_CACHE_DIR = '.enspara_atoms'
+
+
+def sound_trajectory(trj, stride=1, frame=None, cache=True):
     """Determine the length of a trajectory on disk.
 
     For H5 file formats, this is a trivial lookup of the shape parameter
@@ -26,12 +62,18 @@ def sound_trajectory(trj, stride=1, frame=None):
     in (maybe) log(n) time and constant space by loading individual
     frames from disk at exponentially increasing indices.
 
-    Additional keyword args are passed on to md.load.
+    Lengths are cached on disk (see `sound_trajectories`), so each file
+    is only sounded once for as long as it is unchanged.
 
     Parameters
     ----------
     trj: file path
         Path to the trajectory to sound.
+    stride : int, default=1
+        Give the length the trajectory would have if loaded with this
+        stride.
+    cache : bool, default=True
+        Consult and update the trajectory length cache.
 
     Returns
     ----------
@@ -41,13 +83,371 @@ def sound_trajectory(trj, stride=1, frame=None):
 
     See Also
     ----------
-    md.load
+    md.load, sound_trajectories
     """
 
+    return sound_trajectories([trj], stride=stride, processes=1,
+                              cache=cache)[0]
+
+
+def sound_trajectories(filenames, stride=1, processes=None, cache=True):
+    """Determine the lengths of many trajectories on disk.
+
+    Lengths are cached in a sidecar file (LENGTH_CACHE_NAME) in the
+    directory of each trajectory, keyed by file name, size and
+    modification time, so that only new or changed trajectories are
+    opened. Writers to the same cache are serialized with a lock file
+    and the cache is replaced atomically, so many jobs can share a
+    directory of trajectories safely. If the directory isn't writable,
+    trajectories are sounded without caching.
+
+    Parameters
+    ----------
+    filenames : list
+        Paths to the trajectories to sound.
+    stride : int or list of ints, default=1
+        Give the lengths the trajectories would have if loaded with
+        this stride (or, if a list, with one stride per trajectory).
+    processes : int, optional
+        The number of processes with which to sound uncached
+        trajectories.
+    cache : bool, default=True
+        Consult and update the trajectory length cache.
+
+    Returns
+    -------
+    lengths : list of ints
+        The length (in frames) of each trajectory.
+    """
+
+    filenames = list(filenames)
+    if isinstance(stride, numbers.Integral):
+        stride = [stride] * len(filenames)
+
+    n_frames = [None] * len(filenames)
+    stats = [None] * len(filenames)
+
+    if cache:
+        caches = {}
+        for i, fname in enumerate(filenames):
+            directory, base = os.path.split(os.path.abspath(fname))
+            if directory not in caches:
+                caches[directory] = _read_length_cache(directory)
+
+            st = os.stat(fname)
+            stats[i] = [st.st_size, st.st_mtime_ns]
+
+            entry = caches[directory].get(base)
+            if entry is not None and entry[:2] == stats[i]:
+                n_frames[i] = entry[2]
+
+    uncached = [i for i, n in enumerate(n_frames) if n is None]
+    logger.debug("Sounding %s trajectories (%s cached) with %s processes.",
+                 len(uncached), len(filenames) - len(uncached), processes)
+
+    if len(uncached) > 1 and processes != 1:
+        with mp.Pool(processes=processes) as pool:
+            sounded = pool.map(_count_frames,
+                               [filenames[i] for i in uncached])
+    else:
+        sounded = [_count_frames(filenames[i]) for i in uncached]
+
+    updates = {}
+    for i, n in zip(uncached, sounded):
+        n_frames[i] = n
+        if cache:
+            directory, base = os.path.split(os.path.abspath(filenames[i]))
+            updates.setdefault(directory, {})[base] = stats[i] + [n]
+
+    for directory, entries in updates.items():
+        _update_length_cache(directory, entries)
+
+    return [math.ceil(n / s) for n, s in zip(n_frames, stride)]
+
+
+def _count_frames(trj):
     with md.open(trj) as f:
-        n_frames = len(f)
+        return len(f)
+
+
+def _read_length_cache(directory):
+    """Read the trajectory length cache for a directory, as a dict
+    mapping file names to [size, mtime_ns, n_frames]."""
+
+    try:
+        with open(os.path.join(directory, LENGTH_CACHE_NAME)) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if cache.get('version') != LENGTH_CACHE_VERSION:
+        return {}
+    return cache['lengths']
+
+
+def _update_length_cache(directory, entries):
+    """Merge entries into the trajectory length cache for a directory."""
+
+    cache_fname = os.path.join(directory, LENGTH_CACHE_NAME)
+
+    try:
+        with open(cache_fname + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            # re-read under the lock, so entries other writers added
+            # since we last read the cache are kept.
+            lengths = _read_length_cache(directory)
+            lengths.update(entries)
+
+            fd, tmp_fname = tempfile.mkstemp(dir=directory,
+                                             prefix=LENGTH_CACHE_NAME)
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump({'version': LENGTH_CACHE_VERSION,
+                               'lengths': lengths}, f)
+                os.replace(tmp_fname, cache_fname)
+            except BaseException:
+                os.remove(tmp_fname)
+                raise
+    except OSError as e:
+        logger.debug("Couldn't update trajectory length cache in %s: %s",
+                     directory, e)
+
 
-    return math.ceil(n_frames / stride)
+def frame_offsets(trj, cache=True):
+    """Get the byte offset of each frame in a trajectory file.
+
+    In formats with variable-sized frames (XTC, TRR), reaching a frame
+    means scanning the file from the start, but with these offsets it
+    can be read directly (by setting the offsets attribute of the
+    mdtraj file object). Offsets are cached in OFFSET_CACHE_DIR, next to
+    the trajectory, keyed by its size and modification time, and the
+    trajectory's length is added to the length cache as well (see
+    `sound_trajectories`).
+
+    Parameters
+    ----------
+    trj : file path
+        Path to the trajectory.
+    cache : bool, default=True
+        Consult and update the frame offset cache.
+
+    Returns
+    -------
+    offsets : np.ndarray or None
+        The offset of each frame, or None if the format has no need
+        for (or no support for) offsets.
+    """
+
+    directory, base = os.path.split(os.path.abspath(trj))
+    st = os.stat(trj)
+    stat = [st.st_size, st.st_mtime_ns]
+    cache_fname = os.path.join(directory, OFFSET_CACHE_DIR, base + '.npz')
+
+    if cache:
+        try:
+            with np.load(cache_fname) as cached:
+                if cached['stat'].tolist() == stat:
+                    return cached['offsets']
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            pass
+
+    with md.open(trj) as f:
+        if not hasattr(f, 'offsets'):
+            return None
+        offsets = np.asarray(f.offsets)
+
+    if cache:
+        _write_offset_cache(cache_fname, stat, offsets)
+        _update_length_cache(directory, {base: stat + [len(offsets)]})
+
+    return offsets
+
+
+def _write_offset_cache(cache_fname, stat, offsets):
+    """Atomically write a frame offset cache file."""
+
+    cache_dir = os.path.dirname(cache_fname)
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_fname = tempfile.mkstemp(dir=cache_dir, suffix='.npz')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, stat=stat, offsets=offsets)
+            os.replace(tmp_fname, cache_fname)
+        except BaseException:
+            os.remove(tmp_fname)
+            raise
+    except OSError as e:
+        logger.debug("Couldn't write frame offset cache %s: %s",
+                     cache_fname, e)
+
+
+def atom_cache_path(trj, atom_indices=None, stride=1):
+    """Path at which the coordinates of `atom_indices`, taken every
+    `stride` frames of `trj`, are cached by `extract_atoms`.
+
+    The file name is keyed by the trajectory's size and modification
+    time, the atom indices and the stride, so a modified trajectory or
+    a different selection never matches a stale entry.
+
+    Parameters
+    ----------
+    trj : file path
+        Path to the trajectory.
+    atom_indices : array-like, default=None
+        Indices of the cached atoms. If None, all atoms.
+    stride : int, default=1
+        Stride of the cached frames.
+
+    Returns
+    -------
+    path : str
+        Path to the (possibly nonexistent) cache file.
+    """
+
+    directory, base = os.path.split(os.path.abspath(trj))
+    st = os.stat(trj)
+
+    key = hashlib.sha1(np.array(
+        [st.st_size, st.st_mtime_ns, stride], dtype=np.int64).tobytes())
+    if atom_indices is None:
+        key.update(b'all')
+    else:
+        key.update(np.asarray(atom_indices, dtype=np.int64).tobytes())
+
+    return os.path.join(directory, ATOM_CACHE_DIR,
+                        '%s.%s.npy' % (base, key.hexdigest()[:16]))
+
+
+def cached_atoms(trj, atom_indices=None, stride=1):
+    """Get the cached coordinates of a subset of atoms in a trajectory,
+    if `extract_atoms` has cached them.
+
+    Frames cached with stride 1 also serve any other stride.
+
+    Parameters
+    ----------
+    trj : file path
+        Path to the trajectory.
+    atom_indices : array-like, default=None
+        Indices of the atoms to get. If None, all atoms.
+    stride : int, default=1
+        Get only every stride-th frame.
+
+    Returns
+    -------
+    xyz : np.memmap or None
+        Read-only, memory-mapped coordinates, shape=(n_frames,
+        n_atoms, 3), or None if they aren't cached.
+    """
+
+    for cached_stride in sorted({stride, 1}, reverse=True):
+        path = atom_cache_path(trj, atom_indices, cached_stride)
+        try:
+            xyz = np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            continue
+        return xyz[::stride // cached_stride]
+
+    return None
+
+
+def extract_atoms(filenames, args=None, processes=None, block_size=10000,
+                  **kwargs):
+    """Cache the coordinates of a subset of atoms in each of many
+    trajectories, so later loads read them from a compact file.
+
+    Each trajectory is decoded once, block by block, and the selected
+    atoms are written to a memory-mappable .npy file in ATOM_CACHE_DIR,
+    next to the trajectory (see `atom_cache_path`). `load_as_concatenated`
+    (and so the cluster and reassign apps) reads from these files
+    instead of the trajectory when they are present. Trajectories that
+    are already cached are skipped.
+
+    Parameters
+    ----------
+    filenames : list
+        Paths to the trajectories to cache.
+    args : list, optional
+        A list of dictionaries of `top`, `atom_indices` and `stride`,
+        one for each of filenames. Supplied XOR ``**kwargs``, as in
+        `load_as_concatenated`.
+    processes : int, optional
+        The number of processes to extract trajectories with.
+    block_size : int, default=10000
+        Number of frames read from a trajectory at a time.
+
+    Returns
+    -------
+    paths : list
+        Path to the cache file of each trajectory.
+    """
+
+    filenames = list(filenames)
+
+    if kwargs and args:
+        raise exception.ImproperlyConfigured(
+            "Additional unnamed args can only be supplied iff no "
+            "additonal keyword args are supplied")
+    elif not args:
+        args = [kwargs] * len(filenames)
+    elif len(args) != len(filenames):
+        raise exception.ImproperlyConfigured(
+            "When add'l unnamed args are provided, len(args) == "
+            "len(filenames), but %s != %s." % (len(args), len(filenames)))
+
+    for kw in args:
+        if 'top' not in kw or not set(kw).issubset(
+                {'top', 'atom_indices', 'stride'}):
+            raise exception.ImproperlyConfigured(
+                "Extracting atoms needs 'top' and takes only 'top', "
+                "'atom_indices' and 'stride' arguments, got %s." %
+                sorted(kw))
+
+    with closing(mp.Pool(processes=processes)) as p:
+        paths = p.starmap(
+            partial(_extract_atoms, block_size=block_size),
+            [(f, kw['top'], kw.get('atom_indices'), kw.get('stride', 1))
+             for f, kw in zip(filenames, args)])
+    p.join()
+
+    return paths
+
+
+def _extract_atoms(trj, top, atom_indices, stride, block_size):
+    """Write the cache file of a single trajectory for `extract_atoms`."""
+
+    path = atom_cache_path(trj, atom_indices, stride)
+    if os.path.isfile(path):
+        return path
+
+    stream = TrajectoryStream(
+        [trj], top, block_size=block_size, stride=stride,
+        atom_indices=atom_indices, n_workers=0)
+
+    cache_dir = os.path.dirname(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_fname = tempfile.mkstemp(dir=cache_dir, suffix='.npy')
+    os.close(fd)
+
+    try:
+        xyz = np.lib.format.open_memmap(
+            tmp_fname, mode='w+', dtype=np.float32,
+            shape=(len(stream), stream.topology.n_atoms, 3))
+        start = 0
+        for block in stream:
+            xyz[start:start+len(block)] = block.xyz
+            start += len(block)
+        xyz.flush()
+        del xyz
+        os.replace(tmp_fname, path)
+    except BaseException:
+        os.remove(tmp_fname)
+        raise
+
+    return path
 
 
 def load_as_concatenated(filenames, lengths=None, processes=None,
@@ -83,9 +483,15 @@ def load_as_concatenated(filenames, lengths=None, processes=None,
        A 2-tuple of trajectory lengths (list of ints, frames) and
        coordinates (ndarray, shape=(n_atoms, n_frames, 3)).
 
+    Notes
+    -----
+    If the atoms to load from a trajectory were cached by
+    `extract_atoms`, they are read from the cache rather than from the
+    trajectory itself.
+
     See Also
     --------
-    md.load
+    md.load, extract_atoms
     '''
 
     # we need access to this as a list, so if we get some kind of
@@ -112,13 +518,11 @@ def load_as_concatenated(filenames, lengths=None, processes=None,
         args[0], args[-1])
 
     if lengths is None:
-        logger.debug("Sounding %s trajectories with %s processes.",
-                     len(filenames), processes)
-        with mp.Pool(processes=processes) as pool:
-            lengths = pool.starmap(
-                sound_trajectory,
-                [(f, kw.get('stride', 1)) for f, kw
-                 in zip(filenames, args) if 'frame' not in kw])
+        lengths = sound_trajectories(
+            [f for f, kw in zip(filenames, args) if 'frame' not in kw],
+            stride=[kw.get('stride', 1) for kw in args
+                    if 'frame' not in kw],
+            processes=processes)
 
         # trjs with frame are always length 1, add that to lengths now
         for i, kw in enumerate(args):
@@ -162,6 +566,247 @@ def load_as_concatenated(filenames, lengths=None, processes=None,
     return lengths, xyz
 
 
+class TrajectoryStream(object):
+    """Stream the frames of a list of trajectory files in fixed-size
+    blocks, reading ahead in background processes.
+
+    Iterating over a TrajectoryStream yields md.Trajectory blocks of
+    `block_size` frames (the last may be shorter) of the concatenated
+    trajectories, in order. Blocks may span files; use `trajectories`
+    to get one trajectory per file instead. At most `prefetch` blocks
+    are read ahead of the one being consumed, so memory use stays near
+    (prefetch + 1) * block_size frames however large the dataset is.
+
+    Parameters
+    ----------
+    filenames : list
+        Paths to the trajectories to stream.
+    top : str, md.Topology or md.Trajectory
+        Topology of the trajectories.
+    block_size : int, default=10000
+        Number of frames in each block.
+    stride : int, default=1
+        Stream only every stride-th frame of each trajectory.
+    atom_indices : array-like, default=None
+        Stream only these atoms.
+    n_workers : int, default=1
+        Number of background processes reading blocks. If 0, blocks are
+        read in the calling process when they are requested.
+    prefetch : int, default=2
+        Number of blocks to read ahead of the one being consumed.
+
+    Attributes
+    ----------
+    lengths : list of ints
+        The number of frames streamed from each trajectory.
+    topology : md.Topology
+        Topology of the streamed frames (i.e. of `atom_indices`).
+
+    Examples
+    --------
+    >>> stream = TrajectoryStream(filenames, top='prot.pdb', stride=10)
+    >>> assignments, distances = assign_to_nearest_center(
+    ...     stream, centers, md.rmsd)
+    """
+
+    def __init__(self, filenames, top, block_size=10000, stride=1,
+                 atom_indices=None, n_workers=1, prefetch=2):
+
+        if block_size < 1 or prefetch < 1 or n_workers < 0:
+            raise exception.ImproperlyConfigured(
+                "TrajectoryStream needs block_size >= 1, prefetch >= 1 "
+                "and n_workers >= 0 (got %s, %s and %s)." %
+                (block_size, prefetch, n_workers))
+
+        if isinstance(top, str):
+            top = md.load_topology(top)
+        elif isinstance(top, md.Trajectory):
+            top = top.topology
+
+        self.filenames = list(filenames)
+        self.top = top
+        self.block_size = block_size
+        self.stride = stride
+        self.atom_indices = atom_indices
+        self.n_workers = n_workers
+        self.prefetch = prefetch
+
+        self.lengths = sound_trajectories(self.filenames, stride=stride)
+        self.topology = top if atom_indices is None else \
+            top.subset(atom_indices)
+
+    def __len__(self):
+        return sum(self.lengths)
+
+    def __iter__(self):
+        blocks, block, room = [], [], self.block_size
+        for filename, length in zip(self.filenames, self.lengths):
+            start = 0
+            while start < length:
+                n_frames = min(room, length - start)
+                block.append((filename, start, n_frames))
+                start += n_frames
+                room -= n_frames
+                if room == 0:
+                    blocks.append(block)
+                    block, room = [], self.block_size
+        if block:
+            blocks.append(block)
+
+        return self._stream(blocks)
+
+    def trajectories(self):
+        """Stream whole trajectories, one per file, reading ahead as
+        for blocks (so here, memory use is bounded in files).
+        """
+        return self._stream([[(filename, 0, length)] for filename, length
+                             in zip(self.filenames, self.lengths)])
+
+    def _stream(self, blocks):
+        read_args = (self.top, self.stride, self.atom_indices)
+
+        if self.n_workers == 0:
+            for block in blocks:
+                yield self._to_trajectory(_read_stream_block(
+                    block, *read_args))
+            return
+
+        blocks = iter(blocks)
+        with mp.Pool(processes=self.n_workers, initializer=_init_stream,
+                     initargs=read_args) as pool:
+            pending = collections.deque(
+                pool.apply_async(_read_stream_block, (block,))
+                for block in itertools.islice(blocks, self.prefetch))
+
+            while pending:
+                coords = pending.popleft().get()
+
+                # only start reading the next block once one is taken
+                # off the queue, so that at most `prefetch` wait.
+                block = next(blocks, None)
+                if block is not None:
+                    pending.append(
+                        pool.apply_async(_read_stream_block, (block,)))
+
+                yield self._to_trajectory(coords)
+
+    def _to_trajectory(self, coords):
+        xyz, time, unitcell_lengths, unitcell_angles = coords
+        return md.Trajectory(
+            xyz, self.topology, time=time,
+            unitcell_lengths=unitcell_lengths,
+            unitcell_angles=unitcell_angles)
+
+
+def _init_stream(top, stride, atom_indices):
+    global stream_read_args
+    stream_read_args = (top, stride, atom_indices)
+
+
+def _read_stream_block(block, *read_args):
+    """Read the (filename, first frame, n_frames) pieces of a stream
+    block, returning the coordinates, times and unitcells."""
+
+    if not read_args:
+        read_args = stream_read_args
+
+    trj = md.join([read_frames(filename, start, n_frames, *read_args)
+                   for filename, start, n_frames in block],
+                  check_topology=False)
+
+    return (trj.xyz, trj.time, trj.unitcell_lengths,
+            trj.unitcell_angles)
+
+
+def read_frames(filename, start, n_frames, top, stride=1,
+                atom_indices=None):
+    """Read a run of frames from a trajectory file, without reading the
+    frames before it where the format allows. Other formats are read
+    from the start a chunk at a time, so only the frames asked for are
+    held in memory.
+
+    Parameters
+    ----------
+    filename : file path
+        The trajectory to read from.
+    start : int
+        Index of the first frame to read, counted in strided frames.
+    n_frames : int
+        Number of (strided) frames to read.
+    top : md.Topology
+        Topology of the trajectory.
+    stride : int, default=1
+        Read every stride-th frame.
+    atom_indices : array-like, default=None
+        Read only these atoms.
+
+    Returns
+    -------
+    trj : md.Trajectory
+        The n_frames frames starting at `start`.
+    """
+
+    ext = os.path.splitext(filename)[1].lower()
+
+    if ext in _SEEKABLE_FORMATS:
+        offsets = frame_offsets(filename)
+        with md.open(filename) as f:
+            if offsets is not None:
+                f.offsets = offsets
+
+            if offsets is not None and stride > 1:
+                # mdtraj can't stride through files whose offsets were
+                # assigned rather than computed, so read runs of
+                # contiguous frames and stride them in memory. (For
+                # strides longer than a run, each read is one frame.)
+                run = max(1, _READ_CHUNK_FRAMES // stride)
+                trjs = []
+                for first in range(start, start + n_frames, run):
+                    n = min(run, start + n_frames - first)
+                    f.seek(first * stride)
+                    trjs.append(f.read_as_traj(
+                        top, n_frames=(n - 1) * stride + 1,
+                        atom_indices=atom_indices)[::stride])
+                trj = md.join(trjs, check_topology=False)
+            else:
+                f.seek(start * stride)
+                trj = f.read_as_traj(top, n_frames=n_frames, stride=stride,
+                                     atom_indices=atom_indices)
+    elif ext == '.h5':
+        # HDF5 counts n_frames before striding, and has its own topology
+        with md.open(filename) as f:
+            f.seek(start * stride)
+            trj = f.read_as_traj(n_frames=(n_frames - 1) * stride + 1,
+                                 stride=stride, atom_indices=atom_indices)
+    else:
+        # other formats are read from the start, a chunk at a time, so
+        # only the frames asked for are kept in memory.
+        trjs, n_skipped, n_read = [], 0, 0
+        chunks = md.iterload(filename, top=top, chunk=_READ_CHUNK_FRAMES,
+                             stride=stride, atom_indices=atom_indices)
+        for chunk in chunks:
+            skip = min(len(chunk), start - n_skipped)
+            n_skipped += skip
+            chunk = chunk[skip:skip + n_frames - n_read]
+            if len(chunk):
+                trjs.append(chunk)
+                n_read += len(chunk)
+            if n_read == n_frames:
+                break
+        chunks.close()
+
+        trj = md.join(trjs, check_topology=False) if trjs else None
+
+    n_found = 0 if trj is None else len(trj)
+    if n_found != n_frames:
+        raise exception.DataInvalid(
+            "Expected %s frames from %s, starting at frame %s (stride %s), "
+            "but only found %s." %
+            (n_frames, filename, start, stride, n_found))
+
+    return trj
+
+
 def concatenate_trjs(trj_list, atoms=None, n_procs=None):
     """Convert a list of trajectories into a single trajectory building
     a concatenated array in parallel.
@@ -205,6 +850,32 @@ def concatenate_trjs(trj_list, atoms=None, n_procs=None):
 
 
 def shared_array_like_trj(lengths, example_trj):
+    """Allocate memory, shared with forked worker processes, to hold
+    the coordinates of trajectories of the given lengths.
+
+    Where processes are forked (the default on POSIX), the memory is an
+    anonymous shared mapping (MAP_SHARED|MAP_ANONYMOUS), so it lives in
+    RAM rather than in a file under $TMPDIR, and transparent huge pages
+    are requested for it. Numpy arrays made from it with
+    `_tonumpyarray` are views, and the mapping is released as soon as
+    the last of them is garbage collected. Otherwise, it falls back to
+    a file-backed mp.Array.
+
+    Parameters
+    ----------
+    lengths : list of ints
+        The length of each trajectory.
+    example_trj : md.Trajectory
+        A trajectory with the atoms (and coordinate dtype) to allocate
+        space for.
+
+    Returns
+    -------
+    full_shape : tuple, shape=(3,)
+        Shape of the concatenated coordinates.
+    shared_array : mmap.mmap or mp.Array
+        The shared buffer.
+    """
 
     # when we allocate the shared array below, we expect a float32
     # c_double seems to work with trajectories that use float32s. Why?
@@ -217,14 +888,26 @@ def shared_array_like_trj(lengths, example_trj):
     full_shape = (sum(lengths), shape[1], shape[2])
 
     # mp.Arrays are one-dimensional, so multiply the shape together for size
+    dtype = ctypes.c_float
+    arr_bytes = reduce(mul, full_shape, 1) * ctypes.sizeof(dtype)
+
+    if arr_bytes > 0 and mp.get_start_method() == 'fork':
+        try:
+            shared_array = mmap.mmap(-1, arr_bytes)
+        except OSError as e:
+            raise exception.InsufficientResourceError(
+                "Couldn't allocate %.2f GB of shared memory as part of "
+                "loading trajectories in parallel: %s" %
+                (arr_bytes / 1024**3, e))
+        _advise_hugepages(shared_array)
+        return full_shape, shared_array
+
     try:
-        dtype = ctypes.c_float
         shared_array = mp.Array(dtype, reduce(mul, full_shape, 1),
                                 lock=False)
     except OSError as e:
         if e.args[0] != 28:
             raise
-        arr_bytes = reduce(mul, full_shape, 1) * ctypes.sizeof(dtype)
         raise exception.InsufficientResourceError(
             ("Couldn't allocate array of size %.2f GB to %s as part of "
              "loading trajectories in parallel. Check this partition "
@@ -237,6 +920,25 @@ def shared_array_like_trj(lengths, example_trj):
     return full_shape, shared_array
 
 
+def _advise_hugepages(buf):
+    """Ask the kernel to back a (page-aligned) buffer with transparent
+    huge pages. This is only a hint, so failure is ignored."""
+
+    if not sys.platform.startswith('linux'):
+        return
+
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        c_buf = (ctypes.c_char * len(buf)).from_buffer(buf)
+        try:
+            libc.madvise(ctypes.c_void_p(ctypes.addressof(c_buf)),
+                         ctypes.c_size_t(len(buf)), _MADV_HUGEPAGE)
+        finally:
+            del c_buf
+    except (OSError, AttributeError, TypeError) as e:
+        logger.debug("Couldn't request huge pages: %s", e)
+
+
 def _slice_and_insert_xyz(spec, arr_shape, atoms):
     """Slice out atoms and insert xyz of trajectory into larger array.
 
@@ -280,7 +982,8 @@ def _init(shared_array_):
 
 
 def _tonumpyarray(mp_arr, dtype='float32'):
-    # mp_arr.get_obj if Array is locking, otherwise mp_arr.
+    # mp_arr.get_obj if Array is locking, otherwise mp_arr. Works the
+    # same for mmaps.
     return np.frombuffer(mp_arr, dtype=dtype)
 
 
@@ -291,7 +994,12 @@ def _load_to_position(spec, arr_shape):
     '''
     (position, filename, load_kwargs) = spec
 
-    xyz = md.load(filename, **load_kwargs).xyz
+    xyz = None
+    if set(load_kwargs).issubset({'top', 'atom_indices', 'stride'}):
+        xyz = cached_atoms(filename, load_kwargs.get('atom_indices'),
+                           load_kwargs.get('stride', 1))
+    if xyz is None:
+        xyz = md.load(filename, **load_kwargs).xyz
 
     # mp.Array must be converted to numpy array and reshaped
     arr = _tonumpyarray(shared_array).reshape(arr_shape)
@@ -300,3 +1008,23 @@ def _load_to_position(spec, arr_shape):
     arr[position:position+len(xyz)] = xyz
 
     return xyz.shape
+
+
+def _load_range_to_position(spec, arr_shape):
+    '''
+    Load a range of frames of a file into a specified position by spec,
+    reading from the atom cache (see `extract_atoms`) if possible.
+    '''
+    (position, filename, start, stop, top, atom_indices) = spec
+
+    xyz = cached_atoms(filename, atom_indices)
+    if xyz is not None:
+        xyz = xyz[start:stop]
+    else:
+        xyz = read_frames(filename, start, stop - start, top,
+                          atom_indices=atom_indices).xyz
+
+    arr = _tonumpyarray(shared_array).reshape(arr_shape)
+    arr[position:position+len(xyz)] = xyz
+
+    return len(xyz)